@@ -1,23 +1,17 @@
 import os
 from dotenv import load_dotenv
 import google.generativeai as genai
-import json
+from backend.prompts import ConstructorPrompt, normalizar_historial
+from backend.analisis import AnalizadorRiesgo, EstadoConversacion, SeguimientoConversaciones
+from backend.llm import ModeloFalso, ClienteLLM
+from backend.metricas import registro
 
 load_dotenv()
 api_key = os.getenv("GOOGLE_API_KEY")
+# "gemini" (por defecto) o "falso" para trabajar sin conexión
+llm_backend = os.getenv("LLM_BACKEND", "gemini").lower()
 model = None
-
-# --- CONFIGURACION ---
-if api_key:
-    try:
-        genai.configure(api_key=api_key)
-        # Usamos tu modelo disponible
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        print("✅ IA CONECTADA: Backend listo con Gemini 2.5 Flash")
-    except Exception as e:
-        print(f"❌ Error configuración IA: {e}")
-else:
-    print("⚠️ ADVERTENCIA: No se encontró GOOGLE_API_KEY en .env")
+modelo_chat = None
 
 # --- PROTOCOLO (RAG MEJORADO Y HUMANIZADO) ---
 PROTOCOLO_SEGURIDAD = """
@@ -48,58 +42,114 @@ EJEMPLO DE FLUJO IDEAL:
 - Tú: "Lo siento mucho, nadie debería pasar por eso. ¿Puedes decirme quién te está molestando?"
 """
 
+# --- CONFIGURACION ---
+# Los modelos van envueltos en ClienteLLM (backend/llm.py): saludos en caché,
+# peticiones duplicadas agrupadas y un máximo de llamadas simultáneas
+if llm_backend == "falso":
+    falso = ModeloFalso()
+    model = ClienteLLM(falso, nombre="analisis")
+    modelo_chat = ClienteLLM(falso, nombre="chat")
+    print("🧪 IA SIMULADA: LLM_BACKEND=falso (sin llamadas a Gemini)")
+elif api_key:
+    try:
+        genai.configure(api_key=api_key)
+        # Usamos tu modelo disponible
+        model = ClienteLLM(genai.GenerativeModel("gemini-2.5-flash"), nombre="analisis")
+        # El chat lleva el protocolo como instrucción de sistema: parte fija,
+        # no se reenvía dentro del texto de cada turno.
+        modelo_chat = ClienteLLM(genai.GenerativeModel("gemini-2.5-flash", system_instruction=PROTOCOLO_SEGURIDAD),
+                                 nombre="chat")
+        print("✅ IA CONECTADA: Backend listo con Gemini 2.5 Flash")
+    except Exception as e:
+        print(f"❌ Error configuración IA: {e}")
+else:
+    print("⚠️ ADVERTENCIA: No se encontró GOOGLE_API_KEY en .env")
+
+
+def _metricas_clientes():
+    """Contadores de caché y agrupación de los ClienteLLM para /metrics."""
+    for cliente in (model, modelo_chat):
+        if cliente is not None:
+            for dato, valor in cliente.metricas().items():
+                yield "sayit_llm_cliente", {"modelo": cliente.nombre, "dato": dato}, valor
+
+registro.medidor(lambda: list(_metricas_clientes()))
+
+def _contexto_normativa(mensaje):
+    """RAG: fragmentos del protocolo del centro relacionados con el mensaje."""
+    from backend.rag import obtener_contexto_relevante
+    return obtener_contexto_relevante(mensaje)
+
+constructor_prompt = ConstructorPrompt(recuperar_contexto=_contexto_normativa)
+analizador_riesgo = AnalizadorRiesgo(model)
+# Análisis local que avanza con cada mensaje del alumno (ver backend/analisis.py)
+seguimiento = SeguimientoConversaciones()
+
+def _seguir_turno(historial, mensaje_usuario):
+    """Actualiza el estado de la conversación y devuelve la nota para el modelo."""
+    estado, paso_a_grave = seguimiento.actualizar(normalizar_historial(historial), mensaje_usuario)
+    if paso_a_grave:
+        print(f"🚨 Conversación con indicios GRAVES ({', '.join(estado.tipos) or 'sin tipo'}).")
+    if estado.gravedad == "GRAVE":
+        return ("Hay indicios de un caso GRAVE. Muestra calma y apoyo y recuérdale que pulse "
+                "el botón de FINALIZAR para avisar ya a dirección.")
+    if estado.datos["QUÉ"] and estado.faltan:
+        return f"Aún no sabemos: {', '.join(estado.faltan)}. Pregunta con tacto por uno solo."
+    return None
+
+def estado_conversacion(historial):
+    """EstadoConversacion de un chat terminado (al registrar la denuncia)."""
+    return seguimiento.estado(normalizar_historial(historial))
+
 def responder_alumno(historial, mensaje_usuario):
-    if not model:
+    if not modelo_chat:
         return "⚠️ Error: IA no conectada."
 
     try:
-        historial_texto = ""
-        for item in historial:
-            if isinstance(item, (list, tuple)) and len(item) >= 2:
-                human = item[0]
-                ai = item[1]
-                if human and ai:
-                    historial_texto += f"Alumno: {human}\nSay It: {ai}\n"
-
-        prompt_completo = f"""
-        {PROTOCOLO_SEGURIDAD}
-        
-        HISTORIAL PREVIO:
-        {historial_texto}
-        
-        NUEVO MENSAJE DEL ALUMNO:
-        {mensaje_usuario}
-        
-        TU RESPUESTA (Directa y orientada a conseguir los datos):
-        """
-        
-        response = model.generate_content(prompt_completo)
+        # Historial con presupuesto de tokens + normativa relevante + mensaje nuevo
+        nota = _seguir_turno(historial, mensaje_usuario)
+        contenidos = constructor_prompt.construir(historial, mensaje_usuario, nota=nota)
+        response = modelo_chat.generate_content(contenidos)
         return response.text
         
     except Exception as e:
         print(f"🔥 ERROR CHAT: {e}")
         return "Disculpa, he tenido un fallo técnico. ¿Puedes repetirlo?"
 
-def generar_reporte_riesgo(historial_chat):
-    if not model:
-        raise ConnectionError("Sin API Key")
-
-    chat_str = str(historial_chat)
-    prompt_analisis = f"""
-    Actúa como analista. Extrae JSON puro de este chat:
-    {chat_str}
-    
-    JSON ESPERADO:
-    {{
-        "rol_informante": "VÍCTIMA" o "TESTIGO",
-        "tipo_incidente": ["Físico", "Verbal", "Ciber"],
-        "nivel_gravedad": "LEVE", "MODERADO" o "GRAVE",
-        "resumen_hechos": "Resumen en 3 persona (max 30 palabras)",
-        "nombres_involucrados": ["Nombres o Desconocido"]
-    }}
+def responder_alumno_stream(historial, mensaje_usuario):
+    """
+    Igual que responder_alumno pero va entregando el texto según se genera
+    (cada valor es la respuesta acumulada hasta el momento, como espera Gradio).
+    """
+    if not modelo_chat:
+        yield "⚠️ Error: IA no conectada."
+        return
+
+    texto = ""
+    try:
+        nota = _seguir_turno(historial, mensaje_usuario)
+        contenidos = constructor_prompt.construir(historial, mensaje_usuario, nota=nota)
+        for fragmento in modelo_chat.generate_content(contenidos, stream=True):
+            trozo = getattr(fragmento, "text", "")
+            if trozo:
+                texto += trozo
+                yield texto
+        if not texto:
+            yield "Disculpa, no he podido generar una respuesta. ¿Puedes repetirlo?"
+
+    except Exception as e:
+        print(f"🔥 ERROR CHAT: {e}")
+        aviso = "Disculpa, he tenido un fallo técnico. ¿Puedes repetirlo?"
+        # Si ya se había mostrado parte de la respuesta, no se borra
+        yield f"{texto}\n\n{aviso}" if texto else aviso
+
+def generar_reporte_riesgo(historial_chat, estado=None):
+    """
+    Análisis estructurado y validado del chat (ver backend/analisis.py).
+    Nunca falla ni espera más del presupuesto: sin IA, con errores o si el
+    modelo tarda, devuelve la clasificación local. `estado` es el
+    EstadoConversacion (o su dict) acumulado durante el chat.
     """
-    
-    response = model.generate_content(prompt_analisis)
-    texto_limpio = response.text.replace("```json", "").replace("```", 
-"").strip()
-    return json.loads(texto_limpio)
+    if isinstance(estado, dict):
+        estado = EstadoConversacion.desde_dict(estado)
+    return analizador_riesgo.analizar(normalizar_historial(historial_chat), estado)
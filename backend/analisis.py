@@ -0,0 +1,481 @@
+"""
+Análisis de riesgo del chat con salida estructurada y respaldo local.
+
+- El modelo recibe la conversación como transcripción (no el repr de Python)
+  y se le pide JSON con esquema (`response_schema`), que además se valida
+  aquí: valores permitidos, tipos y longitudes.
+- Si la respuesta no es válida se pide una corrección indicando los errores,
+  como mucho REINTENTOS_REPARACION veces.
+- Todo ello dentro de un presupuesto de tiempo (PRESUPUESTO_ANALISIS_SEGUNDOS).
+  Si el modelo no está, falla o tarda, un clasificador local por palabras
+  clave da tipo y gravedad al momento. El resultado siempre es válido y
+  lleva `origen_analisis` ("ia" o "local") para que dirección sepa si
+  conviene revisarlo.
+- Durante el chat, `SeguimientoConversaciones` mantiene un EstadoConversacion
+  por conversación que se actualiza con cada mensaje del alumno (nombres,
+  tipos, gravedad y qué datos del protocolo faltan). Al enviar el informe
+  ese estado ya es el análisis local y orienta al modelo.
+"""
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as TiempoAgotado
+
+try:
+    from google.api_core.exceptions import InvalidArgument
+except ImportError:  # sin el SDK de Google (ModeloFalso)
+    InvalidArgument = TypeError
+
+# Errores con los que el SDK o el modelo rechazan la salida estructurada
+# (argumento desconocido, esquema no admitido). Un timeout, un 429 o un
+# fallo de red no dicen nada del esquema.
+ERRORES_ESQUEMA = (TypeError, InvalidArgument)
+
+PRESUPUESTO_ANALISIS_SEGUNDOS = float(os.getenv("PRESUPUESTO_ANALISIS_SEGUNDOS", "20"))
+REINTENTOS_REPARACION = int(os.getenv("REINTENTOS_REPARACION_ANALISIS", "2"))
+# Llamadas al modelo en vuelo a la vez; las que se abandonan por tiempo siguen
+# ocupando su hilo hasta terminar, así que el pool las limita
+HILOS_ANALISIS = int(os.getenv("HILOS_ANALISIS", "4"))
+
+ROLES_INFORMANTE = ["VÍCTIMA", "TESTIGO"]
+TIPOS_INCIDENTE = ["Físico", "Verbal", "Ciber", "Exclusión", "Otro"]
+NIVELES_GRAVEDAD = ["LEVE", "MODERADO", "GRAVE"]
+MAX_PALABRAS_RESUMEN = 60
+MAX_NOMBRES = 10
+
+ESQUEMA_INFORME = {
+    "type": "object",
+    "properties": {
+        "rol_informante": {"type": "string", "format": "enum", "enum": ROLES_INFORMANTE},
+        "tipo_incidente": {"type": "array",
+                           "items": {"type": "string", "format": "enum", "enum": TIPOS_INCIDENTE}},
+        "nivel_gravedad": {"type": "string", "format": "enum", "enum": NIVELES_GRAVEDAD},
+        "resumen_hechos": {"type": "string"},
+        "nombres_involucrados": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["rol_informante", "tipo_incidente", "nivel_gravedad", "resumen_hechos",
+                 "nombres_involucrados"],
+}
+
+_pool = ThreadPoolExecutor(max_workers=HILOS_ANALISIS, thread_name_prefix="analisis-ia")
+
+
+# --- VALIDACIÓN ---
+
+def _clave(texto):
+    """Minúsculas y sin tildes (la ñ queda como n)."""
+    descompuesto = unicodedata.normalize("NFD", str(texto).strip().lower())
+    return "".join(c for c in descompuesto if unicodedata.category(c) != "Mn")
+
+
+def _canonico(valor, permitidos):
+    """El valor permitido que coincide sin mayúsculas ni tildes, o None."""
+    clave = _clave(valor)
+    for permitido in permitidos:
+        if _clave(permitido) == clave:
+            return permitido
+    return None
+
+
+def validar_informe(datos):
+    """
+    Comprueba y normaliza un análisis. Devuelve (datos_limpios, errores);
+    con errores, datos_limpios es None.
+    """
+    if not isinstance(datos, dict):
+        return None, ["La respuesta debe ser un objeto JSON."]
+    errores = []
+    limpio = {}
+
+    rol = _canonico(datos.get("rol_informante", ""), ROLES_INFORMANTE)
+    if rol is None:
+        errores.append(f"rol_informante debe ser uno de {ROLES_INFORMANTE}.")
+    limpio["rol_informante"] = rol
+
+    tipos = datos.get("tipo_incidente")
+    if isinstance(tipos, str):
+        tipos = [tipos]
+    if not isinstance(tipos, list) or not tipos:
+        errores.append(f"tipo_incidente debe ser una lista no vacía con valores de {TIPOS_INCIDENTE}.")
+        tipos = []
+    canonicos = [_canonico(t, TIPOS_INCIDENTE) for t in tipos]
+    if any(c is None for c in canonicos):
+        errores.append(f"tipo_incidente solo admite {TIPOS_INCIDENTE}.")
+    limpio["tipo_incidente"] = list(dict.fromkeys(c for c in canonicos if c))
+
+    gravedad = _canonico(datos.get("nivel_gravedad", ""), NIVELES_GRAVEDAD)
+    if gravedad is None:
+        errores.append(f"nivel_gravedad debe ser uno de {NIVELES_GRAVEDAD}.")
+    limpio["nivel_gravedad"] = gravedad
+
+    resumen = datos.get("resumen_hechos")
+    if not isinstance(resumen, str) or not resumen.strip():
+        errores.append("resumen_hechos debe ser un texto no vacío.")
+    elif len(resumen.split()) > MAX_PALABRAS_RESUMEN:
+        errores.append(f"resumen_hechos no puede pasar de {MAX_PALABRAS_RESUMEN} palabras.")
+    limpio["resumen_hechos"] = resumen.strip() if isinstance(resumen, str) else ""
+
+    nombres = datos.get("nombres_involucrados", [])
+    if isinstance(nombres, str):
+        nombres = [nombres]
+    if not isinstance(nombres, list) or not all(isinstance(n, str) for n in nombres):
+        errores.append("nombres_involucrados debe ser una lista de textos.")
+        nombres = []
+    limpio["nombres_involucrados"] = [n.strip() for n in nombres if n.strip()][:MAX_NOMBRES] or ["Desconocido"]
+
+    return (None, errores) if errores else (limpio, [])
+
+
+def extraer_json(texto):
+    """Primer objeto JSON del texto, aunque venga entre ```json ... ``` o con comentarios."""
+    inicio = texto.find("{")
+    if inicio < 0:
+        raise ValueError("La respuesta no contiene un objeto JSON.")
+    datos, _ = json.JSONDecoder().raw_decode(texto[inicio:])
+    return datos
+
+
+# --- CLASIFICADOR LOCAL ---
+
+# Raíces (sin tildes ni ñ), que deben empezar palabra -> tipo de incidente
+PALABRAS_TIPO = {
+    "Físico": ["peg", "golpe", "empuj", "patad", "punetaz", "tortaz", "collej",
+               "agred", "agresi", "zancadill", "escupi", "tiran del pelo", "me tiro", "rompi"],
+    "Verbal": ["insult", "mote", "me llaman", "burl", "se rien", "humill", "amenaz", "grita",
+               "gorda", "gordo", "feo", "fea", "tonto", "tonta", "subnormal"],
+    "Ciber": ["whatsapp", "instagram", "tiktok", "redes sociales", "foto", "video", "movil",
+              "internet", "me escriben", "story", "stories", "captura", "online"],
+    "Exclusión": ["exclu", "aparta", "nadie me habla", "no me dejan", "me ignoran", "ignoran",
+                  "solo en el recreo", "sola en el recreo", "no me hablan"],
+}
+# Cualquiera de estas hace el caso GRAVE
+PALABRAS_GRAVE = ["cuchill", "navaja", "un arma", "armas", "sangr", "hospital", "suicid", "matar", "morir",
+                  "muerte", "desaparecer", "hacerme dano", "cortarme", "autolesi", "no quiero vivir",
+                  "abus", "tocamient", "me obligan"]
+# Indican reiteración o intimidación: al menos MODERADO
+PALABRAS_MODERADO = ["todos los dias", "cada dia", "siempre", "desde hace", "amenaz", "miedo",
+                     "no quiero ir", "quitan", "roban", "dinero"]
+PALABRAS_TESTIGO = ["he visto", "vi como", "vi que", "a mi amigo", "a mi amiga", "a un companero",
+                    "a una companera", "a otro", "a otra", "le pegan", "le insultan", "se meten con el",
+                    "se meten con ella"]
+
+_PALABRA_NOMBRE = re.compile(r"\b([A-ZÁÉÍÓÚÑ][a-záéíóúñ]{2,})(?:\s+([A-ZÁÉÍÓÚÑ][a-záéíóúñ]{2,}))?")
+_NO_NOMBRES = {"hola", "buenas", "que", "como", "cuando", "donde", "pero", "porque", "ayer", "hoy",
+               "luego", "despues", "entonces", "tambien", "siempre", "nadie", "gracias", "vale",
+               "profe", "profesor", "profesora", "instagram", "whatsapp", "tiktok", "say", "lunes",
+               "martes", "miercoles", "jueves", "viernes", "sabado", "domingo", "ellos", "ellas"}
+
+
+def _contiene(texto, raices):
+    # Al inicio de palabra: "peg" no debe casar con "despego" ni "feo" con "trofeo"
+    return any(re.search(r"\b" + re.escape(r), texto) for r in raices)
+
+
+# Pistas de los datos que pide el protocolo (QUÉ lo da el propio tipo de incidente)
+PALABRAS_QUIEN = ["un chico", "una chica", "unos chicos", "unas chicas", "los de", "las de", "companer",
+                  "el de", "la de", "mi clase", "otro curso", "mayores", "profe", "grupo de"]
+PALABRAS_CUANDO = ["ayer", "hoy", "anoche", "esta manana", "esta tarde", "el otro dia", "hace ", "semana",
+                   "lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo", "todos los dias",
+                   "cada dia", "siempre", "desde hace", "a la salida", "a la entrada", "en el recreo", "mes"]
+PALABRAS_DONDE = ["patio", "recreo", "clase", "aula", "pasillo", "bano", "servicio", "vestuario", "comedor",
+                  "gimnasio", "autobus", "ruta", "salida", "entrada", "calle", "parque", "biblioteca",
+                  "escalera", "instituto", "colegio", "whatsapp", "instagram", "tiktok", "grupo", "redes"]
+DATOS_PROTOCOLO = ("QUÉ", "QUIÉN", "CUÁNDO", "DÓNDE")
+NIVEL = {g: n for n, g in enumerate(NIVELES_GRAVEDAD)}
+PALABRAS_RESUMEN_LOCAL = 40
+
+
+def _nombres(mensaje):
+    nombres = []
+    for frase in re.split(r"[.!?¿¡\n]+", mensaje):
+        palabras = frase.strip().split(" ", 1)
+        resto = palabras[1] if len(palabras) > 1 else ""  # la 1ª palabra siempre va en mayúscula
+        for nombre, apellido in _PALABRA_NOMBRE.findall(resto):
+            if _clave(nombre) not in _NO_NOMBRES:
+                nombres.append(f"{nombre} {apellido}".strip())
+    return nombres
+
+
+class EstadoConversacion:
+    """
+    Lo que se sabe del incidente hasta el último mensaje del alumno.
+    `actualizar(mensaje)` solo mira el mensaje nuevo, así que mantenerlo al
+    día turno a turno cuesta lo mismo con 2 que con 50 mensajes.
+    """
+
+    def __init__(self):
+        self.mensajes = 0
+        self.tipos = []
+        self.gravedad = "LEVE"
+        self.testigo = False
+        self.nombres = []
+        self.datos = dict.fromkeys(DATOS_PROTOCOLO, False)
+        self.relato = []   # primeras palabras de los mensajes con contenido
+        self.cortos = []   # por si solo hay mensajes muy cortos
+
+    def actualizar(self, mensaje):
+        """Incorpora un mensaje del alumno. Devuelve True si el caso acaba de pasar a GRAVE."""
+        antes = self.gravedad
+        texto = _clave(mensaje)
+        self.mensajes += 1
+
+        for tipo, raices in PALABRAS_TIPO.items():
+            if tipo not in self.tipos and _contiene(texto, raices):
+                self.tipos.append(tipo)
+        if _contiene(texto, PALABRAS_GRAVE):
+            nivel = "GRAVE"
+        elif "Físico" in self.tipos or _contiene(texto, PALABRAS_MODERADO):
+            nivel = "MODERADO"
+        else:
+            nivel = "LEVE"
+        if NIVEL[nivel] > NIVEL[self.gravedad]:
+            self.gravedad = nivel
+        self.testigo = self.testigo or _contiene(texto, PALABRAS_TESTIGO)
+
+        nuevos = [n for n in _nombres(mensaje) if n not in self.nombres]
+        self.nombres = (self.nombres + nuevos)[:MAX_NOMBRES]
+        self.datos["QUÉ"] = bool(self.tipos)
+        self.datos["QUIÉN"] = bool(self.nombres) or self.datos["QUIÉN"] or _contiene(texto, PALABRAS_QUIEN)
+        self.datos["CUÁNDO"] = self.datos["CUÁNDO"] or _contiene(texto, PALABRAS_CUANDO)
+        self.datos["DÓNDE"] = self.datos["DÓNDE"] or _contiene(texto, PALABRAS_DONDE)
+
+        palabras = mensaje.split()
+        destino = self.relato if len(palabras) >= 3 else self.cortos
+        if len(destino) <= PALABRAS_RESUMEN_LOCAL:
+            destino.extend(palabras[:PALABRAS_RESUMEN_LOCAL + 1 - len(destino)])
+        return antes != "GRAVE" and self.gravedad == "GRAVE"
+
+    @property
+    def faltan(self):
+        return [dato for dato, conocido in self.datos.items() if not conocido]
+
+    def como_informe(self):
+        """El análisis local (mismo formato que el de la IA)."""
+        palabras = self.relato or self.cortos
+        resumen = " ".join(palabras[:PALABRAS_RESUMEN_LOCAL]) + ("…" if len(palabras) > PALABRAS_RESUMEN_LOCAL else "")
+        return {
+            "rol_informante": "TESTIGO" if self.testigo else "VÍCTIMA",
+            "tipo_incidente": list(self.tipos) or ["Otro"],
+            "nivel_gravedad": self.gravedad,
+            "resumen_hechos": f"El alumno relata: \"{resumen}\"" if resumen else "Sin relato en el chat.",
+            "nombres_involucrados": list(self.nombres) or ["Desconocido"],
+        }
+
+    def a_dict(self):
+        """Forma serializable (carga del trabajo de análisis)."""
+        return {"mensajes": self.mensajes, "tipos": self.tipos, "gravedad": self.gravedad,
+                "testigo": self.testigo, "nombres": self.nombres, "datos": self.datos,
+                "relato": self.relato, "cortos": self.cortos}
+
+    @classmethod
+    def desde_dict(cls, datos):
+        estado = cls()
+        for atributo, valor in (datos or {}).items():
+            if hasattr(estado, atributo):
+                setattr(estado, atributo, valor)
+        return estado
+
+
+def clasificar_localmente(turnos):
+    """
+    Clasificación por palabras clave de los mensajes del alumno, sin red y
+    en microsegundos. `turnos` es [(alumno, say_it), ...].
+    """
+    estado = EstadoConversacion()
+    for humano, _ in turnos:
+        if humano:
+            estado.actualizar(humano)
+    return estado.como_informe()
+
+
+class SeguimientoConversaciones:
+    """
+    Estados de las conversaciones en curso, para no rehacer el análisis
+    desde cero en cada turno. Gradio reenvía el historial completo, así que
+    la clave es un HMAC de los mensajes del alumno: el estado guardado tras
+    el turno N es el que se encuentra al llegar el turno N+1. Si no está
+    (reinicio, caducado), se reconstruye repasando el historial en local.
+    """
+
+    def __init__(self, entradas=2000, ttl_segundos=6 * 3600):
+        self.entradas = entradas
+        self.ttl_segundos = ttl_segundos
+        self._estados = OrderedDict()  # clave -> (caduca, EstadoConversacion)
+        self._cerrojo = threading.Lock()
+        self._secreto = secrets.token_bytes(32)
+
+    def _clave(self, mensajes):
+        material = "\x1e".join(mensajes).encode("utf-8")
+        return hmac.new(self._secreto, material, hashlib.sha256).hexdigest()
+
+    def _guardar(self, clave, estado):
+        self._estados[clave] = (time.monotonic() + self.ttl_segundos, estado)
+        self._estados.move_to_end(clave)
+        while len(self._estados) > self.entradas:
+            self._estados.popitem(last=False)
+
+    def _sacar(self, clave):
+        """Quita y devuelve el estado (cada conversación avanza por un solo camino)."""
+        entrada = self._estados.pop(clave, None)
+        if entrada is None or entrada[0] < time.monotonic():
+            return None
+        return entrada[1]
+
+    def _reconstruir(self, mensajes):
+        estado = EstadoConversacion()
+        for mensaje in mensajes:
+            estado.actualizar(mensaje)
+        return estado
+
+    def actualizar(self, turnos, mensaje):
+        """
+        Estado tras añadir `mensaje` a la conversación `turnos`
+        ([(alumno, say_it), ...]). Devuelve (estado, paso_a_grave).
+        """
+        previos = [humano for humano, _ in turnos if humano]
+        with self._cerrojo:
+            estado = self._sacar(self._clave(previos))
+        if estado is None:
+            estado = self._reconstruir(previos)
+        paso_a_grave = estado.actualizar(mensaje)
+        with self._cerrojo:
+            self._guardar(self._clave(previos + [mensaje]), estado)
+        return estado, paso_a_grave
+
+    def estado(self, turnos):
+        """Estado de una conversación terminada (al enviar el informe)."""
+        mensajes = [humano for humano, _ in turnos if humano]
+        with self._cerrojo:
+            entrada = self._estados.get(self._clave(mensajes))
+        if entrada is not None and entrada[0] >= time.monotonic():
+            return entrada[1]
+        return self._reconstruir(mensajes)
+
+
+# --- ANÁLISIS CON EL MODELO ---
+
+def transcribir(turnos):
+    return "\n".join(f"ALUMNO: {humano}\nSAY IT: {ia}" for humano, ia in turnos)
+
+
+def _pistas(estado):
+    """Lo detectado turno a turno, para que el modelo solo lo confirme o corrija."""
+    if estado is None:
+        return ""
+    local = estado.como_informe()
+    return f"""
+    DETECTADO DURANTE EL CHAT (confírmalo o corrígelo):
+    tipos {local['tipo_incidente']}, gravedad {local['nivel_gravedad']},
+    nombres {local['nombres_involucrados']}, sin mencionar: {estado.faltan or 'nada'}
+"""
+
+
+def _prompt_analisis(transcripcion, estado=None):
+    return f"""
+    Actúa como analista de convivencia escolar. Analiza esta conversación entre
+    un alumno y el asistente y devuelve SOLO un objeto JSON.
+
+    CONVERSACIÓN:
+    {transcripcion}
+    {_pistas(estado)}
+
+    JSON ESPERADO:
+    {{
+        "rol_informante": "VÍCTIMA" o "TESTIGO",
+        "tipo_incidente": lista con valores de {TIPOS_INCIDENTE},
+        "nivel_gravedad": "LEVE", "MODERADO" o "GRAVE",
+        "resumen_hechos": "Resumen en 3ª persona (máx. 30 palabras)",
+        "nombres_involucrados": ["Nombres o Desconocido"]
+    }}
+    """
+
+
+def _prompt_reparacion(prompt, respuesta, errores):
+    return (f"{prompt}\n\nTu respuesta anterior no es válida:\n{respuesta[:2000]}\n\n"
+            f"Errores:\n- " + "\n- ".join(errores) +
+            "\n\nDevuelve de nuevo SOLO el objeto JSON corregido.")
+
+
+class AnalizadorRiesgo:
+    """
+    `analizar(turnos, estado)` -> dict válido, siempre y dentro del presupuesto.
+    `modelo` es un GenerativeModel (o ModeloFalso); None = solo local.
+    """
+
+    def __init__(self, modelo, presupuesto_segundos=PRESUPUESTO_ANALISIS_SEGUNDOS,
+                 reintentos=REINTENTOS_REPARACION):
+        self.modelo = modelo
+        self.presupuesto_segundos = presupuesto_segundos
+        self.reintentos = reintentos
+        self.con_esquema = True
+        self.resultados = {"ia": 0, "local": 0}
+
+    def _generar(self, prompt):
+        if not self.con_esquema:
+            return self.modelo.generate_content(prompt).text
+        try:
+            return self.modelo.generate_content(prompt, generation_config={
+                "response_mime_type": "application/json",
+                "response_schema": ESQUEMA_INFORME,
+            }).text
+        except ERRORES_ESQUEMA as e:
+            # SDK o modelo sin salida estructurada: se deja de usar y se pide el JSON en el prompt.
+            # Cualquier otro error sube tal cual y la próxima petición vuelve a usar el esquema.
+            print(f"⚠️ Salida estructurada no disponible ({e}); se pide JSON en el prompt.")
+            self.con_esquema = False
+            return self.modelo.generate_content(prompt).text
+
+    def _con_modelo(self, turnos, limite, estado=None):
+        prompt = _prompt_analisis(transcribir(turnos), estado)
+        peticion = prompt
+        for intento in range(self.reintentos + 1):
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                raise TiempoAgotado()
+            respuesta = _pool.submit(self._generar, peticion).result(timeout=restante)
+            try:
+                datos, errores = validar_informe(extraer_json(respuesta))
+            except ValueError as e:  # incluye JSONDecodeError
+                datos, errores = None, [f"JSON ilegible: {e}"]
+            if datos:
+                return datos
+            print(f"🔧 Análisis IA inválido (intento {intento + 1}): {'; '.join(errores)}")
+            peticion = _prompt_reparacion(prompt, respuesta, errores)
+        raise ValueError("El modelo no devolvió un análisis válido")
+
+    def analizar(self, turnos, estado=None):
+        """
+        `estado` es el EstadoConversacion llevado durante el chat: si está al
+        día, el análisis local ya está hecho y solo queda cerrarlo.
+        """
+        mensajes = [humano for humano, _ in turnos if humano]
+        if estado is None or estado.mensajes != len(mensajes):
+            estado = EstadoConversacion()
+            for mensaje in mensajes:
+                estado.actualizar(mensaje)
+
+        datos = None
+        if self.modelo is not None and turnos:
+            limite = time.monotonic() + self.presupuesto_segundos
+            try:
+                datos = self._con_modelo(turnos, limite, estado)
+                datos["origen_analisis"] = "ia"
+                self.resultados["ia"] += 1
+            except TiempoAgotado:
+                print(f"⏱️ Análisis IA fuera de presupuesto ({self.presupuesto_segundos}s): clasificación local.")
+            except Exception as e:
+                print(f"⚠️ Análisis IA no disponible ({e}): clasificación local.")
+        if datos is None:
+            datos = estado.como_informe()
+            datos["origen_analisis"] = "local"
+            self.resultados["local"] += 1
+        # Lo que el alumno no llegó a contar: dirección sabe qué preguntar
+        datos["datos_pendientes"] = estado.faltan
+        return datos
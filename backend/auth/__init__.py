@@ -1,36 +1,40 @@
-from werkzeug.security import check_password_hash
-from backend.models import Alumno, Director, Profesor, Tutor
+"""backend module"""
+from backend.models import db
+from backend.auth.identidades import ROLES, buscar_identidades
+from backend.security.contrasenas import generar_hash_en_pool, verificar_en_pool, verificar_senuelo
 
 def autenticar_usuario(email, password):
     """
-    Busca al usuario en todas las tablas (Alumno, Director, Tutor, Profesor).
-    Verifica la contraseña contra el campo 'password_hash'.
+    Busca al usuario en el índice de identidades (una consulta indexada por
+    email que cubre Alumno, Director, Tutor y Profesor).
+    Verifica la contraseña contra el campo 'password_hash' en el pool de
+    verificación acotado y, si el hash está desfasado, lo actualiza.
     """
-    
-    # 1. Buscar en ALUMNOS
-    alumno = Alumno.query.filter_by(email_alumno=email).first()
-    if alumno:
-        # Nota: En producción usaríamos check_password_hash. 
-        # Para la demo, comparamos texto plano porque reset_db.py guardó "1234" tal cual.
-        if alumno.password_hash == password:
-            return "alumno", alumno.nombre_alumno
-    
-    # 2. Buscar en DIRECTORES
-    director = Director.query.filter_by(email_director=email).first()
-    if director:
-        if director.password_hash == password:
-            return "director", director.nombre_director
+    identidades = buscar_identidades(email)
+    if not identidades:
+        verificar_senuelo(password).result()
+        return "error", None
 
-    # 3. Buscar en TUTORES
-    tutor = Tutor.query.filter_by(email_tutor=email).first()
-    if tutor:
-        if tutor.password_hash == password:
-            return "tutor", tutor.nombre_tutor
-            
-    # 4. Buscar en PROFESORES
-    profesor = Profesor.query.filter_by(email_profesor=email).first()
-    if profesor:
-        if profesor.password_hash == password:
-            return "profesor", profesor.nombre_profesor
+    for identidad in identidades:
+        correcta, necesita_rehash = verificar_en_pool(identidad.password_hash, password).result()
+        if correcta:
+            # Se leen antes: al actualizar el hash se regenera la fila de identidad
+            rol, nombre = identidad.rol, identidad.nombre
+            if necesita_rehash:
+                _actualizar_hash(identidad, password)
+            return rol, nombre
 
-    return "error", None
\ No newline at end of file
+    return "error", None
+
+def _actualizar_hash(identidad, password):
+    """Guarda la contraseña con el método/coste actual (el índice se sincroniza solo)."""
+    modelo = ROLES[identidad.rol][0]
+    usuario = db.session.get(modelo, identidad.id_usuario)
+    if usuario is None:
+        return
+    try:
+        usuario.password_hash = generar_hash_en_pool(password).result()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ No se pudo actualizar el hash de {identidad.rol} #{identidad.id_usuario}: {e}")
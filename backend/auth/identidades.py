@@ -0,0 +1,98 @@
+"""
+Sincronización del índice de identidades (tabla `identidades`).
+
+Cada alta, cambio o baja en Alumno, Director, Tutor o Profesor se refleja
+en la misma transacción en `identidades`, así el login hace una única
+búsqueda por email indexado. `rellenar_indice_identidades` reconstruye el
+índice desde las tablas de rol (migración inicial o tras cargas masivas que
+no pasan por el ORM).
+"""
+from sqlalchemy import delete, event, func, insert, literal, select
+
+from backend.models import db, Alumno, Director, Identidad, Profesor, Tutor
+
+# rol -> (modelo, columna id, columna email, columna nombre). El orden es la
+# prioridad si un mismo email existe en varios roles (igual que el login antiguo).
+ROLES = {
+    "alumno": (Alumno, "id_alumno", "email_alumno", "nombre_alumno"),
+    "director": (Director, "id_director", "email_director", "nombre_director"),
+    "tutor": (Tutor, "id_tutor", "email_tutor", "nombre_tutor"),
+    "profesor": (Profesor, "id_profesor", "email_profesor", "nombre_profesor"),
+}
+PRIORIDAD_ROL = {rol: n for n, rol in enumerate(ROLES)}
+
+
+def normalizar_email(email):
+    return (email or "").strip().lower()
+
+
+def buscar_identidades(email):
+    """Todas las identidades de un email (normalmente una), por prioridad de rol."""
+    filas = Identidad.query.filter_by(email=normalizar_email(email)).all()
+    return sorted(filas, key=lambda i: PRIORIDAD_ROL.get(i.rol, len(PRIORIDAD_ROL)))
+
+
+def _sincronizar(rol, columna_id, columna_email, columna_nombre):
+    def al_guardar(mapper, connection, objeto):
+        id_usuario = getattr(objeto, columna_id)
+        connection.execute(delete(Identidad.__table__).where(
+            Identidad.rol == rol, Identidad.id_usuario == id_usuario))
+        email = normalizar_email(getattr(objeto, columna_email))
+        if email:
+            connection.execute(insert(Identidad.__table__).values(
+                email=email, rol=rol, id_usuario=id_usuario,
+                nombre=getattr(objeto, columna_nombre),
+                password_hash=objeto.password_hash,
+            ))
+
+    def al_borrar(mapper, connection, objeto):
+        connection.execute(delete(Identidad.__table__).where(
+            Identidad.rol == rol, Identidad.id_usuario == getattr(objeto, columna_id)))
+
+    return al_guardar, al_borrar
+
+
+for _rol, (_modelo, *_columnas) in ROLES.items():
+    _al_guardar, _al_borrar = _sincronizar(_rol, *_columnas)
+    event.listen(_modelo, "after_insert", _al_guardar)
+    event.listen(_modelo, "after_update", _al_guardar)
+    event.listen(_modelo, "after_delete", _al_borrar)
+
+
+def rellenar_indice_identidades(conexion=None):
+    """
+    Crea la tabla si falta y la reconstruye con INSERT ... SELECT desde cada
+    tabla de rol (sin cargar filas en Python). Con `conexion` se hace dentro
+    de esa transacción (migraciones); si no, en una propia.
+    Devuelve cuántas identidades hay.
+    """
+    if conexion is None:
+        with db.engine.begin() as conexion:
+            return rellenar_indice_identidades(conexion)
+
+    tabla = Identidad.__table__
+    tabla.create(conexion, checkfirst=True)
+    conexion.execute(delete(tabla))
+    for rol, (modelo, columna_id, columna_email, columna_nombre) in ROLES.items():
+        email = getattr(modelo, columna_email)
+        origen = select(
+            func.lower(func.trim(email)),
+            literal(rol),
+            getattr(modelo, columna_id),
+            getattr(modelo, columna_nombre),
+            modelo.password_hash,
+        ).where(email.is_not(None), func.trim(email) != "")
+        conexion.execute(
+            insert(tabla).from_select(
+                ["email", "rol", "id_usuario", "nombre", "password_hash"], origen)
+        )
+    return conexion.execute(select(func.count()).select_from(tabla)).scalar()
+
+
+def asegurar_indice_identidades():
+    """Al arrancar: si el índice no existe o está vacío, se rellena."""
+    Identidad.__table__.create(db.engine, checkfirst=True)
+    if db.session.query(Identidad.id_identidad).first() is None:
+        total = rellenar_indice_identidades()
+        print(f"🔑 Índice de identidades creado: {total} usuarios.")
+
@@ -0,0 +1,220 @@
+"""
+Cola de trabajos persistente sobre la base de datos de la app (tabla `trabajos`).
+
+- Los trabajos sobreviven a reinicios: si un worker muere a mitad, el trabajo
+  queda "en_curso" con un lease que caduca y otro worker lo recoge.
+- Cada tipo de trabajo tiene un manejador registrado con `registrar`.
+- Si el manejador falla, se reintenta con espera exponencial hasta
+  `max_intentos`; después queda "fallido" con el último error.
+- El número de hilos es fijo: una avalancha de informes se encola, no
+  multiplica el trabajo simultáneo.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, or_, select, update
+
+from backend.models import db, Trabajo
+from backend.metricas import con_id_peticion, id_peticion_actual, observar, registrar_evento
+
+ESPERA_BASE_SEGUNDOS = 5
+ESPERA_MAXIMA_SEGUNDOS = 600
+LEASE_SEGUNDOS = 300
+INTERVALO_SONDEO = 1.0
+TAMANO_LOTE_PURGA = 500
+
+
+def consultas_siguiente_trabajo(ahora, limite=1):
+    """
+    Candidatos a reclamar: pendientes ya vencidos y en curso con el lease
+    caducado. Son dos consultas y no un OR: cada una recorre
+    ix_trabajos_estado_disponible ya en orden, y con el OR SQLite combina
+    índices y ordena en memoria. backend/migraciones.py comprueba sus planes.
+    """
+    columnas = (Trabajo.id_trabajo, Trabajo.disponible_en)
+    orden = (Trabajo.disponible_en, Trabajo.id_trabajo)
+    return [
+        select(*columnas).where(Trabajo.estado == "pendiente", Trabajo.disponible_en <= ahora)
+        .order_by(*orden).limit(limite),
+        select(*columnas).where(Trabajo.estado == "en_curso", Trabajo.bloqueado_hasta < ahora)
+        .order_by(*orden).limit(limite),
+    ]
+
+
+def purgar_trabajos(antes_de):
+    """Borra (por lotes) los trabajos hechos o fallidos sin cambios desde `antes_de`. Devuelve cuántos."""
+    terminados = and_(Trabajo.estado.in_(("hecho", "fallido")), Trabajo.actualizado < antes_de)
+    borrados = 0
+    while True:
+        ids = db.session.execute(
+            select(Trabajo.id_trabajo).where(terminados).limit(TAMANO_LOTE_PURGA)).scalars().all()
+        if not ids:
+            return borrados
+        db.session.execute(delete(Trabajo).where(Trabajo.id_trabajo.in_(ids)))
+        db.session.commit()
+        borrados += len(ids)
+
+
+class ColaTrabajos:
+
+    def __init__(self, app, espera_base=ESPERA_BASE_SEGUNDOS, lease=LEASE_SEGUNDOS):
+        self.app = app
+        self.espera_base = espera_base
+        self.lease = lease
+        self.manejadores = {}
+        self.al_fallar = {}
+        self._hilos = []
+        self._parar = threading.Event()
+        self._aviso = threading.Event()
+
+    # --- API ---
+
+    def registrar(self, tipo, funcion, al_fallar=None):
+        """
+        `funcion(trabajo, carga)` ejecuta la etapa; `al_fallar(trabajo, error)`
+        se llama una sola vez cuando se agotan los reintentos.
+        """
+        self.manejadores[tipo] = funcion
+        if al_fallar:
+            self.al_fallar[tipo] = al_fallar
+
+    def encolar(self, tipo, id_informe=None, carga=None, retraso=0, max_intentos=5, commit=True):
+        """
+        Añade un trabajo. Con `commit=False` se queda en la sesión actual, para
+        guardarlo en la misma transacción que el informe que lo origina.
+        El id de petición en curso viaja en la carga hasta el worker.
+        """
+        carga = dict(carga or {})
+        if id_peticion_actual() and "id_peticion" not in carga:
+            carga["id_peticion"] = id_peticion_actual()
+        trabajo = Trabajo(
+            tipo=tipo,
+            id_informe=id_informe,
+            carga=json.dumps(carga, ensure_ascii=False),
+            estado="pendiente",
+            intentos=0,
+            max_intentos=max_intentos,
+            disponible_en=datetime.utcnow() + timedelta(seconds=retraso),
+        )
+        db.session.add(trabajo)
+        if commit:
+            db.session.commit()
+        self._aviso.set()
+        return trabajo
+
+    def iniciar(self, hilos=2):
+        """Arranca los workers en segundo plano (hilos daemon)."""
+        self._parar.clear()
+        for n in range(hilos):
+            hilo = threading.Thread(target=self._bucle, name=f"cola-informes-{n}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+        print(f"⚙️  Cola de informes: {hilos} workers en marcha.")
+
+    def detener(self, timeout=5):
+        self._parar.set()
+        self._aviso.set()
+        for hilo in self._hilos:
+            hilo.join(timeout)
+        self._hilos = []
+
+    def procesar_pendientes(self, limite=None):
+        """Ejecuta en este hilo los trabajos disponibles (scripts, pruebas). Devuelve cuántos."""
+        hechos = 0
+        while limite is None or hechos < limite:
+            with self.app.app_context():
+                if not self._ejecutar_siguiente():
+                    break
+            hechos += 1
+        return hechos
+
+    # --- internos ---
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                with self.app.app_context():
+                    hubo_trabajo = self._ejecutar_siguiente()
+            except Exception as e:
+                print(f"🔥 ERROR COLA: {e}")
+                hubo_trabajo = False
+            if not hubo_trabajo:
+                self._aviso.wait(INTERVALO_SONDEO)
+                self._aviso.clear()
+
+    def _disponible(self, ahora):
+        # Pendiente ya vencido, o en curso con el lease caducado (worker caído)
+        return or_(
+            and_(Trabajo.estado == "pendiente", Trabajo.disponible_en <= ahora),
+            and_(Trabajo.estado == "en_curso", Trabajo.bloqueado_hasta < ahora),
+        )
+
+    def _reclamar(self):
+        """Marca atómicamente el siguiente trabajo como "en_curso" para este worker."""
+        while True:
+            ahora = datetime.utcnow()
+            candidatos = [fila for consulta in consultas_siguiente_trabajo(ahora)
+                          for fila in db.session.execute(consulta).all()]
+            if not candidatos:
+                db.session.rollback()
+                return None
+            candidato = min(candidatos, key=lambda f: (f.disponible_en, f.id_trabajo)).id_trabajo
+            # Si otro worker se adelantó, el UPDATE no toca ninguna fila y se prueba otro
+            resultado = db.session.execute(
+                update(Trabajo)
+                .where(Trabajo.id_trabajo == candidato, self._disponible(ahora))
+                .values(estado="en_curso", intentos=Trabajo.intentos + 1,
+                        bloqueado_hasta=ahora + timedelta(seconds=self.lease))
+            )
+            db.session.commit()
+            if resultado.rowcount == 1:
+                return db.session.get(Trabajo, candidato)
+
+    def _ejecutar_siguiente(self):
+        trabajo = self._reclamar()
+        if trabajo is None:
+            return False
+
+        carga = json.loads(trabajo.carga or "{}")
+        with con_id_peticion(carga.get("id_peticion") or f"trabajo-{trabajo.id_trabajo}"):
+            inicio = time.perf_counter()
+            resultado = self._ejecutar(trabajo, carga)
+            segundos = time.perf_counter() - inicio
+            observar("sayit_trabajo_duracion_segundos", segundos, tipo=trabajo.tipo, resultado=resultado)
+            registrar_evento("trabajo", id_trabajo=trabajo.id_trabajo, tipo=trabajo.tipo,
+                             id_informe=trabajo.id_informe, intento=trabajo.intentos,
+                             resultado=resultado, duracion_ms=round(segundos * 1000, 1))
+        return True
+
+    def _ejecutar(self, trabajo, carga):
+        """Ejecuta el manejador y deja el trabajo hecho, pendiente o fallido. Devuelve cuál."""
+        manejador = self.manejadores.get(trabajo.tipo)
+        try:
+            if manejador is None:
+                raise LookupError(f"Tipo de trabajo sin manejador: {trabajo.tipo}")
+            manejador(trabajo, carga)
+            trabajo.estado = "hecho"
+            trabajo.ultimo_error = None
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            trabajo = db.session.get(Trabajo, trabajo.id_trabajo)
+            trabajo.ultimo_error = str(e)[:500]
+            if trabajo.intentos >= trabajo.max_intentos:
+                trabajo.estado = "fallido"
+                print(f"❌ Trabajo #{trabajo.id_trabajo} ({trabajo.tipo}) fallido tras "
+                      f"{trabajo.intentos} intentos: {e}")
+                if trabajo.tipo in self.al_fallar:
+                    try:
+                        self.al_fallar[trabajo.tipo](trabajo, e)
+                    except Exception as e2:
+                        print(f"⚠️ Error registrando el fallo: {e2}")
+            else:
+                espera = min(ESPERA_MAXIMA_SEGUNDOS, self.espera_base * 2 ** (trabajo.intentos - 1))
+                trabajo.estado = "pendiente"
+                trabajo.disponible_en = datetime.utcnow() + timedelta(seconds=espera)
+                print(f"⏳ Trabajo #{trabajo.id_trabajo} ({trabajo.tipo}) reintento en {espera}s: {e}")
+            db.session.commit()
+        return trabajo.estado
@@ -1,69 +1,85 @@
 import sys
 import os
+import argparse
 from dotenv import load_dotenv
-from langchain_community.document_loaders import TextLoader, DirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_chroma import Chroma
 
 # --- CONFIGURACIÓN DE RUTAS ---
 # Calculamos la raíz del proyecto para encontrar las carpetas
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+sys.path.insert(0, BASE_DIR)
+
+from backend.data_science.indexador import IndexadorIncremental
+from backend.data_science.embeddings import BACKENDS, crear_embeddings, describir_embeddings
+
 DOCS_PATH = os.path.join(BASE_DIR, "documentos_rag")  # Donde están los TXT
 DB_PATH = os.path.join(BASE_DIR, "data/vector_store") # Donde guardamos la memoria
 
 # Cargar .env
 load_dotenv(os.path.join(BASE_DIR, ".env"))
 
-def indexar_conocimiento():
-    print("--- 🧠 Entrenando al Agente (RAG) con Google Gemini ---")
-    print(f"📂 Buscando documentos en: {DOCS_PATH}")
+def indexar_conocimiento(docs_path=DOCS_PATH, db_path=DB_PATH, tamano_lote=64, hilos=4,
+                         backend=None):
+    """
+    Sincroniza `db_path` con los TXT de `docs_path`.
+    `backend` = "google", "local" o "falso" (por defecto, EMBEDDINGS_BACKEND).
+    """
+    print("--- 🧠 Entrenando al Agente (RAG) ---")
+    print(f"📂 Buscando documentos en: {docs_path}")
     
-    # 1. Verificar claves
-    if not os.getenv("GOOGLE_API_KEY"):
-        print("❌ ERROR: No se encontró GOOGLE_API_KEY en el archivo .env")
+    # 1. Elegir backend de embeddings (verifica claves si es Google)
+    try:
+        embeddings = crear_embeddings(backend)
+    except ValueError as e:
+        print(f"❌ ERROR: {e}")
         return
 
     # 2. Cargar documentos
-    if not os.path.exists(DOCS_PATH):
-        os.makedirs(DOCS_PATH)
-        print(f"⚠️ La carpeta {DOCS_PATH} no existía. Créala y pon archivos .txt dentro.")
+    if not os.path.exists(docs_path):
+        os.makedirs(docs_path)
+        print(f"⚠️ La carpeta {docs_path} no existía. Créala y pon archivos .txt dentro.")
         return
 
-    loader = DirectoryLoader(DOCS_PATH, glob="*.txt", loader_cls=TextLoader)
-    docs = loader.load()
+    indexador = IndexadorIncremental(
+        docs_dir=docs_path,
+        db_dir=db_path,
+        embeddings=embeddings,
+        chunk_size=1000,
+        chunk_overlap=200,
+        tamano_lote=tamano_lote,
+        hilos=hilos,
+    )
+    archivos = indexador.archivos_actuales()
     
-    if not docs:
+    if not archivos:
         print("❌ No hay archivos .txt para leer. El cerebro está vacío.")
         print("👉 Crea un archivo .txt con normas en la carpeta 'documentos_rag'.")
         return
 
-    print(f"📄 Leídos {len(docs)} documentos.")
+    print(f"📄 Leídos {len(archivos)} documentos.")
 
-    # 3. Dividir texto (Chunks)
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200
-    )
-    splits = text_splitter.split_documents(docs)
-    print(f"✂️  Texto dividido en {len(splits)} fragmentos.")
-
-    # 4. Generar Embeddings y Guardar
-    print("🔮 Conectando con Google AI para generar embeddings...")
+    # 3. Trocear, generar embeddings solo de lo nuevo y sincronizar
+    print(f"🔮 Generando embeddings con el backend '{describir_embeddings(embeddings)['backend']}'...")
     try:
-        embedding_engine = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
-        
-        vectorstore = Chroma.from_documents(
-            documents=splits,
-            embedding=embedding_engine,
-            persist_directory=DB_PATH
-        )
+        resumen = indexador.indexar()
         print("="*50)
-        print(f"✅ ¡CEREBRO ACTUALIZADO! Memoria guardada en: data/vector_store")
+        print(f"✅ ¡CEREBRO ACTUALIZADO! Memoria guardada en: {db_path}")
+        print(f"   ➕ {resumen['nuevos']} fragmentos nuevos | ➖ {resumen['eliminados']} eliminados "
+              f"| 💤 {resumen['archivos_sin_cambios']} archivos sin cambios ({resumen['segundos']}s)")
+        print(f"   ⚡ {resumen['fragmentos_por_segundo']} fragmentos/s")
         print("="*50)
         
     except Exception as e:
-        print(f"❌ Error conectando con Google: {e}")
+        print(f"❌ Error generando embeddings: {e}")
+        print("   (Lo ya indexado se conserva: vuelve a ejecutar para continuar.)")
 
 if __name__ == "__main__":
-    indexar_conocimiento()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Indexa documentos_rag/ en la base vectorial.")
+    parser.add_argument("--docs", default=DOCS_PATH, help="Carpeta con los TXT")
+    parser.add_argument("--db", default=DB_PATH, help="Carpeta del almacén vectorial")
+    parser.add_argument("--lote", type=int, default=64, help="Fragmentos por llamada de embeddings")
+    parser.add_argument("--hilos", type=int, default=4, help="Llamadas de embeddings simultáneas")
+    parser.add_argument("--backend", choices=BACKENDS, default=None,
+                        help="Backend de embeddings (por defecto EMBEDDINGS_BACKEND); "
+                             "'falso' genera vectores deterministas sin red")
+    args = parser.parse_args()
+    indexar_conocimiento(args.docs, args.db, args.lote, args.hilos, args.backend)
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+Clientes de embeddings usados por el RAG.
+
+El backend se elige con la variable EMBEDDINGS_BACKEND:
+- "google": API de Google (necesita GOOGLE_API_KEY).
+- "local":  modelo sentence-transformers en CPU, sin red (servidores aislados).
+- "falso":  vectores deterministas para pruebas.
+Si no se indica, se usa "google" cuando hay API key y "local" en caso contrario.
+"""
+import hashlib
+import math
+import os
+import random
+import threading
+import time
+
+from langchain_core.embeddings import Embeddings
+
+MODELO_GOOGLE = "models/text-embedding-004"
+# Multilingüe y ligero (384 dimensiones); puede ser también una ruta local al modelo
+MODELO_LOCAL = os.getenv("EMBEDDINGS_MODELO_LOCAL",
+                         "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+BACKENDS = ("google", "local", "falso")
+# Clientes de terceros que no declaran su backend
+_BACKEND_POR_CLASE = {"GoogleGenerativeAIEmbeddings": "google"}
+
+
+class EmbeddingsIncompatibles(ValueError):
+    """El almacén vectorial se construyó con otro backend, modelo o dimensión."""
+
+
+class EmbeddingsFalsos(Embeddings):
+    """
+    Embeddings deterministas sin red: el mismo texto produce siempre el mismo
+    vector. Sirve para probar el indexado y la recuperación sin API key.
+    Con `latencia` y `tasa_fallos` se simula un proveedor lento o inestable.
+    """
+
+    backend = "falso"
+
+    def __init__(self, dimension=64, latencia=0.0, tasa_fallos=0.0, semilla=0):
+        self.dimension = dimension
+        self.modelo = f"hash-{dimension}"
+        self.latencia = latencia
+        self.tasa_fallos = tasa_fallos
+        self._azar = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.llamadas = 0
+
+    def _vector(self, texto):
+        valores = []
+        bloque = 0
+        while len(valores) < self.dimension:
+            digest = hashlib.sha256(f"{bloque}:{texto}".encode("utf-8")).digest()
+            valores.extend(b / 255.0 - 0.5 for b in digest)
+            bloque += 1
+        valores = valores[:self.dimension]
+        norma = math.sqrt(sum(v * v for v in valores)) or 1.0
+        return [v / norma for v in valores]
+
+    def _simular_red(self):
+        with self._lock:
+            self.llamadas += 1
+            falla = self._azar.random() < self.tasa_fallos
+        if self.latencia:
+            time.sleep(self.latencia)
+        if falla:
+            raise ConnectionError("Fallo simulado del proveedor de embeddings")
+
+    def embed_documents(self, texts):
+        self._simular_red()
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        self._simular_red()
+        return self._vector(text)
+
+
+class EmbeddingsLocales(Embeddings):
+    """
+    Embeddings con sentence-transformers en CPU. El modelo se carga en la
+    primera llamada (no al importar) y se codifica por lotes.
+    """
+
+    backend = "local"
+
+    def __init__(self, modelo=MODELO_LOCAL, dispositivo="cpu", tamano_lote=32):
+        self.modelo = modelo
+        self.dispositivo = dispositivo
+        self.tamano_lote = tamano_lote
+        self._modelo = None
+        self._lock = threading.Lock()
+
+    def _cargar(self):
+        if self._modelo is None:
+            with self._lock:
+                if self._modelo is None:
+                    from sentence_transformers import SentenceTransformer
+                    print(f"🧠 Cargando modelo local de embeddings: {self.modelo}")
+                    self._modelo = SentenceTransformer(self.modelo, device=self.dispositivo)
+        return self._modelo
+
+    @property
+    def dimension(self):
+        return self._cargar().get_sentence_embedding_dimension()
+
+    def _codificar(self, textos):
+        vectores = self._cargar().encode(
+            textos,
+            batch_size=self.tamano_lote,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return vectores.tolist()
+
+    def embed_documents(self, texts):
+        return self._codificar(list(texts))
+
+    def embed_query(self, text):
+        return self._codificar([text])[0]
+
+
+def crear_embeddings(backend=None, modelo_google=MODELO_GOOGLE, modelo_local=MODELO_LOCAL):
+    """Devuelve el cliente de embeddings del backend pedido (o el configurado)."""
+    backend = (backend or os.getenv("EMBEDDINGS_BACKEND")
+               or ("google" if os.getenv("GOOGLE_API_KEY") else "local")).lower()
+    if backend == "google":
+        if not os.getenv("GOOGLE_API_KEY"):
+            raise ValueError("EMBEDDINGS_BACKEND=google requiere GOOGLE_API_KEY "
+                             "(o usa EMBEDDINGS_BACKEND=local)")
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=modelo_google)
+    if backend == "local":
+        return EmbeddingsLocales(modelo_local)
+    if backend == "falso":
+        return EmbeddingsFalsos()
+    raise ValueError(f"Backend de embeddings desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+
+
+def describir_embeddings(embeddings):
+    """Backend y modelo de un cliente, para registrarlos junto al almacén."""
+    nombre_clase = type(embeddings).__name__
+    backend = getattr(embeddings, "backend", None) or _BACKEND_POR_CLASE.get(nombre_clase, nombre_clase)
+    modelo = getattr(embeddings, "modelo", None) or getattr(embeddings, "model", None) or ""
+    return {"backend": backend, "modelo": modelo}
+
+
+def comprobar_compatibilidad(registro, embeddings, dimension=None):
+    """
+    Lanza EmbeddingsIncompatibles si el almacén (según su manifiesto) se creó
+    con otro backend/modelo o con vectores de otra dimensión.
+    """
+    if not registro:
+        return
+    actual = describir_embeddings(embeddings)
+    for clave in ("backend", "modelo"):
+        if registro.get(clave) and registro[clave] != actual[clave]:
+            raise EmbeddingsIncompatibles(
+                f"El índice se creó con {clave}={registro[clave]!r} pero ahora se usa "
+                f"{actual[clave]!r}. Re-indexa o ajusta EMBEDDINGS_BACKEND."
+            )
+    if dimension is not None and registro.get("dimension") and registro["dimension"] != dimension:
+        raise EmbeddingsIncompatibles(
+            f"El índice tiene vectores de dimensión {registro['dimension']} y el modelo "
+            f"actual produce {dimension}."
+        )
@@ -0,0 +1,299 @@
+"""
+Datos sintéticos de la jerarquía escolar a escala real.
+
+Centros con provincia/comarca/localidad de la Comunitat Valenciana, su
+dirección, tutores, profesores, alumnos y el histórico de informes. Todo sale
+de un generador con semilla: la misma semilla y escala dan exactamente los
+mismos datos, así que los benchmarks del dashboard, el login o los
+expedientes se pueden comparar entre versiones.
+
+- Las filas se insertan con el INSERT masivo del ORM (executemany) por
+  lotes, cada lote en su transacción, sin crear objetos ni cargar la tabla
+  en memoria.
+- Todos los usuarios comparten un único hash de contraseña (calcular decenas
+  de miles de scrypt llevaría horas); la contraseña es CLAVE_SINTETICA y la
+  sal del hash también sale de la semilla.
+- Al terminar se reconstruye el índice de identidades del login, que los
+  INSERT masivos no actualizan.
+- Los ids empiezan tras los ya existentes: se puede cargar sobre una base
+  con datos (p.ej. la de setup_data.py).
+
+    python backend/data_science/generar_datos_sinteticos.py --escala demo
+    python backend/data_science/generar_datos_sinteticos.py --escala grande --semilla 7 --db /tmp/carga.db
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../'))
+sys.path.insert(0, BASE_DIR)
+
+from sqlalchemy import func, insert, select
+
+from backend.models import db, Alumno, CentroEstudios, Director, Informe, Profesor, Tutor
+from backend.security.contrasenas import generar_hash
+
+CLAVE_SINTETICA = "12345"
+TAMANO_LOTE = 5000
+# Fecha fija (no "ahora") para que la semilla determine también las fechas
+FECHA_FIN = datetime(2025, 6, 30, 15, 0)
+DIAS_HISTORICO = 730
+
+# centros, y por centro: tutores, profesores, alumnos, informes
+ESCALAS = {
+    "demo": {"centros": 5, "tutores": 4, "profesores": 4, "alumnos": 40, "informes": 60},
+    "media": {"centros": 200, "tutores": 8, "profesores": 6, "alumnos": 100, "informes": 250},
+    "grande": {"centros": 2000, "tutores": 10, "profesores": 8, "alumnos": 25, "informes": 1000},
+}
+
+PROVINCIAS = {
+    "Alacant": ("03", {
+        "l'Alacantí": ["Alacant", "Sant Vicent del Raspeig", "El Campello", "Mutxamel"],
+        "Baix Vinalopó": ["Elx", "Santa Pola", "Crevillent"],
+        "Marina Baixa": ["Benidorm", "La Vila Joiosa", "Altea"],
+        "Vega Baja": ["Oriola", "Torrevieja", "Almoradí"],
+    }),
+    "Castelló": ("12", {
+        "Plana Alta": ["Castelló de la Plana", "Benicàssim", "Vilafamés"],
+        "Plana Baixa": ["Vila-real", "Borriana", "La Vall d'Uixó"],
+        "Baix Maestrat": ["Vinaròs", "Benicarló", "Peníscola"],
+    }),
+    "València": ("46", {
+        "València": ["València"],
+        "Horta Sud": ["Torrent", "Paiporta", "Alaquàs", "Catarroja"],
+        "Camp de Túria": ["Llíria", "La Pobla de Vallbona", "Bétera"],
+        "Safor": ["Gandia", "Oliva", "Tavernes de la Valldigna"],
+        "Ribera Alta": ["Alzira", "Carcaixent", "Algemesí"],
+    }),
+}
+TIPOS_CENTRO = [("Instituto de Educación Secundaria", "Institut d'Educació Secundària", "Público", 5),
+                ("Colegio de Educación Infantil y Primaria", "Col·legi d'Educació Infantil i Primària", "Público", 4),
+                ("Colegio Concertado", "Col·legi Concertat", "Concertado", 2),
+                ("Centro Privado de Educación Secundaria", "Centre Privat d'Educació Secundària", "Privado", 1)]
+NOMBRES_CENTRO = ["Joanot Martorell", "Lluís Vives", "Ausiàs March", "Isabel de Villena", "Blasco Ibáñez",
+                  "Sorolla", "Jaume I", "Clara Campoamor", "Miguel Hernández", "Gabriel Miró",
+                  "La Malvarrosa", "Serra Calderona", "El Palmeral", "Mediterrani", "Les Arts",
+                  "Vicent Andrés Estellés", "Azorín", "Maria Moliner", "La Vall", "El Carme"]
+VIAS = ["Calle", "Avenida", "Plaza", "Camino"]
+CALLES = ["Mayor", "de la Constitución", "del Mar", "de Colón", "Sant Josep", "de la Pau", "del Riu",
+          "de l'Horta", "Primer de Maig", "Ramón y Cajal"]
+
+NOMBRES = ["Lucía", "Hugo", "Martina", "Martín", "Sofía", "Pablo", "Paula", "Mateo", "Julia", "Leo",
+           "Valeria", "Daniel", "Emma", "Álvaro", "Carla", "Marc", "Noa", "Pau", "Laia", "Alejandro",
+           "Vega", "Jordi", "Aitana", "Izan", "Irene", "Mario", "Claudia", "Adrián", "Nerea", "Joan",
+           "Carmen", "Vicent", "Amparo", "Xavier", "Rosa", "Josep", "Neus", "Andreu", "Empar", "Toni"]
+APELLIDOS = ["García", "Martínez", "López", "Sánchez", "Pérez", "Gómez", "Martín", "Ferrer", "Navarro",
+             "Ruiz", "Serrano", "Domínguez", "Vidal", "Soler", "Mas", "Llorens", "Ortega", "Castillo",
+             "Marí", "Moll", "Bosch", "Giner", "Peris", "Cano", "Roig", "Sanchis", "Escrivà", "Puig"]
+
+# (valor, peso) tal como los deja el análisis del chat
+TIPOS_INFORME = [("Verbal", 38), ("Físico", 18), ("Ciber", 16), ("Exclusión", 12),
+                 ("Verbal, Ciber", 8), ("Físico, Verbal", 6), ("Otro", 2)]
+GRAVEDADES = [("LEVE", 50), ("MODERADO", 38), ("GRAVE", 12)]
+RESUMENES = {
+    "Verbal": "El alumno relata insultos y motes reiterados por parte de compañeros de {lugar}.",
+    "Físico": "El alumno relata empujones y golpes durante {lugar}.",
+    "Ciber": "El alumno relata mensajes ofensivos y fotos compartidas sin permiso en redes sociales.",
+    "Exclusión": "El alumno relata que un grupo de compañeros le aparta y le ignora en {lugar}.",
+    "Otro": "El alumno describe una situación de convivencia que requiere revisión.",
+}
+LUGARES = ["el recreo", "el patio", "clase", "los pasillos", "el comedor", "el vestuario", "la salida"]
+
+
+def _elegir(rng, opciones):
+    valores, pesos = zip(*opciones)
+    return rng.choices(valores, weights=pesos)[0]
+
+
+def _nombre(rng):
+    return f"{rng.choice(NOMBRES)} {rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}"
+
+
+def _siguiente_id(modelo, columna):
+    return (db.session.execute(select(func.max(getattr(modelo, columna)))).scalar() or 0) + 1
+
+
+def _insertar(modelo, filas, tamano_lote, contador):
+    """
+    INSERT masivo de `filas` (iterable de dicts con los nombres de atributo
+    del modelo, p.ej. password_hash) en transacciones de `tamano_lote`.
+    """
+    lote = []
+    for fila in filas:
+        lote.append(fila)
+        if len(lote) >= tamano_lote:
+            db.session.execute(insert(modelo), lote)
+            db.session.commit()
+            contador[modelo.__tablename__] = contador.get(modelo.__tablename__, 0) + len(lote)
+            lote = []
+    if lote:
+        db.session.execute(insert(modelo), lote)
+        db.session.commit()
+        contador[modelo.__tablename__] = contador.get(modelo.__tablename__, 0) + len(lote)
+
+
+def _fecha_informe(rng):
+    """Días lectivos en horario escolar, con más casos en los meses de curso."""
+    while True:
+        fecha = FECHA_FIN - timedelta(days=rng.randrange(DIAS_HISTORICO))
+        if fecha.weekday() < 5 and fecha.month not in (7, 8) or rng.random() < 0.05:
+            return fecha.replace(hour=rng.randrange(8, 22), minute=rng.randrange(60),
+                                 second=rng.randrange(60), microsecond=0)
+
+
+def generar_datos(semilla=42, centros=5, tutores=4, profesores=4, alumnos=40, informes=60,
+                  tamano_lote=TAMANO_LOTE, progreso=print):
+    """
+    Inserta la jerarquía completa (dentro de un app_context). Los números de
+    tutores, profesores, alumnos e informes son por centro.
+    Devuelve {tabla: filas insertadas}.
+    """
+    from backend.auth.identidades import rellenar_indice_identidades
+
+    rng = random.Random(semilla)
+    # Generador aparte para la sal: no desplaza la secuencia del resto de datos
+    rng_sal = random.Random(f"sal-{semilla}")
+    sal = "".join(rng_sal.choice(string.ascii_letters + string.digits) for _ in range(16))
+    hash_comun = generar_hash(CLAVE_SINTETICA, sal=sal)
+    contador = {}
+
+    id_director = _siguiente_id(Director, "id_director")
+    id_centro = _siguiente_id(CentroEstudios, "id_centro_estudios")
+    id_tutor = _siguiente_id(Tutor, "id_tutor")
+    id_profesor = _siguiente_id(Profesor, "id_profesor")
+    id_alumno = _siguiente_id(Alumno, "id_alumno")
+
+    # 1. Centros y direcciones (pocas filas: caben en memoria)
+    lista_centros, lista_directores = [], []
+    regiones = [(provincia, prefijo, comarca, localidades)
+                for provincia, (prefijo, comarcas) in PROVINCIAS.items()
+                for comarca, localidades in comarcas.items()]
+    for n in range(centros):
+        provincia, prefijo, comarca, localidades = rng.choice(regiones)
+        generica_es, generica_val, regimen, _ = rng.choices(TIPOS_CENTRO, weights=[t[3] for t in TIPOS_CENTRO])[0]
+        especifica = rng.choice(NOMBRES_CENTRO)
+        id_c, id_d = id_centro + n, id_director + n
+        lista_directores.append({
+            "id_director": id_d, "nombre_director": _nombre(rng),
+            "email_director": f"director{id_d}@sayit.test",
+            "telefono_director": f"96{rng.randrange(10 ** 7):07d}", "password_hash": hash_comun,
+        })
+        lista_centros.append({
+            "id_centro_estudios": id_c, "codigo": f"{prefijo}{id_c:06d}",
+            "denominacion_generica_es": generica_es, "denominacion_generica_val": generica_val,
+            "denominacion_especifica": especifica, "regimen": regimen,
+            "tipo_via": rng.choice(VIAS), "direccion": rng.choice(CALLES), "numero": str(rng.randrange(1, 120)),
+            "codigo_postal": f"{prefijo}{rng.randrange(1000):03d}", "localidad": rng.choice(localidades),
+            "provincia": provincia, "comarca": comarca, "telefono": f"96{rng.randrange(10 ** 7):07d}",
+            "latitud": round(rng.uniform(37.9, 40.7), 6), "longitud": round(rng.uniform(-1.4, 0.5), 6),
+            "id_director": id_d,
+        })
+    _insertar(Director, lista_directores, tamano_lote, contador)
+    _insertar(CentroEstudios, lista_centros, tamano_lote, contador)
+    progreso(f"🏫 {centros} centros con su dirección.")
+
+    # 2. Tutores y profesores (el tutor no tiene centro; se le asigna por sus alumnos)
+    _insertar(Tutor, ({
+        "id_tutor": id_tutor + n, "nombre_tutor": _nombre(rng),
+        "email_tutor": f"tutor{id_tutor + n}@sayit.test",
+        "telefono_tutor": f"6{rng.randrange(10 ** 8):08d}", "password_hash": hash_comun,
+    } for n in range(centros * tutores)), tamano_lote, contador)
+    _insertar(Profesor, ({
+        "id_profesor": id_profesor + n, "nombre_profesor": _nombre(rng),
+        "email_profesor": f"profesor{id_profesor + n}@sayit.test", "password_hash": hash_comun,
+        "id_centro_estudios": id_centro + n // max(profesores, 1),
+    } for n in range(centros * profesores)), tamano_lote, contador)
+    progreso(f"👩‍🏫 {centros * tutores} tutores y {centros * profesores} profesores.")
+
+    # 3. Alumnos, repartidos entre los tutores de su centro
+    def filas_alumnos():
+        for n in range(centros * alumnos):
+            centro = n // max(alumnos, 1)
+            yield {
+                "id_alumno": id_alumno + n, "nombre_alumno": _nombre(rng),
+                "email_alumno": f"alumno{id_alumno + n}@sayit.test",
+                "anyo_nacimiento_alumno": rng.randrange(FECHA_FIN.year - 18, FECHA_FIN.year - 6),
+                "password_hash": hash_comun, "id_centro_estudios": id_centro + centro,
+                "id_tutor": id_tutor + centro * tutores + rng.randrange(tutores) if tutores else None,
+            }
+    _insertar(Alumno, filas_alumnos(), tamano_lote, contador)
+    progreso(f"🎒 {centros * alumnos} alumnos.")
+
+    # 4. Histórico de informes, ya procesados por la cola
+    def filas_informes():
+        for n in range(centros * informes):
+            centro = n // max(informes, 1)
+            tipo = _elegir(rng, TIPOS_INFORME)
+            gravedad = _elegir(rng, GRAVEDADES)
+            fecha = _fecha_informe(rng)
+            antiguedad = (FECHA_FIN - fecha).days
+            estado = ("Resuelto" if antiguedad > 60 or rng.random() < 0.3
+                      else rng.choice(["Pendiente", "En Proceso"]))
+            resumen = RESUMENES[tipo.split(", ")[0]].format(lugar=rng.choice(LUGARES))
+            rol = "TESTIGO" if rng.random() < 0.25 else "VÍCTIMA"
+            if centros and alumnos:
+                alumno = id_alumno + centro * alumnos + rng.randrange(alumnos)
+            else:
+                alumno = None
+            yield {
+                "fecha_informe": fecha, "tipo_bullying": tipo, "descripcion": f"[{rol}] {resumen}",
+                "estado": estado, "id_centro_estudios": id_centro + centro,
+                "id_director": id_director + centro, "id_alumno": alumno,
+                "estado_procesamiento": "notificado", "nivel_gravedad": gravedad,
+                "datos_ia": json.dumps({
+                    "rol_informante": rol, "tipo_incidente": tipo.split(", "), "nivel_gravedad": gravedad,
+                    "resumen_hechos": resumen, "nombres_involucrados": ["Desconocido"],
+                    "origen_analisis": "ia"}, ensure_ascii=False),
+            }
+            if (n + 1) % (tamano_lote * 20) == 0:
+                progreso(f"   📄 {n + 1}/{centros * informes} informes...")
+    _insertar(Informe, filas_informes(), tamano_lote, contador)
+    progreso(f"📄 {centros * informes} informes.")
+
+    # 5. Índice de identidades del login (los INSERT masivos no pasan por el ORM)
+    contador["identidades"] = rellenar_indice_identidades()
+    return contador
+
+
+def _crear_app(ruta_db):
+    from flask import Flask
+    from backend.database import configurar_base_datos
+
+    app = Flask(__name__)
+    configurar_base_datos(app, ruta_db)
+    db.init_app(app)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera datos sintéticos de centros, usuarios e informes")
+    parser.add_argument("--escala", choices=ESCALAS, default="demo")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--db", default=os.path.join(BASE_DIR, "data", "bullying.db"),
+                        help="Fichero SQLite (se ignora si hay DATABASE_URL)")
+    for clave in ("centros", "tutores", "profesores", "alumnos", "informes"):
+        parser.add_argument(f"--{clave}", type=int, help=f"Sustituye el valor de la escala ({clave}"
+                            + ("" if clave == "centros" else " por centro") + ")")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE, help="Filas por transacción")
+    args = parser.parse_args()
+
+    volumen = dict(ESCALAS[args.escala])
+    volumen.update({k: v for k, v in vars(args).items() if k in volumen and v is not None})
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    app = _crear_app(args.db)
+    with app.app_context():
+        from backend.migraciones import aplicar_migraciones
+        aplicar_migraciones()
+        print(f"🌱 Generando escala '{args.escala}' (semilla {args.semilla}): {volumen}")
+        inicio = time.perf_counter()
+        insertadas = generar_datos(args.semilla, tamano_lote=args.lote, **volumen)
+        segundos = time.perf_counter() - inicio
+    total = sum(v for k, v in insertadas.items() if k != "identidades")
+    print(f"✅ {total} filas en {segundos:.1f}s ({total / max(segundos, 1e-9):.0f} filas/s): {insertadas}")
+    print(f"🔑 Contraseña de todos los usuarios sintéticos: {CLAVE_SINTETICA}")
@@ -0,0 +1,252 @@
+"""
+Indexado incremental de la normativa para el RAG.
+
+En lugar de borrar la base vectorial y volver a generar todos los embeddings,
+se guarda un manifiesto junto al almacén con el hash de cada archivo y los IDs
+de sus fragmentos. En cada ejecución solo se embeben los fragmentos nuevos o
+modificados y se eliminan los de archivos borrados.
+"""
+import glob
+import hashlib
+import json
+import os
+import time
+
+import chromadb
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from backend.data_science.embeddings import (
+    EmbeddingsIncompatibles, describir_embeddings,
+)
+from backend.data_science.ingesta import EmbebedorPorLotes, cargar_documentos
+from backend.data_science.lexico import INDICE_LEXICO, IndiceBM25
+
+MANIFIESTO = "manifiesto.json"
+VERSION_MANIFIESTO = 2
+# Misma colección que abre langchain por defecto, para que el recuperador la lea
+COLECCION = "langchain"
+# Cada cuánto se vuelca el manifiesto durante una ingesta larga (segundos)
+INTERVALO_CHECKPOINT = 5.0
+
+
+def hash_texto(texto):
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def cargar_manifiesto(db_dir):
+    """Devuelve el manifiesto guardado o None si el almacén no tiene uno."""
+    ruta = os.path.join(db_dir, MANIFIESTO)
+    if not os.path.exists(ruta):
+        return None
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Manifiesto ilegible ({e}). Se reconstruirá el índice.")
+        return None
+
+
+def guardar_manifiesto(db_dir, manifiesto):
+    """Escritura atómica: un lector nunca ve un manifiesto a medias."""
+    os.makedirs(db_dir, exist_ok=True)
+    ruta = os.path.join(db_dir, MANIFIESTO)
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(temporal, ruta)
+
+
+class IndexadorIncremental:
+    """
+    Mantiene sincronizado un almacén Chroma con una carpeta de TXT.
+    Los IDs de fragmento se derivan del contenido, así que un fragmento que no
+    cambia conserva su ID (y su embedding) entre ejecuciones.
+
+    La ingesta es en streaming: los archivos se leen uno a uno, los embeddings
+    se calculan por lotes en paralelo (ver `EmbebedorPorLotes`) y cada lote se
+    escribe en cuanto termina. El propio almacén hace de checkpoint: si una
+    ejecución se interrumpe, la siguiente solo embebe lo que falta.
+    """
+
+    def __init__(self, docs_dir, db_dir, embeddings, chunk_size=1000, chunk_overlap=200,
+                 tamano_lote=64, hilos=4, reintentos=5, espera_base=1.0):
+        self.docs_dir = docs_dir
+        self.db_dir = db_dir
+        self.embeddings = embeddings
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.embebedor = EmbebedorPorLotes(
+            embeddings,
+            tamano_lote=tamano_lote,
+            hilos=hilos,
+            reintentos=reintentos,
+            espera_base=espera_base,
+        )
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap
+        )
+
+    # --- utilidades ---
+
+    def _configuracion(self):
+        # Si cambia cualquiera de estos valores, los embeddings guardados no sirven
+        return {
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            **describir_embeddings(self.embeddings),
+        }
+
+    def _cliente(self):
+        return chromadb.PersistentClient(path=self.db_dir)
+
+    def archivos_actuales(self):
+        rutas = sorted(glob.glob(os.path.join(self.docs_dir, "*.txt")))
+        return {os.path.relpath(r, self.docs_dir): r for r in rutas}
+
+    def trocear(self, nombre, ruta, contenido):
+        """Divide un archivo en fragmentos con ID estable basado en su contenido."""
+        fragmentos = []
+        vistos = {}
+        for texto in self.splitter.split_text(contenido):
+            base = hash_texto(f"{nombre}\n{texto}")[:32]
+            # El mismo párrafo repetido dentro de un archivo necesita IDs distintos
+            vistos[base] = vistos.get(base, 0) + 1
+            id_fragmento = base if vistos[base] == 1 else f"{base}-{vistos[base]}"
+            fragmentos.append((id_fragmento, texto, {"source": ruta, "archivo": nombre}))
+        return fragmentos
+
+    def _registrar_dimension(self, manifiesto, dimension):
+        """La primera vez se anota la dimensión; después, cualquier discrepancia aborta."""
+        registro = manifiesto["embeddings"]
+        if registro.get("dimension") is None:
+            registro["dimension"] = dimension
+        elif registro["dimension"] != dimension:
+            raise EmbeddingsIncompatibles(
+                f"El modelo devolvió vectores de dimensión {dimension} pero el índice "
+                f"es de {registro['dimension']}."
+            )
+
+    def _construir_lexico(self, coleccion):
+        """Reconstruye el BM25 con todos los fragmentos del almacén (es barato: sin red)."""
+        datos = coleccion.get(include=["documents", "metadatas"])
+        IndiceBM25.construir(datos["ids"], datos["documents"], datos["metadatas"]).guardar(self.db_dir)
+
+    # --- proceso principal ---
+
+    def indexar(self):
+        """Sincroniza el almacén con la carpeta. Devuelve un resumen con contadores."""
+        inicio = time.perf_counter()
+        resumen = {"nuevos": 0, "eliminados": 0, "archivos_sin_cambios": 0,
+                   "archivos_actualizados": 0, "archivos_borrados": 0}
+
+        configuracion = self._configuracion()
+        manifiesto = cargar_manifiesto(self.db_dir)
+        habia_almacen = os.path.exists(os.path.join(self.db_dir, "chroma.sqlite3"))
+        cliente = self._cliente()
+        hay_cambios = False
+
+        if manifiesto is None or manifiesto.get("configuracion") != configuracion \
+                or manifiesto.get("version") != VERSION_MANIFIESTO:
+            # Almacén antiguo (sin manifiesto, posiblemente con duplicados) o
+            # parámetros distintos: se vacía una vez y se parte de cero.
+            if manifiesto is not None or habia_almacen:
+                print("♻️  Índice sin manifiesto compatible: se reconstruye desde cero.")
+                if COLECCION in [c.name for c in cliente.list_collections()]:
+                    cliente.delete_collection(COLECCION)
+            manifiesto = {"version": VERSION_MANIFIESTO, "configuracion": configuracion,
+                          "embeddings": describir_embeddings(self.embeddings), "archivos": {}}
+            # Se guarda ya: si la primera ingesta se corta, la siguiente la reanuda
+            guardar_manifiesto(self.db_dir, manifiesto)
+            hay_cambios = True
+
+        coleccion = cliente.get_or_create_collection(COLECCION)
+        registrados = manifiesto["archivos"]
+        vistos = set()
+        # Archivos a medio escribir: nombre -> (hash, ids actuales, ids previos, pendientes)
+        en_curso = {}
+        ultimo_guardado = time.monotonic()
+
+        def cerrar_archivo(nombre):
+            """Todos los fragmentos del archivo están escritos: se consolida en el manifiesto."""
+            nonlocal hay_cambios
+            hash_archivo, ids_actuales, ids_previos, _ = en_curso.pop(nombre)
+            obsoletos = ids_previos - set(ids_actuales)
+            if obsoletos:
+                coleccion.delete(ids=sorted(obsoletos))
+            registrados[nombre] = {"hash": hash_archivo, "fragmentos": ids_actuales}
+            resumen["eliminados"] += len(obsoletos)
+            resumen["archivos_actualizados"] += 1
+            hay_cambios = True
+
+        def fragmentos_pendientes():
+            """Recorre la carpeta y va entregando solo lo que hay que embeber."""
+            for nombre, ruta, contenido in cargar_documentos(self.docs_dir):
+                vistos.add(nombre)
+                hash_archivo = hash_texto(contenido)
+                previo = registrados.get(nombre)
+                if previo and previo["hash"] == hash_archivo:
+                    resumen["archivos_sin_cambios"] += 1
+                    continue
+
+                fragmentos = self.trocear(nombre, ruta, contenido)
+                ids_previos = set(previo["fragmentos"]) if previo else set()
+                candidatos = [f for f in fragmentos if f[0] not in ids_previos]
+                # Checkpoint: lo que ya quedó escrito en una ejecución interrumpida no se repite
+                if candidatos:
+                    ya_escritos = set(coleccion.get(ids=[f[0] for f in candidatos], include=[])["ids"])
+                    candidatos = [f for f in candidatos if f[0] not in ya_escritos]
+
+                en_curso[nombre] = (hash_archivo, [f[0] for f in fragmentos], ids_previos,
+                                    len(candidatos))
+                if not candidatos:
+                    cerrar_archivo(nombre)
+                    continue
+                yield from candidatos
+
+        try:
+            for lote, vectores in self.embebedor.procesar(fragmentos_pendientes()):
+                self._registrar_dimension(manifiesto, len(vectores[0]))
+                coleccion.upsert(
+                    ids=[f[0] for f in lote],
+                    embeddings=vectores,
+                    documents=[f[1] for f in lote],
+                    metadatas=[f[2] for f in lote],
+                )
+                resumen["nuevos"] += len(lote)
+                for fragmento in lote:
+                    nombre = fragmento[2]["archivo"]
+                    hash_archivo, ids_actuales, ids_previos, pendientes = en_curso[nombre]
+                    en_curso[nombre] = (hash_archivo, ids_actuales, ids_previos, pendientes - 1)
+                    if pendientes == 1:
+                        cerrar_archivo(nombre)
+                if time.monotonic() - ultimo_guardado > INTERVALO_CHECKPOINT:
+                    guardar_manifiesto(self.db_dir, manifiesto)
+                    ultimo_guardado = time.monotonic()
+        except BaseException:
+            # El manifiesto solo contiene archivos completos, así que es seguro volcarlo
+            if hay_cambios:
+                guardar_manifiesto(self.db_dir, manifiesto)
+            raise
+
+        for nombre in sorted(set(registrados) - vistos):
+            ids = registrados.pop(nombre)["fragmentos"]
+            if ids:
+                coleccion.delete(ids=ids)
+            resumen["eliminados"] += len(ids)
+            resumen["archivos_borrados"] += 1
+            hay_cambios = True
+
+        # El índice léxico se escribe antes que el manifiesto: cuando un lector
+        # ve el manifiesto nuevo, el BM25 ya está al día.
+        if hay_cambios or not os.path.exists(os.path.join(self.db_dir, INDICE_LEXICO)):
+            self._construir_lexico(coleccion)
+            hay_cambios = True
+
+        # Sin cambios no se reescribe: así los lectores no recargan el índice en balde
+        if hay_cambios:
+            guardar_manifiesto(self.db_dir, manifiesto)
+        segundos = time.perf_counter() - inicio
+        resumen["segundos"] = round(segundos, 2)
+        resumen["fragmentos_por_segundo"] = round(resumen["nuevos"] / segundos, 1) if segundos else 0.0
+        return resumen
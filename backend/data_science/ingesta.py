@@ -0,0 +1,86 @@
+"""
+Ingesta en streaming para el RAG: lectura perezosa de documentos y generación
+de embeddings por lotes en un pool de hilos, con reintentos y backoff
+exponencial ante límites de cuota o caídas del proveedor.
+"""
+import glob
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def cargar_documentos(docs_dir, patron="*.txt"):
+    """Genera (nombre, ruta, contenido) archivo a archivo, sin cargar la carpeta entera."""
+    for ruta in sorted(glob.glob(os.path.join(docs_dir, patron))):
+        with open(ruta, encoding="utf-8") as f:
+            yield os.path.relpath(ruta, docs_dir), ruta, f.read()
+
+
+def agrupar(iterable, tamano):
+    """Agrupa un iterable en listas de como mucho `tamano` elementos."""
+    lote = []
+    for elemento in iterable:
+        lote.append(elemento)
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+class EmbebedorPorLotes:
+    """
+    Calcula embeddings por lotes en paralelo.
+
+    - `tamano_lote`: textos por llamada al proveedor.
+    - `hilos`: llamadas simultáneas como máximo.
+    - `reintentos`: intentos extra por lote antes de abortar, con espera
+      exponencial (`espera_base` * 2^n, con jitter y tope `espera_maxima`).
+    """
+
+    def __init__(self, embeddings, tamano_lote=64, hilos=4, reintentos=5,
+                 espera_base=1.0, espera_maxima=30.0):
+        self.embeddings = embeddings
+        self.tamano_lote = tamano_lote
+        self.hilos = hilos
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+
+    def embeber(self, textos):
+        """Embebe un lote reintentando con backoff exponencial."""
+        intento = 0
+        while True:
+            try:
+                return self.embeddings.embed_documents(textos)
+            except Exception as e:
+                if intento >= self.reintentos:
+                    raise
+                espera = min(self.espera_maxima, self.espera_base * (2 ** intento))
+                espera *= random.uniform(0.5, 1.0)
+                print(f"⏳ Lote de {len(textos)} falló ({e}). Reintento {intento + 1} "
+                      f"en {espera:.1f}s")
+                time.sleep(espera)
+                intento += 1
+
+    def procesar(self, fragmentos):
+        """
+        Consume un iterable de fragmentos (id, texto, metadatos) y genera
+        (lote, vectores) según van terminando. Como mucho hay 2 lotes por hilo
+        en vuelo, así que la memoria no crece con el tamaño del corpus.
+        """
+        max_en_vuelo = self.hilos * 2
+        with ThreadPoolExecutor(max_workers=self.hilos) as pool:
+            en_vuelo = {}
+            for lote in agrupar(fragmentos, self.tamano_lote):
+                if len(en_vuelo) >= max_en_vuelo:
+                    hechos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                    for futuro in hechos:
+                        yield en_vuelo.pop(futuro), futuro.result()
+                futuro = pool.submit(self.embeber, [f[1] for f in lote])
+                en_vuelo[futuro] = lote
+            while en_vuelo:
+                hechos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                for futuro in hechos:
+                    yield en_vuelo.pop(futuro), futuro.result()
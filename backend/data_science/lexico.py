@@ -0,0 +1,140 @@
+"""
+Índice léxico BM25 sobre los fragmentos de la normativa.
+
+Los protocolos están llenos de términos legales y números de artículo
+("artículo 12.3", "Fiscalía de Menores") que la búsqueda vectorial no
+siempre encuentra. Este índice se construye al indexar, se guarda junto al
+almacén Chroma y se consulta en memoria sin ninguna llamada de embeddings.
+"""
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter
+
+INDICE_LEXICO = "lexico.json"
+
+# Palabras vacías frecuentes en los protocolos; los números nunca se descartan
+PALABRAS_VACIAS = {
+    "a", "al", "ante", "con", "como", "de", "del", "el", "en", "es", "la", "las",
+    "lo", "los", "o", "para", "por", "que", "se", "su", "sus", "un", "una", "y",
+    "me", "mi", "te", "le", "les", "ha", "han", "hay", "no", "si", "sin", "muy",
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-/][0-9]+)*")
+
+
+def _sin_tildes(texto):
+    descompuesto = unicodedata.normalize("NFD", texto)
+    return "".join(c for c in descompuesto if unicodedata.category(c) != "Mn")
+
+
+def tokenizar(texto):
+    """Minúsculas, sin tildes, conserva numeraciones tipo 12.3 o 3/2007."""
+    tokens = _TOKEN.findall(_sin_tildes(texto.lower()))
+    return [t for t in tokens if t not in PALABRAS_VACIAS]
+
+
+class IndiceBM25:
+    """Índice invertido con puntuación BM25 (k1, b clásicos)."""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = []
+        self.textos = []
+        self.metadatos = []
+        self.longitudes = []
+        self.postings = {}  # término -> [[posición_doc, frecuencia], ...]
+        self.media_longitud = 0.0
+
+    # --- construcción ---
+
+    @classmethod
+    def construir(cls, ids, textos, metadatos, **kwargs):
+        indice = cls(**kwargs)
+        for posicion, (id_fragmento, texto, meta) in enumerate(zip(ids, textos, metadatos)):
+            frecuencias = Counter(tokenizar(texto))
+            indice.ids.append(id_fragmento)
+            indice.textos.append(texto)
+            indice.metadatos.append(meta or {})
+            indice.longitudes.append(sum(frecuencias.values()))
+            for termino, tf in frecuencias.items():
+                indice.postings.setdefault(termino, []).append([posicion, tf])
+        if indice.longitudes:
+            indice.media_longitud = sum(indice.longitudes) / len(indice.longitudes)
+        return indice
+
+    def guardar(self, directorio):
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, INDICE_LEXICO)
+        datos = {
+            "k1": self.k1, "b": self.b, "ids": self.ids, "textos": self.textos,
+            "metadatos": self.metadatos, "longitudes": self.longitudes,
+            "postings": self.postings,
+        }
+        temporal = ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(datos, f, ensure_ascii=False)
+        os.replace(temporal, ruta)
+
+    @classmethod
+    def cargar(cls, directorio):
+        """Devuelve el índice guardado o None si no existe."""
+        ruta = os.path.join(directorio, INDICE_LEXICO)
+        if not os.path.exists(ruta):
+            return None
+        with open(ruta, encoding="utf-8") as f:
+            datos = json.load(f)
+        indice = cls(k1=datos["k1"], b=datos["b"])
+        indice.ids = datos["ids"]
+        indice.textos = datos["textos"]
+        indice.metadatos = datos["metadatos"]
+        indice.longitudes = datos["longitudes"]
+        indice.postings = datos["postings"]
+        if indice.longitudes:
+            indice.media_longitud = sum(indice.longitudes) / len(indice.longitudes)
+        return indice
+
+    # --- consulta ---
+
+    def _idf(self, termino):
+        n = len(self.ids)
+        df = len(self.postings.get(termino, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def buscar(self, consulta, k=5):
+        """
+        Devuelve [(posición, puntuación, fracción de términos cubiertos)]
+        ordenado de mayor a menor puntuación.
+        """
+        terminos = set(tokenizar(consulta))
+        if not terminos or not self.ids:
+            return []
+        puntuaciones = {}
+        coincidencias = Counter()
+        for termino in terminos:
+            idf = self._idf(termino)
+            for posicion, tf in self.postings.get(termino, ()):
+                norma = 1 - self.b + self.b * self.longitudes[posicion] / (self.media_longitud or 1)
+                puntuaciones[posicion] = puntuaciones.get(posicion, 0.0) + \
+                    idf * tf * (self.k1 + 1) / (tf + self.k1 * norma)
+                coincidencias[posicion] += 1
+        mejores = sorted(puntuaciones.items(), key=lambda p: p[1], reverse=True)[:k]
+        return [(pos, puntos, coincidencias[pos] / len(terminos)) for pos, puntos in mejores]
+
+    def es_concluyente(self, resultados, cobertura_minima=0.8, margen_minimo=0.3):
+        """
+        ¿Basta con la respuesta léxica? Sí cuando el mejor fragmento contiene
+        casi todos los términos de la consulta y destaca claramente del segundo.
+        """
+        if not resultados:
+            return False
+        _, primera, cobertura = resultados[0]
+        if cobertura < cobertura_minima:
+            return False
+        if len(resultados) == 1:
+            return True
+        segunda = resultados[1][1]
+        return (primera - segunda) / primera >= margen_minimo
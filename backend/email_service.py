@@ -1,4 +1,66 @@
+"""
+Notificaciones por correo con bandeja de salida (outbox).
+
+- `encolar_notificacion` solo añade filas a `correos_salientes` en la sesión
+  actual: se guardan en el mismo commit que el informe que las origina, y
+  quien registra el informe nunca espera al servidor de correo.
+- `EnviadorCorreos` vacía la bandeja en segundo plano: reclama lotes, los
+  agrupa por centro y envía cada grupo por una conexión SMTP reutilizada de
+  un pool. Un mensaje lleva a todos los destinatarios del mismo aviso.
+- Los fallos temporales se reintentan con espera exponencial; los
+  permanentes (5xx) o los que agotan intentos quedan "muerto" (dead letter)
+  con el último error, para revisarlos y reactivarlos a mano.
+- Modo resumen: los avisos por debajo de la gravedad inmediata de cada
+  centro no salen uno a uno; se acumulan por destinatario durante una
+  ventana y se envían juntos en un único correo con los PDFs adjuntos (o
+  listados si son demasiados). Tras un incidente con decenas de denuncias,
+  dirección recibe un puñado de correos en vez de decenas.
+- Sin SMTP_HOST se simula el envío imprimiendo el correo (modo demo).
+
+Para probar con un servidor SMTP de depuración local:
+    python -m aiosmtpd -n -l localhost:1025      # o: python -m smtpd -n -c DebuggingServer localhost:1025
+    SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=false python main.py
+"""
 import os
+import queue
+import smtplib
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from sqlalchemy import and_, func, or_, select, update
+
+from backend.models import db, CentroEstudios, CorreoSaliente, Informe
+from backend.metricas import contar, observar, registrar_evento
+
+SMTP_HOST = os.getenv("SMTP_HOST", "")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USUARIO = os.getenv("SMTP_USUARIO", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "si", "sí")
+SMTP_REMITENTE = os.getenv("SMTP_REMITENTE", "no-responder@sayit.test")
+SMTP_CONEXIONES = int(os.getenv("SMTP_CONEXIONES", "2"))
+SMTP_TIMEOUT = 30
+
+TAMANO_LOTE_CORREOS = 50
+MAX_INTENTOS_CORREO = 6
+ESPERA_BASE_CORREO = 30
+ESPERA_MAXIMA_CORREO = 3600
+LEASE_CORREO = 300
+INTERVALO_SONDEO_CORREO = 2.0
+
+# Resúmenes: valores por defecto si el centro no tiene los suyos
+RESUMEN_VENTANA_MINUTOS = int(os.getenv("RESUMEN_VENTANA_MINUTOS", "30"))
+RESUMEN_GRAVEDAD_INMEDIATA = os.getenv("RESUMEN_GRAVEDAD_INMEDIATA", "GRAVE").upper()
+RESUMEN_MAX_ADJUNTOS = int(os.getenv("RESUMEN_MAX_ADJUNTOS", "10"))
+RESUMEN_MAX_MB_ADJUNTOS = 15
+# De menor a mayor; una gravedad desconocida ("REVISAR") siempre sale al momento
+NIVELES_GRAVEDAD = ["LEVE", "MODERADO", "GRAVE", "MUY GRAVE", "CRITICO"]
+
 
 def enviar_notificacion_protocolo(destinatarios, asunto, cuerpo, ruta_adjunto):
     """
@@ -10,13 +72,462 @@ def enviar_notificacion_protocolo(destinatarios, asunto, cuerpo, ruta_adjunto):
     print("="*60)
     print(f"📨 PARA:      {', '.join(destinatarios)}")
     print(f"📌 ASUNTO:    {asunto}")
-    
+
     adjunto_nombre = os.path.basename(ruta_adjunto) if ruta_adjunto else "Ninguno"
     print(f"📎 ADJUNTO:   {adjunto_nombre}")
-    
+
     print("-" * 60)
     print("CUERPO DEL MENSAJE:")
     print(cuerpo)
     print("="*60 + "\n")
-    
-    return True
\ No newline at end of file
+
+    return True
+
+
+# --- BANDEJA DE SALIDA ---
+
+def politica_avisos(id_centro):
+    """(minutos de ventana de resumen, gravedad inmediata) del centro."""
+    centro = db.session.get(CentroEstudios, id_centro) if id_centro else None
+    ventana = centro.resumen_ventana_minutos if centro else None
+    umbral = centro.resumen_gravedad_inmediata if centro else None
+    return (RESUMEN_VENTANA_MINUTOS if ventana is None else ventana,
+            (umbral or RESUMEN_GRAVEDAD_INMEDIATA).upper())
+
+
+def configurar_avisos_centro(id_centro, ventana_minutos=None, gravedad_inmediata=None):
+    """
+    Política de avisos de un centro: ventana del resumen en minutos (0 = todo
+    al momento) y gravedad desde la que no se espera. None = valor por defecto.
+    """
+    if gravedad_inmediata and gravedad_inmediata.upper() not in NIVELES_GRAVEDAD:
+        raise ValueError(f"Gravedad desconocida: {gravedad_inmediata}. Usa una de {NIVELES_GRAVEDAD}")
+    centro = db.session.get(CentroEstudios, id_centro)
+    if centro is None:
+        raise LookupError(f"Centro #{id_centro} no encontrado")
+    centro.resumen_ventana_minutos = ventana_minutos
+    centro.resumen_gravedad_inmediata = gravedad_inmediata.upper() if gravedad_inmediata else None
+    db.session.commit()
+
+
+def es_inmediato(gravedad, umbral):
+    gravedad = (gravedad or "").upper()
+    if gravedad not in NIVELES_GRAVEDAD or umbral not in NIVELES_GRAVEDAD:
+        return True
+    return NIVELES_GRAVEDAD.index(gravedad) >= NIVELES_GRAVEDAD.index(umbral)
+
+
+def _fin_ventana(destinatario, minutos, ahora):
+    """Se une a la ventana abierta del destinatario o abre una nueva."""
+    abierta = db.session.execute(
+        select(func.min(CorreoSaliente.disponible_en)).where(
+            CorreoSaliente.destinatario == destinatario,
+            CorreoSaliente.modo == "resumen",
+            CorreoSaliente.estado == "pendiente",
+            CorreoSaliente.disponible_en > ahora)
+    ).scalar()
+    return abierta or ahora + timedelta(minutes=minutos)
+
+
+def encolar_notificacion(destinatarios, asunto, cuerpo, ruta_adjunto=None, id_informe=None,
+                         id_centro=None, gravedad=None, max_intentos=MAX_INTENTOS_CORREO):
+    """
+    Añade a la sesión actual (sin commit) una fila por destinatario distinto.
+    El commit lo hace quien guarda el informe, así aviso e informe van juntos.
+    Según la política del centro y la `gravedad`, el aviso sale al momento o
+    entra en el próximo resumen de cada destinatario.
+    """
+    ahora = datetime.utcnow()
+    ventana, umbral = politica_avisos(id_centro)
+    modo = "inmediato" if ventana <= 0 or es_inmediato(gravedad, umbral) else "resumen"
+    filas = []
+    vistos = set()
+    for destinatario in destinatarios:
+        email = (destinatario or "").strip().lower()
+        if not email or email in vistos:
+            continue
+        vistos.add(email)
+        fila = CorreoSaliente(
+            id_informe=id_informe,
+            id_centro_estudios=id_centro,
+            destinatario=email,
+            asunto=asunto[:200],
+            cuerpo=cuerpo,
+            ruta_adjunto=ruta_adjunto,
+            gravedad=gravedad,
+            modo=modo,
+            estado="pendiente",
+            intentos=0,
+            max_intentos=max_intentos,
+            disponible_en=_fin_ventana(email, ventana, ahora) if modo == "resumen" else ahora,
+        )
+        db.session.add(fila)
+        filas.append(fila)
+    return filas
+
+
+def reactivar_muertos(ids=None):
+    """Vuelve a poner en cola los correos en dead letter (todos o los `ids` dados)."""
+    consulta = update(CorreoSaliente).where(CorreoSaliente.estado == "muerto")
+    if ids is not None:
+        consulta = consulta.where(CorreoSaliente.id_correo.in_(ids))
+    resultado = db.session.execute(consulta.values(
+        estado="pendiente", intentos=0, disponible_en=datetime.utcnow(), ultimo_error=None))
+    db.session.commit()
+    return resultado.rowcount
+
+
+# --- CONEXIONES SMTP ---
+
+class TransporteSimulado:
+    """Sustituye a smtplib.SMTP cuando no hay SMTP_HOST: imprime el correo."""
+
+    def send_message(self, mensaje, from_addr=None, to_addrs=None):
+        adjuntos = [p.get_filename() for p in mensaje.iter_attachments()]
+        cuerpo = mensaje.get_body(preferencelist=("plain",))
+        enviar_notificacion_protocolo(to_addrs or [mensaje["To"]], mensaje["Subject"],
+                                      cuerpo.get_content() if cuerpo else "",
+                                      ", ".join(adjuntos) or None)
+        return {}
+
+    def noop(self):
+        return 250, b"OK"
+
+    def quit(self):
+        pass
+
+
+class PoolSMTP:
+    """
+    Conexiones SMTP abiertas y reutilizables (como mucho `maximo` a la vez).
+    Antes de reutilizar una se comprueba con NOOP; las caídas se descartan.
+    """
+
+    def __init__(self, host=SMTP_HOST, puerto=SMTP_PORT, usuario=SMTP_USUARIO,
+                 password=SMTP_PASSWORD, starttls=SMTP_STARTTLS, maximo=SMTP_CONEXIONES):
+        self.host = host
+        self.puerto = puerto
+        self.usuario = usuario
+        self.password = password
+        self.starttls = starttls
+        self._libres = queue.LifoQueue()
+        self._cupo = threading.BoundedSemaphore(maximo)
+        self.abiertas = 0
+
+    def _abrir(self):
+        if not self.host:
+            return TransporteSimulado()
+        smtp = smtplib.SMTP(self.host, self.puerto, timeout=SMTP_TIMEOUT)
+        if self.starttls:
+            smtp.starttls()
+        if self.usuario:
+            smtp.login(self.usuario, self.password)
+        self.abiertas += 1
+        return smtp
+
+    @staticmethod
+    def _cerrar(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            pass
+
+    def _obtener(self):
+        try:
+            smtp = self._libres.get_nowait()
+        except queue.Empty:
+            return self._abrir()
+        try:
+            if smtp.noop()[0] == 250:
+                return smtp
+        except Exception:
+            pass
+        self._cerrar(smtp)
+        return self._abrir()
+
+    @contextmanager
+    def conexion(self):
+        with self._cupo:
+            smtp = self._obtener()
+            try:
+                yield smtp
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self._cerrar(smtp)
+                raise
+            except Exception:
+                self._libres.put(smtp)
+                raise
+            else:
+                self._libres.put(smtp)
+
+    def cerrar(self):
+        while True:
+            try:
+                self._cerrar(self._libres.get_nowait())
+            except queue.Empty:
+                return
+
+
+def construir_mensaje(destinatarios, asunto, cuerpo, adjuntos=(), remitente=SMTP_REMITENTE):
+    mensaje = EmailMessage()
+    mensaje["From"] = remitente
+    mensaje["To"] = ", ".join(destinatarios)
+    mensaje["Subject"] = asunto
+    mensaje.set_content(cuerpo or "")
+    for ruta in adjuntos:
+        if ruta and os.path.exists(ruta):
+            with open(ruta, "rb") as f:
+                mensaje.add_attachment(f.read(), maintype="application", subtype="pdf",
+                                       filename=os.path.basename(ruta))
+    return mensaje
+
+
+def construir_resumen(destinatario, correos):
+    """Un correo con todos los avisos acumulados de un destinatario."""
+    adjuntos, sin_adjuntar = [], []
+    presupuesto = RESUMEN_MAX_MB_ADJUNTOS * 1024 * 1024
+    lineas = []
+    for correo in sorted(correos, key=lambda c: c.id_informe or 0):
+        ruta = correo.ruta_adjunto
+        tamano = os.path.getsize(ruta) if ruta and os.path.exists(ruta) else None
+        if tamano is not None and len(adjuntos) < RESUMEN_MAX_ADJUNTOS and tamano <= presupuesto:
+            adjuntos.append(ruta)
+            presupuesto -= tamano
+            nota = "PDF adjunto"
+        elif tamano is not None:
+            sin_adjuntar.append(ruta)
+            nota = f"PDF en el archivo de expedientes: {os.path.basename(ruta)}"
+        else:
+            nota = "sin PDF"
+        lineas.append(f"    - Expediente #{correo.id_informe} | Gravedad: {correo.gravedad or 'REVISAR'} | {nota}")
+
+    asunto = f"📋 Resumen Say It: {len(correos)} expediente(s) nuevo(s)"
+    cuerpo = f"""
+    SISTEMA DE GESTIÓN DE INCIDENCIAS 'SAY IT'
+    ==========================================
+    Resumen de denuncias registradas en las últimas horas
+    (los casos graves se notifican por separado al momento).
+
+{chr(10).join(lineas)}
+
+    Los informes PDF adjuntos contienen los detalles confidenciales.
+    """
+    return construir_mensaje([destinatario], asunto, cuerpo, adjuntos)
+
+
+# --- ENVÍO EN SEGUNDO PLANO ---
+
+def consultas_siguiente_lote(ahora, limite):
+    """
+    Candidatos del siguiente lote: pendientes ya vencidos y en curso con el
+    lease caducado. Dos consultas ordenadas por ix_correos_estado_disponible
+    en lugar de un OR que SQLite tendría que ordenar en memoria (sus planes
+    se comprueban en backend/migraciones.py).
+    """
+    columnas = (CorreoSaliente.id_correo, CorreoSaliente.disponible_en)
+    orden = (CorreoSaliente.disponible_en, CorreoSaliente.id_correo)
+    return [
+        select(*columnas).where(CorreoSaliente.estado == "pendiente", CorreoSaliente.disponible_en <= ahora)
+        .order_by(*orden).limit(limite),
+        select(*columnas).where(CorreoSaliente.estado == "en_curso", CorreoSaliente.bloqueado_hasta < ahora)
+        .order_by(*orden).limit(limite),
+    ]
+
+
+class EnviadorCorreos:
+
+    def __init__(self, app, pool=None, tamano_lote=TAMANO_LOTE_CORREOS,
+                 espera_base=ESPERA_BASE_CORREO, lease=LEASE_CORREO):
+        self.app = app
+        self.pool = pool or PoolSMTP()
+        self.tamano_lote = tamano_lote
+        self.espera_base = espera_base
+        self.lease = lease
+        self.enviados = 0
+        self.mensajes = 0
+        self._hilos = []
+        self._parar = threading.Event()
+
+    # --- API ---
+
+    def iniciar(self, hilos=1):
+        """Arranca los workers en segundo plano (hilos daemon)."""
+        self._parar.clear()
+        for n in range(hilos):
+            hilo = threading.Thread(target=self._bucle, name=f"correo-{n}", daemon=True)
+            hilo.start()
+            self._hilos.append(hilo)
+        destino = f"{self.pool.host}:{self.pool.puerto}" if self.pool.host else "simulación"
+        print(f"📧 Envío de correo: {hilos} worker(s) ({destino}).")
+
+    def detener(self, timeout=5):
+        self._parar.set()
+        for hilo in self._hilos:
+            hilo.join(timeout)
+        self._hilos = []
+        self.pool.cerrar()
+
+    def procesar_pendientes(self):
+        """Envía en este hilo todo lo disponible (scripts, pruebas). Devuelve cuántos correos."""
+        total = 0
+        while True:
+            with self.app.app_context():
+                hechos = self._enviar_siguiente_lote()
+            if not hechos:
+                return total
+            total += hechos
+
+    # --- internos ---
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                with self.app.app_context():
+                    hubo = self._enviar_siguiente_lote()
+            except Exception as e:
+                print(f"🔥 ERROR CORREO: {e}")
+                hubo = False
+            if not hubo:
+                self._parar.wait(INTERVALO_SONDEO_CORREO)
+
+    def _disponible(self, ahora):
+        return or_(
+            and_(CorreoSaliente.estado == "pendiente", CorreoSaliente.disponible_en <= ahora),
+            and_(CorreoSaliente.estado == "en_curso", CorreoSaliente.bloqueado_hasta < ahora),
+        )
+
+    def _reclamar_lote(self):
+        """Marca atómicamente hasta `tamano_lote` correos como propios de este worker."""
+        ahora = datetime.utcnow()
+        candidatos = [fila for consulta in consultas_siguiente_lote(ahora, self.tamano_lote)
+                      for fila in db.session.execute(consulta).all()]
+        candidatos.sort(key=lambda f: (f.disponible_en, f.id_correo))
+        ids = [f.id_correo for f in candidatos[:self.tamano_lote]]
+        if not ids:
+            db.session.rollback()
+            return []
+        marca = uuid.uuid4().hex
+        reclamar = dict(estado="en_curso", intentos=CorreoSaliente.intentos + 1,
+                        bloqueado_hasta=ahora + timedelta(seconds=self.lease), reclamado_por=marca)
+        db.session.execute(
+            update(CorreoSaliente)
+            .where(CorreoSaliente.id_correo.in_(ids), self._disponible(ahora))
+            .values(**reclamar)
+        )
+        # Un resumen no se parte entre lotes: se reclama el resto de su ventana
+        con_resumen = db.session.execute(
+            select(CorreoSaliente.destinatario).distinct()
+            .where(CorreoSaliente.reclamado_por == marca, CorreoSaliente.modo == "resumen")
+        ).scalars().all()
+        if con_resumen:
+            db.session.execute(
+                update(CorreoSaliente)
+                .where(CorreoSaliente.destinatario.in_(con_resumen), CorreoSaliente.modo == "resumen",
+                       self._disponible(ahora))
+                .values(**reclamar)
+            )
+        db.session.commit()
+        return db.session.execute(
+            select(CorreoSaliente).where(CorreoSaliente.reclamado_por == marca,
+                                         CorreoSaliente.estado == "en_curso")
+        ).scalars().all()
+
+    def _enviar_siguiente_lote(self):
+        correos = self._reclamar_lote()
+        if not correos:
+            return 0
+
+        # centro -> mensaje -> filas. Un aviso inmediato lleva a todos sus
+        # destinatarios; un resumen, todos los avisos acumulados de uno.
+        por_centro = defaultdict(lambda: defaultdict(list))
+        for correo in correos:
+            if correo.modo == "resumen":
+                clave = ("resumen", correo.destinatario)
+            else:
+                clave = ("aviso", correo.id_informe, correo.asunto, correo.cuerpo, correo.ruta_adjunto)
+            por_centro[correo.id_centro_estudios][clave].append(correo)
+
+        for avisos in por_centro.values():
+            pendientes = list(avisos.items())
+            try:
+                with self.pool.conexion() as smtp:
+                    while pendientes:
+                        clave, filas = pendientes[0]
+                        destinatarios = sorted({f.destinatario for f in filas})
+                        if clave[0] == "resumen":
+                            mensaje = construir_resumen(clave[1], filas)
+                        else:
+                            _, _, asunto, cuerpo, adjunto = clave
+                            mensaje = construir_mensaje(destinatarios, asunto, cuerpo, [adjunto])
+                        inicio = time.perf_counter()
+                        try:
+                            rechazados = smtp.send_message(mensaje, to_addrs=destinatarios)
+                        except smtplib.SMTPRecipientsRefused as e:
+                            rechazados = e.recipients
+                        except smtplib.SMTPResponseException as e:
+                            # Error del servidor con este mensaje: la conexión sigue sirviendo
+                            rechazados = {d: (e.smtp_code, e.smtp_error) for d in destinatarios}
+                        observar("sayit_correo_envio_segundos", time.perf_counter() - inicio,
+                                 modo=clave[0], resultado="rechazado" if rechazados else "ok")
+                        pendientes.pop(0)
+                        self.mensajes += 1
+                        for fila in filas:
+                            if fila.destinatario in rechazados:
+                                codigo, texto = rechazados[fila.destinatario]
+                                self._fallo(fila, f"{codigo} {texto!r}", permanente=codigo >= 500)
+                            else:
+                                self._enviado(fila)
+            except Exception as e:
+                # Sin conexión (o caída a mitad): lo que quede se reintenta más tarde
+                for _, filas in pendientes:
+                    for fila in filas:
+                        self._fallo(fila, e)
+
+        db.session.commit()
+        self._actualizar_informes({c.id_informe for c in correos if c.id_informe})
+        return len(correos)
+
+    def _enviado(self, correo):
+        correo.estado = "enviado"
+        correo.enviado_en = datetime.utcnow()
+        correo.ultimo_error = None
+        self.enviados += 1
+        contar("sayit_correos_total", resultado="enviado")
+
+    def _fallo(self, correo, error, permanente=False):
+        correo.ultimo_error = str(error)[:500]
+        if permanente or correo.intentos >= correo.max_intentos:
+            correo.estado = "muerto"
+            contar("sayit_correos_total", resultado="muerto")
+            registrar_evento("correo_muerto", id_correo=correo.id_correo, id_informe=correo.id_informe,
+                             intentos=correo.intentos, error=str(error)[:200])
+            print(f"☠️ Correo #{correo.id_correo} a {correo.destinatario} descartado tras "
+                  f"{correo.intentos} intento(s): {error}")
+        else:
+            contar("sayit_correos_total", resultado="reintento")
+            espera = min(ESPERA_MAXIMA_CORREO, self.espera_base * 2 ** (correo.intentos - 1))
+            correo.estado = "pendiente"
+            correo.disponible_en = datetime.utcnow() + timedelta(seconds=espera)
+            print(f"⏳ Correo #{correo.id_correo} a {correo.destinatario} reintento en {espera}s: {error}")
+
+    def _actualizar_informes(self, ids_informe):
+        """Un informe queda "notificado" cuando todos sus correos han salido."""
+        if not ids_informe:
+            return
+        resumen = db.session.execute(
+            select(CorreoSaliente.id_informe, CorreoSaliente.estado, func.count())
+            .where(CorreoSaliente.id_informe.in_(ids_informe))
+            .group_by(CorreoSaliente.id_informe, CorreoSaliente.estado)
+        ).all()
+        estados = defaultdict(dict)
+        for id_informe, estado, cuantos in resumen:
+            estados[id_informe][estado] = cuantos
+        for id_informe, cuenta in estados.items():
+            if set(cuenta) == {"enviado"}:
+                db.session.execute(update(Informe).where(Informe.id_informe == id_informe)
+                                   .values(estado_procesamiento="notificado"))
+            elif "muerto" in cuenta:
+                db.session.execute(update(Informe).where(Informe.id_informe == id_informe)
+                                   .values(estado_procesamiento="error",
+                                           error_procesamiento="notificacion: correo no entregado"))
+        db.session.commit()
@@ -0,0 +1,182 @@
+"""
+Exportación masiva de expedientes a un único ZIP (peticiones de Inspección).
+
+- Se seleccionan los informes por centro y rango de fechas y se recorren por
+  lotes (cursor sobre id_informe), nunca todos a la vez en memoria.
+- Cada lote se dibuja en paralelo (pool de procesos de backend/reporting.py)
+  en una carpeta temporal, se añade al ZIP y se borra: en disco solo hay un
+  lote de PDFs sueltos como mucho.
+- Es reanudable: junto al ZIP se guarda `<zip>.estado.json` con el último
+  informe exportado. Si se corta, la misma orden continúa donde se quedó
+  (los expedientes ya presentes en el ZIP no se repiten).
+- Cada lote se añade a una copia (`<zip>.tmp`) que sustituye al ZIP con
+  os.replace antes de guardar el estado: si el proceso muere a mitad de un
+  lote, el ZIP sigue siendo el del último lote completo, nunca uno sin
+  directorio central.
+
+    python -m backend.exportacion --salida inspeccion.zip --centro 3 --desde 2025-01-01 --hasta 2025-06-30
+"""
+import json
+import os
+import shutil
+import zipfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from backend.models import db, Informe
+from backend.pipeline_informes import argumentos_pdf
+from backend.reporting import generar_pdfs_lote
+
+TAMANO_LOTE_EXPORTACION = 200
+
+
+def _consulta(centros=None, desde=None, hasta=None):
+    consulta = select(Informe)
+    if centros is not None:
+        consulta = consulta.where(Informe.id_centro_estudios.in_(centros))
+    if desde:
+        consulta = consulta.where(Informe.fecha_informe >= desde)
+    if hasta:
+        consulta = consulta.where(Informe.fecha_informe < hasta)
+    return consulta
+
+
+def _nombre_en_zip(informe):
+    """Ruta dentro del ZIP: una carpeta por centro y un nombre único por expediente."""
+    fecha = informe.fecha_informe.strftime("%Y%m%d") if informe.fecha_informe else "sin_fecha"
+    return f"centro_{informe.id_centro_estudios or 'sin_centro'}/Expediente_{informe.id_informe}_{fecha}.pdf"
+
+
+def _cargar_estado(ruta_estado, filtros):
+    if not os.path.exists(ruta_estado):
+        return None
+    with open(ruta_estado, encoding="utf-8") as f:
+        estado = json.load(f)
+    if estado.get("filtros") != filtros:
+        raise ValueError("Ya hay una exportación a medias en ese ZIP con otros filtros. "
+                         "Usa otro nombre de salida o borra el ZIP y su .estado.json.")
+    return estado
+
+
+def _guardar_estado(ruta_estado, estado):
+    temporal = ruta_estado + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(estado, f, ensure_ascii=False)
+    os.replace(temporal, ruta_estado)
+
+
+def exportar_expedientes(salida, centros=None, desde=None, hasta=None, procesos=None,
+                         tamano_lote=TAMANO_LOTE_EXPORTACION, progreso=None):
+    """
+    Escribe en `salida` (.zip) los expedientes que cumplan los filtros.
+    `progreso(hechos, total)` se llama tras cada lote. Devuelve un resumen dict.
+    Si `salida` tiene una exportación a medias con los mismos filtros, la continúa.
+    """
+    filtros = {
+        "centros": sorted(centros) if centros is not None else None,
+        "desde": desde.isoformat() if desde else None,
+        "hasta": hasta.isoformat() if hasta else None,
+    }
+    ruta_estado = salida + ".estado.json"
+    estado = _cargar_estado(ruta_estado, filtros)
+    if estado is None:
+        if os.path.exists(salida):
+            os.remove(salida)  # un ZIP terminado con el mismo nombre se sustituye
+        estado = {"filtros": filtros, "ultimo_id": 0, "exportados": 0, "fallidos": [],
+                  "inicio": datetime.utcnow().isoformat()}
+    elif estado["ultimo_id"]:
+        print(f"↩️  Reanudando exportación tras el expediente #{estado['ultimo_id']} "
+              f"({estado['exportados']} ya en el ZIP).")
+
+    consulta = _consulta(centros, desde, hasta)
+    total = db.session.execute(
+        select(func.count()).select_from(consulta.subquery())).scalar()
+    carpeta_lote = salida + ".lote"
+    os.makedirs(os.path.dirname(os.path.abspath(salida)), exist_ok=True)
+
+    try:
+        while True:
+            informes = db.session.execute(
+                consulta.where(Informe.id_informe > estado["ultimo_id"])
+                .order_by(Informe.id_informe).limit(tamano_lote)
+            ).scalars().all()
+            if not informes:
+                break
+
+            temporal = salida + ".tmp"
+            if os.path.exists(salida):
+                shutil.copyfile(salida, temporal)
+            elif os.path.exists(temporal):
+                os.remove(temporal)  # restos de un lote que no llegó a terminar
+            with zipfile.ZipFile(temporal, "a", compression=zipfile.ZIP_DEFLATED) as archivo:
+                ya_en_zip = set(archivo.namelist())
+                pendientes = [i for i in informes if _nombre_en_zip(i) not in ya_en_zip]
+                argumentos = [dict(argumentos_pdf(i), nombre_archivo=f"{i.id_informe}.pdf")
+                              for i in pendientes]
+                rutas = generar_pdfs_lote(argumentos, procesos=procesos, directorio=carpeta_lote)
+                for informe, ruta in zip(pendientes, rutas):
+                    if ruta:
+                        archivo.write(ruta, _nombre_en_zip(informe))
+                        os.remove(ruta)
+                        estado["exportados"] += 1
+                    else:
+                        estado["fallidos"].append(informe.id_informe)
+                estado["exportados"] += len(informes) - len(pendientes)
+            os.replace(temporal, salida)
+
+            estado["ultimo_id"] = informes[-1].id_informe
+            _guardar_estado(ruta_estado, estado)
+            db.session.rollback()  # suelta la transacción de lectura entre lotes
+            hechos = estado["exportados"] + len(estado["fallidos"])
+            if progreso:
+                progreso(hechos, total)
+    finally:
+        shutil.rmtree(carpeta_lote, ignore_errors=True)
+        if os.path.exists(salida + ".tmp"):
+            os.remove(salida + ".tmp")
+
+    # Terminado: el estado solo sirve para reanudar
+    if os.path.exists(ruta_estado):
+        os.remove(ruta_estado)
+    if not os.path.exists(salida):
+        with zipfile.ZipFile(salida, "w"):
+            pass  # sin expedientes: ZIP vacío, pero válido
+    return {
+        "salida": salida,
+        "total": total,
+        "exportados": estado["exportados"],
+        "fallidos": estado["fallidos"],
+    }
+
+
+def _fecha(texto, fin_de_dia=False):
+    """'AAAA-MM-DD' -> datetime (el límite superior incluye el día entero)."""
+    if not texto:
+        return None
+    fecha = datetime.strptime(texto, "%Y-%m-%d")
+    return fecha + timedelta(days=1) if fin_de_dia else fecha
+
+
+if __name__ == "__main__":
+    import argparse
+    from main import app
+
+    parser = argparse.ArgumentParser(description="Exporta expedientes PDF a un ZIP")
+    parser.add_argument("--salida", required=True, help="Ruta del ZIP")
+    parser.add_argument("--centro", type=int, action="append", help="ID de centro (repetible)")
+    parser.add_argument("--desde", help="AAAA-MM-DD (incluido)")
+    parser.add_argument("--hasta", help="AAAA-MM-DD (incluido)")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos de dibujo (def.: núcleos)")
+    parser.add_argument("--lote", type=int, default=TAMANO_LOTE_EXPORTACION)
+    args = parser.parse_args()
+
+    def mostrar(hechos, total):
+        print(f"📦 {hechos}/{total} expedientes ({100 * hechos / max(total, 1):.0f}%)")
+
+    with app.app_context():
+        resumen = exportar_expedientes(args.salida, centros=args.centro, desde=_fecha(args.desde),
+                                       hasta=_fecha(args.hasta, fin_de_dia=True),
+                                       procesos=args.procesos, tamano_lote=args.lote, progreso=mostrar)
+    print(f"✅ {resumen['exportados']} expedientes en {resumen['salida']}"
+          + (f" ({len(resumen['fallidos'])} fallidos: {resumen['fallidos']})" if resumen["fallidos"] else ""))
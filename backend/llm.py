@@ -0,0 +1,293 @@
+"""
+Acceso al modelo de lenguaje.
+
+- `ModeloFalso` imita la parte de `genai.GenerativeModel` que usa la app:
+  `generate_content` con o sin `stream=True`. Se activa con LLM_BACKEND=falso
+  (demos, pruebas y benchmarks sin API key).
+- `ClienteLLM` envuelve un modelo (real o falso) con la misma interfaz y
+  añade caché (solo de prompts sin datos del alumno), agrupación de
+  peticiones idénticas en vuelo y un límite de llamadas simultáneas.
+"""
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from backend.metricas import contar, observar, registrar_evento
+from backend.prompts import estimar_tokens
+
+LLM_CACHE_ENTRADAS = int(os.getenv("LLM_CACHE_ENTRADAS", "512"))
+LLM_CACHE_TTL_SEGUNDOS = int(os.getenv("LLM_CACHE_TTL_SEGUNDOS", "3600"))
+LLM_CONCURRENCIA = int(os.getenv("LLM_CONCURRENCIA", "8"))
+# Las claves de la caché son HMAC: el texto del alumno nunca se guarda como clave
+_SECRETO_CACHE = os.getenv("LLM_CACHE_SECRETO", "").encode() or secrets.token_bytes(32)
+
+# Un mensaje solo se cachea de larga duración si TODAS sus palabras están aquí:
+# por construcción no puede llevar nombres, lugares ni fechas
+VOCABULARIO_CACHEABLE = {
+    "hola", "buenas", "buenos", "buen", "dia", "dias", "tardes", "noches", "hey", "ey",
+    "que", "tal", "gracias", "muchas", "vale", "ok", "si", "no", "adios", "hasta", "luego",
+    "necesito", "ayuda", "quiero", "hablar", "contar", "algo", "estas", "como",
+}
+MAX_PALABRAS_CACHEABLE = 6
+
+
+class _Fragmento:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Respuesta:
+    """Respuesta completa o en streaming, como las de google.generativeai."""
+
+    def __init__(self, texto, stream=False, trozos=4, latencia=0.0):
+        self.text = texto
+        self._stream = stream
+        self._trozos = trozos
+        self._latencia = latencia
+
+    def __iter__(self):
+        if not self._stream:
+            yield _Fragmento(self.text)
+            return
+        palabras = self.text.split(" ")
+        paso = max(1, len(palabras) // self._trozos)
+        for i in range(0, len(palabras), paso):
+            if self._latencia:
+                time.sleep(self._latencia / self._trozos)
+            trozo = " ".join(palabras[i:i + paso])
+            yield _Fragmento(trozo if i == 0 else " " + trozo)
+
+
+def _texto_de(contenidos):
+    """Texto del último mensaje, acepte el prompt como str o como lista de contents."""
+    if isinstance(contenidos, str):
+        return contenidos
+    ultimo = contenidos[-1] if contenidos else ""
+    if isinstance(ultimo, dict):
+        return " ".join(str(p) for p in ultimo.get("parts", []))
+    return str(ultimo)
+
+
+class ModeloFalso:
+    """
+    Respuestas deterministas:
+    - Si el prompt pide JSON (análisis de riesgo) devuelve un informe válido.
+    - Si es un saludo, responde con el saludo del protocolo.
+    - En otro caso, una respuesta empática que pide los datos que faltan.
+    """
+
+    def __init__(self, latencia=0.0):
+        self.latencia = latencia
+        self.llamadas = 0
+
+    def _responder(self, texto):
+        if "JSON" in texto:
+            return json.dumps({
+                "rol_informante": "VÍCTIMA",
+                "tipo_incidente": ["Verbal"],
+                "nivel_gravedad": "MODERADO",
+                "resumen_hechos": "El alumno describe un episodio de acoso que requiere revisión.",
+                "nombres_involucrados": ["Desconocido"],
+            }, ensure_ascii=False)
+        if texto.strip().lower().rstrip("!.") in ("hola", "buenas", "hey", "buenos días"):
+            return ("Hola. Estoy aquí para escucharte de forma segura y confidencial. "
+                    "¿Quieres contarme algo o necesitas ayuda?")
+        return ("Siento mucho que estés pasando por eso. ¿Puedes decirme quién estaba "
+                "implicado y cuándo y dónde ocurrió?")
+
+    def generate_content(self, contenidos, stream=False, **kwargs):
+        self.llamadas += 1
+        texto = self._responder(_texto_de(contenidos))
+        if self.latencia and not stream:
+            time.sleep(self.latencia)
+        return _Respuesta(texto, stream=stream, latencia=self.latencia)
+
+
+def _normalizar(texto):
+    """Minúsculas, sin tildes, sin signos y con espacios simples."""
+    texto = unicodedata.normalize("NFD", texto.casefold())
+    texto = "".join(c for c in texto if unicodedata.category(c) != "Mn")
+    return " ".join(re.sub(r"[^\w\s]", " ", texto).split())
+
+
+def _mensajes(contenidos):
+    """[(rol, texto), ...] de un prompt dado como str o como lista de contents."""
+    if isinstance(contenidos, str):
+        return [("user", contenidos)]
+    mensajes = []
+    for item in contenidos:
+        if isinstance(item, dict):
+            mensajes.append((item.get("role", "user"),
+                             " ".join(str(p) for p in item.get("parts", []))))
+        else:
+            mensajes.append(("user", str(item)))
+    return mensajes
+
+
+def es_cacheable(contenidos):
+    """
+    Política de datos: solo un mensaje suelto (sin historial) formado
+    únicamente por palabras de VOCABULARIO_CACHEABLE ("Hola", "Buenas
+    tardes", "Gracias"). Todo lo demás puede contener datos personales.
+    """
+    mensajes = _mensajes(contenidos)
+    if len(mensajes) != 1:
+        return False
+    palabras = _normalizar(mensajes[0][1]).split()
+    return 0 < len(palabras) <= MAX_PALABRAS_CACHEABLE and all(
+        p in VOCABULARIO_CACHEABLE for p in palabras)
+
+
+class ClienteLLM:
+    """
+    Mismo `generate_content` que el modelo envuelto, más:
+    - caché LRU con caducidad por prompt normalizado, solo para los prompts
+      cacheables (`es_cacheable`) y durante LLM_CACHE_TTL_SEGUNDOS. Las
+      respuestas con datos del alumno no se guardan nunca.
+    - agrupación: si llega una petición idéntica a otra que aún está en
+      vuelo (doble clic en FINALIZAR), espera su resultado en lugar de
+      llamar otra vez al modelo. Vale también para las no cacheables.
+    - como mucho `concurrencia` llamadas al modelo a la vez.
+    `metricas()` devuelve los contadores y la tasa de aciertos.
+    """
+
+    def __init__(self, modelo, nombre="llm", entradas=LLM_CACHE_ENTRADAS,
+                 ttl_segundos=LLM_CACHE_TTL_SEGUNDOS, concurrencia=LLM_CONCURRENCIA):
+        self.modelo = modelo
+        self.nombre = nombre
+        self.entradas = entradas
+        self.ttl_segundos = ttl_segundos
+        self._cache = OrderedDict()  # clave -> (caduca, texto)
+        self._en_vuelo = {}          # clave -> Future
+        self._cerrojo = threading.Lock()
+        self._cupo = threading.BoundedSemaphore(concurrencia)
+        self._contadores = {"peticiones": 0, "aciertos": 0, "agrupadas": 0,
+                            "llamadas": 0, "errores": 0, "streaming": 0}
+
+    def _clave(self, contenidos, kwargs):
+        mensajes = [(rol, _normalizar(texto)) for rol, texto in _mensajes(contenidos)]
+        material = json.dumps([mensajes, kwargs], sort_keys=True, default=str, ensure_ascii=False)
+        return hmac.new(_SECRETO_CACHE, material.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def _leer(self, clave):
+        entrada = self._cache.get(clave)
+        if entrada is None:
+            return None
+        if entrada[0] < time.monotonic():
+            del self._cache[clave]
+            return None
+        self._cache.move_to_end(clave)
+        return entrada[1]
+
+    def _guardar(self, clave, texto, segundos):
+        if segundos <= 0:
+            return
+        self._cache[clave] = (time.monotonic() + segundos, texto)
+        self._cache.move_to_end(clave)
+        while len(self._cache) > self.entradas:
+            self._cache.popitem(last=False)
+
+    def _contar(self, contador):
+        with self._cerrojo:
+            self._contadores[contador] += 1
+
+    def _anotar(self, modo, inicio, resultado, contenidos, salida="", uso=None):
+        """Duración, tokens (los del modelo o estimados) y evento de una llamada."""
+        segundos = time.perf_counter() - inicio
+        observar("sayit_llm_duracion_segundos", segundos, modelo=self.nombre, modo=modo, resultado=resultado)
+        entrada = getattr(uso, "prompt_token_count", None)
+        generados = getattr(uso, "candidates_token_count", None)
+        if entrada is None:
+            entrada = sum(estimar_tokens(texto) for _, texto in _mensajes(contenidos))
+        if generados is None:
+            generados = estimar_tokens(salida) if salida else 0
+        contar("sayit_llm_tokens_total", entrada, modelo=self.nombre, tipo="entrada")
+        contar("sayit_llm_tokens_total", generados, modelo=self.nombre, tipo="salida")
+        registrar_evento("llm", modelo=self.nombre, modo=modo, resultado=resultado,
+                         duracion_ms=round(segundos * 1000, 1),
+                         tokens_entrada=entrada, tokens_salida=generados)
+
+    def _llamar(self, contenidos, stream=False, **kwargs):
+        with self._cupo:
+            self._contar("llamadas")
+            inicio = time.perf_counter()
+            try:
+                respuesta = self.modelo.generate_content(contenidos, stream=stream, **kwargs)
+            except Exception:
+                self._anotar("completo", inicio, "error", contenidos)
+                raise
+            self._anotar("completo", inicio, "ok", contenidos, respuesta.text,
+                         getattr(respuesta, "usage_metadata", None))
+            return respuesta
+
+    def _stream(self, contenidos, kwargs):
+        """El cupo se mantiene ocupado mientras se consume la respuesta."""
+        with self._cupo:
+            self._contar("llamadas")
+            inicio = time.perf_counter()
+            trozos, uso = [], None
+            try:
+                for trozo in self.modelo.generate_content(contenidos, stream=True, **kwargs):
+                    trozos.append(getattr(trozo, "text", "") or "")
+                    # El recuento de tokens llega con el último fragmento
+                    uso = getattr(trozo, "usage_metadata", None) or uso
+                    yield trozo
+            except Exception:
+                self._contar("errores")
+                self._anotar("stream", inicio, "error", contenidos, "".join(trozos))
+                raise
+            self._anotar("stream", inicio, "ok", contenidos, "".join(trozos), uso)
+
+    def generate_content(self, contenidos, stream=False, **kwargs):
+        cacheable = es_cacheable(contenidos)
+        self._contar("peticiones")
+        if stream and not cacheable:
+            # Un turno de chat con historial no se repite: directo al modelo
+            self._contar("streaming")
+            return self._stream(contenidos, kwargs)
+
+        clave = self._clave(contenidos, kwargs)
+        with self._cerrojo:
+            texto = self._leer(clave)
+            if texto is not None:
+                self._contadores["aciertos"] += 1
+                return _Respuesta(texto)
+            futuro = self._en_vuelo.get(clave)
+            lider = futuro is None
+            if lider:
+                futuro = self._en_vuelo[clave] = Future()
+            else:
+                self._contadores["agrupadas"] += 1
+        if not lider:
+            return _Respuesta(futuro.result())
+
+        try:
+            texto = self._llamar(contenidos, **kwargs).text
+        except Exception as e:
+            with self._cerrojo:
+                self._contadores["errores"] += 1
+                del self._en_vuelo[clave]
+            futuro.set_exception(e)
+            raise
+        with self._cerrojo:
+            if cacheable:
+                self._guardar(clave, texto, self.ttl_segundos)
+            del self._en_vuelo[clave]
+        futuro.set_result(texto)
+        # En streaming se entrega de una vez: ya está completa
+        return _Respuesta(texto)
+
+    def metricas(self):
+        with self._cerrojo:
+            datos = dict(self._contadores, entradas_cache=len(self._cache),
+                         en_vuelo=len(self._en_vuelo))
+        datos["tasa_aciertos"] = (datos["aciertos"] + datos["agrupadas"]) / max(datos["peticiones"], 1)
+        return datos
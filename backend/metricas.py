@@ -0,0 +1,324 @@
+"""
+Métricas de las rutas calientes y registro estructurado.
+
+- Contadores e histogramas en memoria, con etiquetas y seguros entre hilos.
+  `cronometro(nombre, **etiquetas)` mide un bloque y lo etiqueta con
+  resultado="ok" o "error".
+- `exportar_prometheus()` los devuelve en el formato de texto de Prometheus.
+  `registrar_en_flask(app)` los publica en /metrics y `servir_metricas`
+  levanta ese endpoint junto a la interfaz (METRICAS_PUERTO).
+- `registrar_evento(evento, **campos)` escribe una línea JSON en stderr con
+  el id de petición en curso. El id nace en la acción del usuario (login,
+  chat, denuncia...) o en la petición HTTP y viaja con los trabajos de la
+  cola, así que un informe se puede seguir desde el formulario hasta el correo.
+- Las consultas SQL se miden con eventos del Engine (como los PRAGMA de
+  backend/database.py) y las lentas se registran.
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LOG_EVENTOS = os.getenv("LOG_EVENTOS", "json").lower() != "no"
+LOG_CONSULTA_LENTA_MS = float(os.getenv("LOG_CONSULTA_LENTA_MS", "250"))
+METRICAS_HOST = os.getenv("METRICAS_HOST", "127.0.0.1")
+METRICAS_PUERTO = int(os.getenv("METRICAS_PUERTO", "9464"))  # 0 = sin endpoint
+
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LIMITES_SQL = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+# nombre -> (tipo, ayuda, límites de los cubos si es histograma)
+METRICAS = {
+    "sayit_peticion_duracion_segundos": ("histogram", "Acciones del usuario (login, chat, denuncia, dashboard...)", LIMITES_SEGUNDOS),
+    "sayit_http_peticiones_total": ("counter", "Peticiones HTTP a la app Flask", None),
+    "sayit_llm_duracion_segundos": ("histogram", "Llamadas al modelo de lenguaje (las respondidas por la caché no cuentan)", LIMITES_SEGUNDOS),
+    "sayit_llm_tokens_total": ("counter", "Tokens de entrada y salida (estimados si el modelo no los informa)", None),
+    "sayit_llm_cliente": ("gauge", "Contadores del ClienteLLM: peticiones, aciertos de caché, agrupadas, tasa de aciertos...", None),
+    "sayit_rag_duracion_segundos": ("histogram", "Búsqueda de normativa (RAG)", LIMITES_SEGUNDOS),
+    "sayit_bd_consulta_segundos": ("histogram", "Sentencias SQL por operación", LIMITES_SQL),
+    "sayit_pdf_duracion_segundos": ("histogram", "Dibujo de un expediente PDF", LIMITES_SEGUNDOS),
+    "sayit_pdf_lote_segundos": ("histogram", "Lote de expedientes en el pool de procesos", LIMITES_SEGUNDOS),
+    "sayit_pdf_generados_total": ("counter", "Expedientes PDF generados en lote", None),
+    "sayit_correo_envio_segundos": ("histogram", "Entrega SMTP de un mensaje (aviso o resumen)", LIMITES_SEGUNDOS),
+    "sayit_correos_total": ("counter", "Correos de la bandeja de salida por desenlace", None),
+    "sayit_trabajo_duracion_segundos": ("histogram", "Etapas de la cola de informes", LIMITES_SEGUNDOS),
+}
+
+_id_peticion = contextvars.ContextVar("id_peticion", default=None)
+_log = logging.getLogger("sayit.eventos")
+
+
+class Registro:
+    """Valores de las métricas de METRICAS, por combinación de etiquetas."""
+
+    def __init__(self):
+        self._cerrojo = threading.Lock()
+        self._contadores = defaultdict(float)  # (nombre, etiquetas) -> valor
+        self._histogramas = {}                 # (nombre, etiquetas) -> [cubos..., suma, cuenta]
+        self._medidores = []                   # funciones -> [(nombre, etiquetas dict, valor)]
+
+    @staticmethod
+    def _etiquetas(etiquetas):
+        return tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+    def contar(self, nombre, valor=1, **etiquetas):
+        if METRICAS[nombre][0] != "counter":
+            raise ValueError(f"{nombre} no es un contador")
+        with self._cerrojo:
+            self._contadores[(nombre, self._etiquetas(etiquetas))] += valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        tipo, _, limites = METRICAS[nombre]
+        if tipo != "histogram":
+            raise ValueError(f"{nombre} no es un histograma")
+        clave = (nombre, self._etiquetas(etiquetas))
+        with self._cerrojo:
+            datos = self._histogramas.get(clave)
+            if datos is None:
+                datos = self._histogramas[clave] = [0] * len(limites) + [0.0, 0]
+            for i, limite in enumerate(limites):
+                if valor <= limite:
+                    datos[i] += 1
+                    break
+            datos[-2] += valor
+            datos[-1] += 1
+
+    def medidor(self, funcion):
+        """`funcion()` -> [(nombre, etiquetas, valor)], se consulta al exportar."""
+        self._medidores.append(funcion)
+
+    def exportar(self):
+        """Formato de texto de Prometheus (versión 0.0.4)."""
+        with self._cerrojo:
+            contadores = dict(self._contadores)
+            histogramas = {clave: list(datos) for clave, datos in self._histogramas.items()}
+        medidores = defaultdict(list)
+        for funcion in self._medidores:
+            try:
+                for nombre, etiquetas, valor in funcion():
+                    medidores[nombre].append((self._etiquetas(etiquetas), valor))
+            except Exception as e:
+                registrar_evento("error_medidor", error=str(e))
+
+        lineas = []
+        for nombre, (tipo, ayuda, limites) in METRICAS.items():
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} {tipo}")
+            if tipo == "counter":
+                for (n, etiquetas), valor in sorted(contadores.items()):
+                    if n == nombre:
+                        lineas.append(f"{nombre}{_formatear(etiquetas)} {_numero(valor)}")
+            elif tipo == "gauge":
+                for etiquetas, valor in sorted(medidores.get(nombre, [])):
+                    lineas.append(f"{nombre}{_formatear(etiquetas)} {_numero(valor)}")
+            else:
+                for (n, etiquetas), datos in sorted(histogramas.items()):
+                    if n != nombre:
+                        continue
+                    acumulado = 0
+                    for limite, cuenta in zip(limites, datos):
+                        acumulado += cuenta
+                        lineas.append(f"{nombre}_bucket{_formatear(etiquetas + (('le', _numero(limite)),))} {acumulado}")
+                    lineas.append(f"{nombre}_bucket{_formatear(etiquetas + (('le', '+Inf'),))} {datos[-1]}")
+                    lineas.append(f"{nombre}_sum{_formatear(etiquetas)} {_numero(datos[-2])}")
+                    lineas.append(f"{nombre}_count{_formatear(etiquetas)} {datos[-1]}")
+        return "\n".join(lineas) + "\n"
+
+
+def _formatear(etiquetas):
+    if not etiquetas:
+        return ""
+    escapar = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in etiquetas) + "}"
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+registro = Registro()
+contar = registro.contar
+observar = registro.observar
+exportar_prometheus = registro.exportar
+
+
+@contextmanager
+def cronometro(nombre, **etiquetas):
+    """Observa la duración del bloque en el histograma `nombre` con resultado ok/error."""
+    inicio = time.perf_counter()
+    resultado = "ok"
+    try:
+        yield
+    except BaseException:
+        resultado = "error"
+        raise
+    finally:
+        observar(nombre, time.perf_counter() - inicio, resultado=resultado, **etiquetas)
+
+
+# --- REGISTRO ESTRUCTURADO ---
+
+def _configurar_log():
+    if not LOG_EVENTOS or _log.handlers:
+        return
+    manejador = logging.StreamHandler(sys.stderr)
+    manejador.setFormatter(logging.Formatter("%(message)s"))
+    _log.addHandler(manejador)
+    _log.setLevel(logging.INFO)
+    _log.propagate = False
+
+
+_configurar_log()
+
+
+def id_peticion_actual():
+    return _id_peticion.get()
+
+
+@contextmanager
+def con_id_peticion(id_peticion=None):
+    """Fija el id de petición del bloque (uno nuevo si no se da) y lo devuelve."""
+    token = _id_peticion.set(id_peticion or uuid.uuid4().hex[:16])
+    try:
+        yield _id_peticion.get()
+    finally:
+        _id_peticion.reset(token)
+
+
+def registrar_evento(evento, **campos):
+    """Una línea JSON con marca de tiempo, evento e id de petición."""
+    if not LOG_EVENTOS:
+        return
+    linea = {"ts": datetime.utcnow().isoformat(timespec="milliseconds") + "Z", "evento": evento,
+             "id_peticion": _id_peticion.get(), **campos}
+    _log.info(json.dumps(linea, ensure_ascii=False, default=str))
+
+
+def accion_medida(accion):
+    """
+    Decorador para los manejadores de la interfaz: cada llamada lleva su id
+    de petición, se mide en sayit_peticion_duracion_segundos y deja un evento.
+    Admite generadores (chat en streaming): el id se fija en cada paso.
+    """
+    def decorador(funcion):
+        def terminar(id_peticion, inicio, resultado):
+            segundos = time.perf_counter() - inicio
+            observar("sayit_peticion_duracion_segundos", segundos, accion=accion, resultado=resultado)
+            with con_id_peticion(id_peticion):
+                registrar_evento("peticion", accion=accion, resultado=resultado,
+                                 duracion_ms=round(segundos * 1000, 1))
+
+        if inspect.isgeneratorfunction(funcion):
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                id_peticion, inicio, resultado = uuid.uuid4().hex[:16], time.perf_counter(), "ok"
+                generador = funcion(*args, **kwargs)
+                try:
+                    while True:
+                        with con_id_peticion(id_peticion):
+                            try:
+                                valor = next(generador)
+                            except StopIteration:
+                                return
+                        yield valor
+                except GeneratorExit:
+                    resultado = "cancelada"  # el alumno cerró o recargó a mitad de respuesta
+                    raise
+                except BaseException:
+                    resultado = "error"
+                    raise
+                finally:
+                    terminar(id_peticion, inicio, resultado)
+        else:
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                with con_id_peticion() as id_peticion:
+                    inicio, resultado = time.perf_counter(), "ok"
+                    try:
+                        return funcion(*args, **kwargs)
+                    except BaseException:
+                        resultado = "error"
+                        raise
+                    finally:
+                        terminar(id_peticion, inicio, resultado)
+        return envoltura
+    return decorador
+
+
+# --- SQL ---
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _antes_sql(conexion, cursor, sentencia, parametros, contexto, executemany):
+    # En el contexto de la ejecución, no en la conexión: si la sentencia falla
+    # no hay after_cursor_execute y el inicio se va con el contexto
+    if contexto is not None:
+        contexto._inicio_sql = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _despues_sql(conexion, cursor, sentencia, parametros, contexto, executemany):
+    inicio = getattr(contexto, "_inicio_sql", None)
+    if inicio is None:
+        return
+    segundos = time.perf_counter() - inicio
+    operacion = sentencia.lstrip().split(None, 1)[0].upper() if sentencia.strip() else "?"
+    observar("sayit_bd_consulta_segundos", segundos, operacion=operacion)
+    if segundos * 1000 >= LOG_CONSULTA_LENTA_MS:
+        registrar_evento("consulta_lenta", duracion_ms=round(segundos * 1000, 1),
+                         sql=" ".join(sentencia.split())[:300])
+
+
+# --- ENDPOINT ---
+
+def registrar_en_flask(app):
+    """/metrics en la app Flask e id de petición (cabecera X-Request-ID) en cada petición HTTP."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _inicio_peticion():
+        g.inicio_peticion = time.perf_counter()
+        g.token_peticion = _id_peticion.set(request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16])
+
+    @app.after_request
+    def _fin_peticion(respuesta):
+        respuesta.headers["X-Request-ID"] = _id_peticion.get() or ""
+        ruta = request.url_rule.rule if request.url_rule else "desconocida"
+        contar("sayit_http_peticiones_total", ruta=ruta, estado=respuesta.status_code)
+        if ruta != "/metrics":
+            registrar_evento("http", metodo=request.method, ruta=ruta, estado=respuesta.status_code,
+                             duracion_ms=round((time.perf_counter() - g.inicio_peticion) * 1000, 1))
+        return respuesta
+
+    @app.teardown_request
+    def _limpiar_peticion(error=None):
+        token = g.pop("token_peticion", None)
+        if token is not None:
+            _id_peticion.reset(token)
+
+    @app.route("/metrics")
+    def metricas():
+        return Response(exportar_prometheus(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+def servir_metricas(app, host=METRICAS_HOST, puerto=METRICAS_PUERTO):
+    """Sirve la app Flask (con /metrics) en un hilo aparte; Gradio tiene su propio servidor."""
+    if not puerto:
+        return None
+    from werkzeug.serving import make_server
+
+    servidor = make_server(host, puerto, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    print(f"📈 Métricas en http://{host}:{puerto}/metrics")
+    return servidor
@@ -0,0 +1,235 @@
+"""
+Migraciones versionadas del esquema.
+
+`db.create_all()` solo crea las tablas que faltan: no añade columnas ni
+índices a un `bullying.db` que ya existe. Aquí cada cambio de esquema es una
+migración numerada que se aplica una sola vez y queda anotada en la tabla
+`version_esquema`. Todas son idempotentes (comprueban antes de crear), así
+que una base a medio migrar se puede volver a migrar sin riesgo.
+
+    python -m backend.migraciones              # aplica las pendientes
+    python -m backend.migraciones --estado     # versión actual
+    python -m backend.migraciones --verificar  # comprueba que las consultas calientes usan índices
+
+Para añadir una migración: escribir la función y añadirla al final de
+MIGRACIONES con el siguiente número. Nunca reordenar ni renumerar.
+"""
+import sys
+from datetime import datetime
+
+from sqlalchemy import inspect, select, text
+
+from backend.models import (db, Alumno, CentroEstudios, CorreoSaliente, Director, Identidad,
+                            Informe, Profesor, SesionChat, Trabajo, TurnoChat, Tutor,
+                            codificar_cursor, consulta_pagina_informes)
+
+TABLA_VERSION = "version_esquema"
+
+
+# --- utilidades idempotentes ---
+
+def _columnas(conexion, tabla):
+    return {c["name"] for c in inspect(conexion).get_columns(tabla)}
+
+
+def _anadir_columnas(conexion, modelo, *atributos):
+    """ALTER TABLE ... ADD COLUMN para las columnas del modelo que aún no existen."""
+    tabla = modelo.__table__
+    existentes = _columnas(conexion, tabla.name)
+    for atributo in atributos:
+        columna = getattr(modelo, atributo).property.columns[0]
+        if columna.name in existentes:
+            continue
+        tipo = columna.type.compile(dialect=conexion.dialect)
+        conexion.execute(text(f'ALTER TABLE {tabla.name} ADD COLUMN {columna.name} {tipo}'))
+        print(f"   + {tabla.name}.{columna.name}")
+
+
+def _crear_indices(conexion, modelo):
+    """Crea los índices declarados en el modelo que aún no existen."""
+    for indice in modelo.__table__.indexes:
+        indice.create(conexion, checkfirst=True)
+
+
+# --- migraciones ---
+
+def _m001_tablas_base(conexion):
+    """Tablas que no existan (instalación nueva, o `trabajos` e `identidades`)."""
+    db.metadata.create_all(conexion, checkfirst=True)
+
+
+def _m002_columnas_nuevas(conexion):
+    """Columnas añadidas al modelo después de crear el primer bullying.db."""
+    _anadir_columnas(conexion, Alumno, "email_alumno")
+    _anadir_columnas(conexion, Profesor, "id_centro_estudios")
+    _anadir_columnas(conexion, Informe, "id_alumno", "estado_procesamiento", "nivel_gravedad",
+                     "datos_ia", "ruta_pdf", "error_procesamiento")
+    # Los informes anteriores a la cola se procesaban al momento
+    conexion.execute(text("UPDATE informe SET estado_procesamiento = 'notificado' "
+                          "WHERE estado_procesamiento IS NULL"))
+
+
+def _m003_indices(conexion):
+    """Emails de login, claves foráneas y ordenación del dashboard."""
+    for modelo in (Director, CentroEstudios, Tutor, Profesor, Alumno, Informe, Trabajo, Identidad):
+        _crear_indices(conexion, modelo)
+
+
+def _m004_indice_identidades(conexion):
+    """Rellena `identidades` desde las tablas de rol (ya con email_alumno)."""
+    from backend.auth.identidades import rellenar_indice_identidades
+    total = rellenar_indice_identidades(conexion)
+    print(f"   {total} identidades")
+
+
+def _m005_bandeja_correo(conexion):
+    """Bandeja de salida de notificaciones (outbox)."""
+    CorreoSaliente.__table__.create(conexion, checkfirst=True)
+    _crear_indices(conexion, CorreoSaliente)
+
+
+def _m006_resumenes(conexion):
+    """Avisos agrupados: política por centro y modo/gravedad de cada correo."""
+    _anadir_columnas(conexion, CentroEstudios, "resumen_ventana_minutos", "resumen_gravedad_inmediata")
+    _anadir_columnas(conexion, CorreoSaliente, "gravedad", "modo")
+    conexion.execute(text("UPDATE correos_salientes SET modo = 'inmediato' WHERE modo IS NULL"))
+    _crear_indices(conexion, CorreoSaliente)
+
+
+def _m007_sesiones_chat(conexion):
+    """Conversaciones del alumno guardadas en el servidor."""
+    SesionChat.__table__.create(conexion, checkfirst=True)
+    TurnoChat.__table__.create(conexion, checkfirst=True)
+    _crear_indices(conexion, SesionChat)
+
+
+MIGRACIONES = [
+    (1, "tablas base", _m001_tablas_base),
+    (2, "columnas de alumno, profesor e informe", _m002_columnas_nuevas),
+    (3, "índices de login, claves foráneas y dashboard", _m003_indices),
+    (4, "índice de identidades", _m004_indice_identidades),
+    (5, "bandeja de salida de correo", _m005_bandeja_correo),
+    (6, "resúmenes de avisos por centro", _m006_resumenes),
+    (7, "sesiones de chat del alumno", _m007_sesiones_chat),
+]
+
+
+# --- API ---
+
+def version_actual():
+    with db.engine.begin() as conexion:
+        conexion.execute(text(f"CREATE TABLE IF NOT EXISTS {TABLA_VERSION} ("
+                              "version INTEGER PRIMARY KEY, descripcion VARCHAR(200), "
+                              "aplicada TIMESTAMP)"))
+        return conexion.execute(text(f"SELECT MAX(version) FROM {TABLA_VERSION}")).scalar() or 0
+
+
+def aplicar_migraciones():
+    """Aplica en orden las migraciones pendientes. Devuelve la versión final."""
+    version = version_actual()
+    pendientes = [m for m in MIGRACIONES if m[0] > version]
+    if not pendientes:
+        return version
+    for numero, descripcion, funcion in pendientes:
+        print(f"🧱 Migración {numero:03d}: {descripcion}")
+        # Cada migración y su anotación van en la misma transacción
+        with db.engine.begin() as conexion:
+            funcion(conexion)
+            conexion.execute(
+                text(f"INSERT INTO {TABLA_VERSION} (version, descripcion, aplicada) "
+                     "VALUES (:v, :d, :a)"),
+                {"v": numero, "d": descripcion, "a": datetime.utcnow()})
+        version = numero
+    print(f"✅ Esquema en la versión {version}.")
+    return version
+
+
+# --- comprobación de planes de consulta ---
+
+def consultas_calientes():
+    """
+    Las consultas de cada login, informe y página del dashboard. El dashboard,
+    la cola y la bandeja de salida se construyen con el mismo código que usan
+    en producción, para que la comprobación no se quede en una versión simplificada.
+    """
+    from backend.cola import consultas_siguiente_trabajo
+    from backend.email_service import consultas_siguiente_lote
+
+    fecha = datetime(2100, 1, 1)
+    cursor = codificar_cursor(fecha, 10 ** 9)
+    trabajo_pendiente, trabajo_caducado = consultas_siguiente_trabajo(fecha)
+    correo_pendiente, correo_caducado = consultas_siguiente_lote(fecha, 50)
+    return {
+        "login (identidades por email)":
+            select(Identidad).where(Identidad.email == "x@sayit.test"),
+        "alumno por email (informe)":
+            select(Alumno.id_alumno, Tutor.nombre_tutor, CentroEstudios.denominacion_especifica,
+                   Director.email_director)
+            .outerjoin(Tutor, Tutor.id_tutor == Alumno.id_tutor)
+            .outerjoin(CentroEstudios, CentroEstudios.id_centro_estudios == Alumno.id_centro_estudios)
+            .outerjoin(Director, Director.id_director == CentroEstudios.id_director)
+            .where(Alumno.email_alumno == "x@sayit.test"),
+        "centros del director":
+            select(CentroEstudios.id_centro_estudios)
+            .join(Director, Director.id_director == CentroEstudios.id_director)
+            .where(Director.email_director == "x@sayit.test"),
+        "centros del profesor":
+            select(Profesor.id_centro_estudios).where(Profesor.email_profesor == "x@sayit.test"),
+        "alumnos de un centro":
+            select(Alumno.id_alumno).where(Alumno.id_centro_estudios == 1),
+        "dashboard por centro":
+            consulta_pagina_informes(id_centro=1, cursor=cursor),
+        "dashboard por centro y estado":
+            consulta_pagina_informes(id_centro=1, estado="Pendiente", cursor=cursor),
+        "dashboard sin filtro":
+            consulta_pagina_informes(cursor=cursor),
+        "correo: siguiente lote (pendientes)": correo_pendiente,
+        "correo: siguiente lote (lease caducado)": correo_caducado,
+        "chat: sesión abierta del alumno":
+            select(SesionChat.id_sesion)
+            .where(SesionChat.id_alumno == 1, SesionChat.estado == "abierta", SesionChat.actualizada >= fecha)
+            .order_by(SesionChat.actualizada.desc()).limit(1),
+        "chat: turnos de la sesión":
+            select(TurnoChat.mensaje, TurnoChat.respuesta)
+            .where(TurnoChat.id_sesion == 1).order_by(TurnoChat.numero),
+        "cola: siguiente trabajo (pendientes)": trabajo_pendiente,
+        "cola: siguiente trabajo (lease caducado)": trabajo_caducado,
+    }
+
+
+def verificar_planes():
+    """
+    EXPLAIN QUERY PLAN (SQLite) de cada consulta caliente: ninguna puede
+    recorrer una tabla entera ("SCAN tabla" sin índice) ni ordenar en
+    memoria ("USE TEMP B-TREE FOR ... ORDER BY"). Devuelve la lista de
+    problemas; vacía si todo va por índice.
+    """
+    if db.engine.dialect.name != "sqlite":
+        print("ℹ️ La verificación de planes solo está implementada para SQLite.")
+        return []
+    problemas = []
+    with db.engine.connect() as conexion:
+        for nombre, consulta in consultas_calientes().items():
+            sql = str(consulta.compile(dialect=conexion.dialect, compile_kwargs={"literal_binds": True}))
+            plan = [fila[-1] for fila in conexion.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+            escaneos = [paso for paso in plan
+                        if (paso.startswith("SCAN") and " USING " not in paso)
+                        or (paso.startswith("USE TEMP B-TREE") and "ORDER BY" in paso)]
+            if escaneos:
+                problemas.append(f"{nombre}: {'; '.join(escaneos)}")
+            print(f"{'❌' if escaneos else '✅'} {nombre}: {' | '.join(plan)}")
+    return problemas
+
+
+if __name__ == "__main__":
+    from main import app
+
+    with app.app_context():
+        if "--estado" in sys.argv:
+            print(f"Versión del esquema: {version_actual()} de {MIGRACIONES[-1][0]}")
+        elif "--verificar" in sys.argv:
+            aplicar_migraciones()
+            if verificar_planes():
+                sys.exit(1)
+        else:
+            aplicar_migraciones()
@@ -1,7 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
-from sqlalchemy import Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Integer, String, Float, DateTime, ForeignKey, Text, select, event, tuple_
 from datetime import datetime
+import base64
+import heapq
+import json
+import threading
+import time
 
 class Base(DeclarativeBase):
     pass
@@ -14,9 +19,10 @@ class Director(db.Model):
     __tablename__ = 'directores'
     id_director = db.Column(Integer, primary_key=True)
     nombre_director = db.Column(String(100))
-    email_director = db.Column(String(100))
+    email_director = db.Column(String(100), index=True)
     telefono_director = db.Column(String(20))
-    pass_director = db.Column(String(255))
+    # El código usa 'password_hash'; la columna sigue llamándose pass_director
+    password_hash = db.Column('pass_director', String(255))
 
 class CentroEstudios(db.Model):
     __tablename__ = 'centro_estudios'
@@ -36,7 +42,12 @@ class CentroEstudios(db.Model):
     longitud = db.Column(Float)
     latitud = db.Column(Float)
     comarca = db.Column(String(100))
-    id_director = db.Column(Integer, ForeignKey('directores.id_director'))
+    id_director = db.Column(Integer, ForeignKey('directores.id_director'), index=True)
+    # Avisos por correo (ver backend/email_service.py). NULL = valor por defecto:
+    # minutos que se agrupan los avisos leves en un resumen (0 = sin resumen)
+    resumen_ventana_minutos = db.Column(Integer)
+    # gravedad a partir de la cual el aviso sale al momento
+    resumen_gravedad_inmediata = db.Column(String(20))
 
 class Clase(db.Model):
     __tablename__ = 'clase'
@@ -47,34 +58,363 @@ class Tutor(db.Model):
     __tablename__ = 'tutor'
     id_tutor = db.Column(Integer, primary_key=True)
     nombre_tutor = db.Column(String(100))
-    email_tutor = db.Column(String(100))
+    email_tutor = db.Column(String(100), index=True)
     telefono_tutor = db.Column(String(20))
-    pass_tutor = db.Column(String(255))
+    password_hash = db.Column('pass_tutor', String(255))
 
 class Profesor(db.Model):
     __tablename__ = 'profesor'
     id_profesor = db.Column(Integer, primary_key=True)
     nombre_profesor = db.Column(String(100))
-    mail_profesor = db.Column(String(100))
-    pass_profesor = db.Column(String(255))
+    email_profesor = db.Column('mail_profesor', String(100), index=True)
+    password_hash = db.Column('pass_profesor', String(255))
     id_clase = db.Column(Integer, ForeignKey('clase.id_clase'))
+    id_centro_estudios = db.Column(Integer, ForeignKey('centro_estudios.id_centro_estudios'), index=True)
 
 class Alumno(db.Model):
     __tablename__ = 'alumno'
     id_alumno = db.Column(Integer, primary_key=True)
     nombre_alumno = db.Column(String(100))
+    email_alumno = db.Column(String(100), index=True)
     anyo_nacimiento_alumno = db.Column(Integer)
-    pass_alumno = db.Column(String(255))
-    id_centro_estudios = db.Column(Integer, ForeignKey('centro_estudios.id_centro_estudios'))
-    id_tutor = db.Column(Integer, ForeignKey('tutor.id_tutor'))
+    password_hash = db.Column('pass_alumno', String(255))
+    id_centro_estudios = db.Column(Integer, ForeignKey('centro_estudios.id_centro_estudios'), index=True)
+    id_tutor = db.Column(Integer, ForeignKey('tutor.id_tutor'), index=True)
     id_clase = db.Column(Integer, ForeignKey('clase.id_clase'))
 
 class Informe(db.Model):
     __tablename__ = 'informe'
+    # Índices para la bandeja de dirección: orden por (fecha, id) con filtro por centro o estado
+    __table_args__ = (
+        db.Index('ix_informe_centro_fecha', 'id_centro_estudios', 'fecha_informe', 'id_informe'),
+        db.Index('ix_informe_estado_fecha', 'estado', 'fecha_informe', 'id_informe'),
+        db.Index('ix_informe_fecha', 'fecha_informe', 'id_informe'),
+    )
     id_informe = db.Column(Integer, primary_key=True)
     fecha_informe = db.Column(DateTime, default=datetime.utcnow)
     tipo_bullying = db.Column(String(50))
     descripcion = db.Column(String(1000))
     estado = db.Column(String(20), default="Pendiente")  # Pendiente, En Proceso, Resuelto
     id_centro_estudios = db.Column(Integer, ForeignKey('centro_estudios.id_centro_estudios'))
-    id_director = db.Column(Integer, ForeignKey('directores.id_director'))
\ No newline at end of file
+    id_director = db.Column(Integer, ForeignKey('directores.id_director'))
+    id_alumno = db.Column(Integer, ForeignKey('alumno.id_alumno'), index=True)
+    # Seguimiento del procesado en segundo plano (ver backend/pipeline_informes.py)
+    # recibido -> analizado -> pdf_generado -> notificado | error
+    estado_procesamiento = db.Column(String(20), default="recibido")
+    nivel_gravedad = db.Column(String(20))
+    datos_ia = db.Column(Text)  # JSON del análisis
+    ruta_pdf = db.Column(String(300))
+    error_procesamiento = db.Column(String(500))
+
+class Trabajo(db.Model):
+    """Cola de trabajos persistente (ver backend/cola.py)."""
+    __tablename__ = 'trabajos'
+    # Los workers buscan "el siguiente pendiente ya disponible"
+    __table_args__ = (db.Index('ix_trabajos_estado_disponible', 'estado', 'disponible_en'),)
+    id_trabajo = db.Column(Integer, primary_key=True)
+    tipo = db.Column(String(50), nullable=False)
+    id_informe = db.Column(Integer, ForeignKey('informe.id_informe'), index=True)
+    carga = db.Column(Text)  # JSON con los datos de la etapa
+    estado = db.Column(String(20), default="pendiente")  # pendiente, en_curso, hecho, fallido
+    intentos = db.Column(Integer, default=0)
+    max_intentos = db.Column(Integer, default=5)
+    disponible_en = db.Column(DateTime, default=datetime.utcnow)  # no antes de (backoff)
+    bloqueado_hasta = db.Column(DateTime)  # lease del worker que lo ejecuta
+    ultimo_error = db.Column(String(500))
+    creado = db.Column(DateTime, default=datetime.utcnow)
+    actualizado = db.Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class CorreoSaliente(db.Model):
+    """
+    Bandeja de salida (outbox) de notificaciones, un destinatario por fila.
+    Se escribe en la misma transacción que el informe que la origina y la
+    envía backend/email_service.py en segundo plano.
+    """
+    __tablename__ = 'correos_salientes'
+    __table_args__ = (
+        db.Index('ix_correos_estado_disponible', 'estado', 'disponible_en'),
+        # Ventana de resumen abierta de cada destinatario
+        db.Index('ix_correos_destinatario_modo', 'destinatario', 'modo', 'estado'),
+    )
+    id_correo = db.Column(Integer, primary_key=True)
+    id_informe = db.Column(Integer, ForeignKey('informe.id_informe'), index=True)
+    id_centro_estudios = db.Column(Integer, ForeignKey('centro_estudios.id_centro_estudios'))
+    destinatario = db.Column(String(100), nullable=False)
+    asunto = db.Column(String(200))
+    cuerpo = db.Column(Text)
+    ruta_adjunto = db.Column(String(300))
+    gravedad = db.Column(String(20))
+    modo = db.Column(String(20), default="inmediato")  # inmediato, resumen
+    estado = db.Column(String(20), default="pendiente")  # pendiente, en_curso, enviado, muerto
+    intentos = db.Column(Integer, default=0)
+    max_intentos = db.Column(Integer, default=6)
+    disponible_en = db.Column(DateTime, default=datetime.utcnow)
+    bloqueado_hasta = db.Column(DateTime)
+    reclamado_por = db.Column(String(32))  # lote del worker que lo está enviando
+    ultimo_error = db.Column(String(500))
+    creado = db.Column(DateTime, default=datetime.utcnow)
+    enviado_en = db.Column(DateTime)
+
+class SesionChat(db.Model):
+    """
+    Conversación de un alumno guardada en el servidor (ver
+    backend/sesiones_chat.py): se retoma al volver a entrar y el chat no
+    depende del historial que reenvía el navegador.
+    """
+    __tablename__ = 'sesiones_chat'
+    # Sesión abierta del alumno y purga por inactividad
+    __table_args__ = (
+        db.Index('ix_sesiones_chat_alumno_estado', 'id_alumno', 'estado', 'actualizada'),
+        db.Index('ix_sesiones_chat_estado_actualizada', 'estado', 'actualizada'),
+    )
+    id_sesion = db.Column(Integer, primary_key=True)
+    id_alumno = db.Column(Integer, ForeignKey('alumno.id_alumno'), nullable=False)
+    estado = db.Column(String(20), default="abierta")  # abierta, cerrada (denuncia enviada)
+    turnos = db.Column(Integer, default=0)
+    id_informe = db.Column(Integer, ForeignKey('informe.id_informe'))
+    creada = db.Column(DateTime, default=datetime.utcnow)
+    actualizada = db.Column(DateTime, default=datetime.utcnow)
+
+class TurnoChat(db.Model):
+    """Un turno (mensaje del alumno + respuesta) por fila; solo se añaden."""
+    __tablename__ = 'turnos_chat'
+    __table_args__ = (db.UniqueConstraint('id_sesion', 'numero', name='uq_turnos_chat_sesion_numero'),)
+    id_turno = db.Column(Integer, primary_key=True)
+    id_sesion = db.Column(Integer, ForeignKey('sesiones_chat.id_sesion'), nullable=False)
+    numero = db.Column(Integer, nullable=False)
+    mensaje = db.Column(Text)
+    respuesta = db.Column(Text)
+    creado = db.Column(DateTime, default=datetime.utcnow)
+
+class Identidad(db.Model):
+    """
+    Índice único de acceso: email -> (rol, id en su tabla, credencial).
+    Se mantiene sincronizado con Alumno/Director/Tutor/Profesor
+    (ver backend/auth/identidades.py) para resolver el login con una sola
+    búsqueda indexada en lugar de recorrer las cuatro tablas.
+    """
+    __tablename__ = 'identidades'
+    __table_args__ = (db.UniqueConstraint('rol', 'id_usuario', name='uq_identidades_rol_usuario'),)
+    id_identidad = db.Column(Integer, primary_key=True)
+    email = db.Column(String(100), nullable=False, index=True)  # siempre en minúsculas
+    rol = db.Column(String(20), nullable=False)  # alumno, director, tutor, profesor
+    id_usuario = db.Column(Integer, nullable=False)
+    nombre = db.Column(String(100))
+    password_hash = db.Column(String(255))
+
+# --- CONSULTAS DE JERARQUÍA (alumno -> centro -> dirección / tutoría) ---
+
+# El centro y su dirección cambian muy poco (casi una vez por curso) pero se
+# consultan en cada informe: se guardan en memoria con caducidad y se
+# invalidan cuando este proceso modifica un centro o un director.
+TTL_JERARQUIA_SEGUNDOS = 3600
+
+_cache_centros = {}  # id_centro -> (caduca_en, datos)
+_cache_lock = threading.Lock()
+
+
+def _datos_centro(centro_id, generica, especifica, id_director, nombre_director, email_director):
+    nombre = f"{generica or ''} {especifica or ''}".strip() or None
+    return {
+        "id_centro": centro_id,
+        "nombre_centro": nombre,
+        "id_director": id_director,
+        "nombre_director": nombre_director,
+        "email_director": email_director,
+    }
+
+
+def _guardar_centro_en_cache(datos):
+    with _cache_lock:
+        _cache_centros[datos["id_centro"]] = (time.monotonic() + TTL_JERARQUIA_SEGUNDOS, datos)
+
+
+def invalidar_cache_jerarquia(id_centro=None):
+    """Vacía la caché entera o solo la entrada de un centro."""
+    with _cache_lock:
+        if id_centro is None:
+            _cache_centros.clear()
+        else:
+            _cache_centros.pop(id_centro, None)
+
+
+def obtener_jerarquia_centro(id_centro):
+    """Nombre del centro y su director (caché con TTL; si no, una consulta con JOIN)."""
+    if id_centro is None:
+        return None
+    with _cache_lock:
+        entrada = _cache_centros.get(id_centro)
+    if entrada and entrada[0] > time.monotonic():
+        return entrada[1]
+
+    fila = db.session.execute(
+        select(CentroEstudios.id_centro_estudios, CentroEstudios.denominacion_generica_es,
+               CentroEstudios.denominacion_especifica, Director.id_director,
+               Director.nombre_director, Director.email_director)
+        .outerjoin(Director, Director.id_director == CentroEstudios.id_director)
+        .where(CentroEstudios.id_centro_estudios == id_centro)
+    ).first()
+    if fila is None:
+        return None
+    datos = _datos_centro(*fila)
+    _guardar_centro_en_cache(datos)
+    return datos
+
+
+def resolver_alumno(email=None, id_alumno=None):
+    """
+    Devuelve en un dict el alumno con su tutor, su centro y el director del
+    centro, resueltos en UNA sola consulta (LEFT JOIN), o None si no existe.
+    """
+    consulta = (
+        select(Alumno.id_alumno, Alumno.nombre_alumno, Alumno.id_centro_estudios,
+               Tutor.id_tutor, Tutor.nombre_tutor, Tutor.email_tutor,
+               CentroEstudios.id_centro_estudios, CentroEstudios.denominacion_generica_es,
+               CentroEstudios.denominacion_especifica, Director.id_director,
+               Director.nombre_director, Director.email_director)
+        .outerjoin(Tutor, Tutor.id_tutor == Alumno.id_tutor)
+        .outerjoin(CentroEstudios, CentroEstudios.id_centro_estudios == Alumno.id_centro_estudios)
+        .outerjoin(Director, Director.id_director == CentroEstudios.id_director)
+    )
+    if email is not None:
+        consulta = consulta.where(Alumno.email_alumno == email)
+    elif id_alumno is not None:
+        consulta = consulta.where(Alumno.id_alumno == id_alumno)
+    else:
+        raise ValueError("Indica email o id_alumno")
+
+    fila = db.session.execute(consulta.limit(1)).first()
+    if fila is None:
+        return None
+
+    datos = {
+        "id_alumno": fila[0],
+        "nombre_alumno": fila[1],
+        "id_tutor": fila[3],
+        "nombre_tutor": fila[4],
+        "email_tutor": fila[5],
+    }
+    if fila[6] is not None:
+        centro = _datos_centro(*fila[6:])
+        _guardar_centro_en_cache(centro)
+    else:
+        centro = _datos_centro(fila[2], None, None, None, None, None)
+    datos.update(centro)
+    return datos
+
+
+@event.listens_for(CentroEstudios, "after_insert")
+@event.listens_for(CentroEstudios, "after_update")
+@event.listens_for(CentroEstudios, "after_delete")
+def _centro_modificado(mapper, connection, centro):
+    invalidar_cache_jerarquia(centro.id_centro_estudios)
+
+
+@event.listens_for(Director, "after_insert")
+@event.listens_for(Director, "after_update")
+@event.listens_for(Director, "after_delete")
+def _director_modificado(mapper, connection, director):
+    # Un director puede estar en varios centros: se vacía todo
+    invalidar_cache_jerarquia()
+
+
+
+# --- BANDEJA DE DIRECCIÓN (paginación por cursor) ---
+
+# Columnas que puede pedir el dashboard: etiqueta -> columna
+COLUMNAS_INFORME = {
+    "ID": Informe.id_informe,
+    "Fecha": Informe.fecha_informe,
+    "Tipo": Informe.tipo_bullying,
+    "Gravedad": Informe.nivel_gravedad,
+    "Estado": Informe.estado,
+    "Resumen": Informe.descripcion,
+    "Centro": Informe.id_centro_estudios,
+}
+COLUMNAS_DASHBOARD = ["ID", "Fecha", "Tipo", "Resumen"]
+
+
+def codificar_cursor(fecha, id_informe):
+    crudo = json.dumps([fecha.isoformat() if fecha else None, id_informe])
+    return base64.urlsafe_b64encode(crudo.encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    fecha, id_informe = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return (datetime.fromisoformat(fecha) if fecha else None), id_informe
+
+
+def centros_del_usuario(rol, email):
+    """Centros cuyos informes puede ver un director o profesor (lista vacía para otros roles)."""
+    if rol == "director":
+        return [c for (c,) in db.session.execute(
+            select(CentroEstudios.id_centro_estudios)
+            .join(Director, Director.id_director == CentroEstudios.id_director)
+            .where(Director.email_director == email)
+        )]
+    if rol == "profesor":
+        return [c for (c,) in db.session.execute(
+            select(Profesor.id_centro_estudios)
+            .where(Profesor.email_profesor == email, Profesor.id_centro_estudios.is_not(None))
+        )]
+    return []
+
+
+def consulta_pagina_informes(columnas=COLUMNAS_DASHBOARD, id_centro=None, estado=None, tipo=None,
+                             desde=None, hasta=None, cursor=None, limite=50):
+    """
+    SELECT de una página de un centro (o de todos, sin `id_centro`). Con
+    centro se recorre ix_informe_centro_fecha ya en orden: sin ordenar en
+    memoria, solo se leen `limite + 1` filas a partir del cursor.
+    """
+    seleccion = [COLUMNAS_INFORME[c] for c in columnas]
+    consulta = select(*seleccion, Informe.fecha_informe, Informe.id_informe)
+
+    if id_centro is not None:
+        consulta = consulta.where(Informe.id_centro_estudios == id_centro)
+    if estado:
+        consulta = consulta.where(Informe.estado == estado)
+    if tipo:
+        consulta = consulta.where(Informe.tipo_bullying.ilike(f"%{tipo}%"))
+    if desde:
+        consulta = consulta.where(Informe.fecha_informe >= desde)
+    if hasta:
+        consulta = consulta.where(Informe.fecha_informe < hasta)
+    if cursor:
+        fecha, id_informe = decodificar_cursor(cursor)
+        consulta = consulta.where(tuple_(Informe.fecha_informe, Informe.id_informe) < (fecha, id_informe))
+
+    return consulta.order_by(Informe.fecha_informe.desc(), Informe.id_informe.desc()).limit(limite + 1)
+
+
+def obtener_pagina_informes(centros=None, estado=None, tipo=None, desde=None, hasta=None,
+                            cursor=None, limite=50, columnas=COLUMNAS_DASHBOARD):
+    """
+    Una página de informes, del más reciente al más antiguo.
+
+    Paginación por cursor (keyset) sobre (fecha_informe, id_informe): cada
+    página cuesta lo mismo tenga la tabla mil filas o millones, porque la
+    consulta salta directamente al punto del índice donde acabó la anterior.
+    Solo se leen las `columnas` pedidas.
+
+    Con varios centros no se usa un IN (SQLite ordenaría en memoria todas las
+    filas de esos centros): se lee la página de cada centro por su índice y
+    se mezclan, así que una página cuesta como mucho `limite + 1` filas por centro.
+
+    Devuelve (filas, siguiente_cursor); siguiente_cursor es None en la última página.
+    """
+    filtros = dict(columnas=columnas, estado=estado, tipo=tipo, desde=desde, hasta=hasta,
+                   cursor=cursor, limite=limite)
+    if centros is None:
+        consultas = [consulta_pagina_informes(**filtros)]
+    else:
+        consultas = [consulta_pagina_informes(id_centro=c, **filtros) for c in dict.fromkeys(centros)]
+    # Cada resultado ya viene de más reciente a más antiguo
+    filas = list(heapq.merge(*(db.session.execute(c).all() for c in consultas),
+                             key=lambda f: (f[-2] or datetime.min, f[-1]), reverse=True))[:limite + 1]
+
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = codificar_cursor(filas[-1][-2], filas[-1][-1])
+    return [tuple(f[:len(columnas)]) for f in filas], siguiente
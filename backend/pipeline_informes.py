@@ -0,0 +1,210 @@
+"""
+Procesado de un informe en segundo plano, en etapas reintentables:
+
+    analisis  -> (IA) clasifica y resume el chat
+    pdf       -> genera el expediente PDF y deja el aviso a dirección y
+                 tutoría en la bandeja de salida (backend/email_service.py)
+
+El formulario del alumno solo guarda el Informe y encola la primera etapa;
+cada etapa, al terminar, encola la siguiente en la misma transacción en la
+que guarda su resultado. El avance queda en `Informe.estado_procesamiento`.
+"""
+import json
+
+from sqlalchemy import select
+
+from backend.models import db, Informe, obtener_jerarquia_centro, resolver_alumno
+from backend.agents import generar_reporte_riesgo
+from backend.reporting import generar_pdf_informe, generar_pdfs_lote
+from backend.email_service import encolar_notificacion
+from backend.sesiones_chat import turnos_sesion
+
+# Claves de la carga con texto del alumno (transcripción o lo extraído de
+# ella): se quitan en cuanto el análisis termina o se da por fallido
+DATOS_CONVERSACION = ("historial", "estado")
+
+def _informe(trabajo):
+    informe = db.session.get(Informe, trabajo.id_informe)
+    if informe is None:
+        raise LookupError(f"Informe #{trabajo.id_informe} no encontrado")
+    return informe
+
+
+def _sin_conversacion(trabajo, carga):
+    """La tabla `trabajos` no guarda la conversación más allá del análisis (sin commit)."""
+    trabajo.carga = json.dumps({k: v for k, v in carga.items() if k not in DATOS_CONVERSACION},
+                               ensure_ascii=False)
+
+
+def etapa_analisis(cola, trabajo, carga):
+    informe = _informe(trabajo)
+    if carga.get("id_sesion"):
+        # La conversación se lee de la sesión guardada, que tiene su propia retención
+        historial = turnos_sesion(carga["id_sesion"])
+    else:
+        historial = carga.get("historial", [])
+    # Siempre válido: si la IA no responde a tiempo, clasificación local
+    datos = generar_reporte_riesgo(historial, estado=carga.get("estado"))
+
+    # Limpieza
+    tipo_raw = datos.get("tipo_incidente", "Otro")
+    tipo = ", ".join(tipo_raw) if isinstance(tipo_raw, list) else str(tipo_raw)
+    resumen = datos.get("resumen_hechos", "Sin detalles disponibles.")
+    rol_informante = datos.get("rol_informante", "TESTIGO")
+
+    informe.tipo_bullying = tipo[:50]
+    informe.descripcion = f"[{rol_informante}] {resumen}"[:1000]
+    informe.nivel_gravedad = datos.get("nivel_gravedad", "REVISAR")
+    informe.datos_ia = json.dumps(datos, ensure_ascii=False)
+    informe.estado_procesamiento = "analizado"
+    _sin_conversacion(trabajo, carga)
+    cola.encolar("pdf", informe.id_informe, commit=False)
+
+
+def _implicados(informe):
+    """Nombres y correos de centro, dirección, tutoría y alumno del informe."""
+    datos = {
+        "nombre_centro": "Centro Desconocido",
+        "nombre_director": "No asignado",
+        "email_director": "director@sayit.test",
+        "id_docente": None,
+        "nombre_docente": "No asignado",
+        "email_tutor": "tutor@sayit.test",
+        "nombre_alumno": "Desconocido",
+    }
+    # Una consulta (alumno+tutor+centro+director) o, sin alumno, la caché de centros
+    if informe.id_alumno:
+        jerarquia = resolver_alumno(id_alumno=informe.id_alumno) or {}
+    else:
+        jerarquia = obtener_jerarquia_centro(informe.id_centro_estudios) or {}
+
+    for clave, origen in (("nombre_centro", "nombre_centro"), ("nombre_director", "nombre_director"),
+                          ("email_director", "email_director"), ("id_docente", "id_tutor"),
+                          ("nombre_docente", "nombre_tutor"), ("email_tutor", "email_tutor"),
+                          ("nombre_alumno", "nombre_alumno")):
+        if jerarquia.get(origen):
+            datos[clave] = jerarquia[origen]
+    return datos
+
+
+def argumentos_pdf(informe):
+    """Parámetros de `generar_pdf_informe` para un informe ya analizado."""
+    implicados = _implicados(informe)
+    if informe.datos_ia:
+        datos_ia = json.loads(informe.datos_ia)
+    else:
+        # Informes anteriores al análisis en segundo plano: lo guardado en la fila
+        datos_ia = {"tipo_incidente": informe.tipo_bullying or "No especificado",
+                    "nivel_gravedad": informe.nivel_gravedad or "REVISAR",
+                    "resumen_hechos": informe.descripcion or "Sin resumen disponible."}
+    return dict(
+        id_informe=informe.id_informe,
+        fecha_reporte=informe.fecha_informe.strftime("%d/%m/%Y %H:%M") if informe.fecha_informe else "Sin fecha",
+        datos_ia=datos_ia,
+        nombre_centro=implicados["nombre_centro"],
+        id_centro=informe.id_centro_estudios,
+        id_director=informe.id_director,
+        nombre_director=implicados["nombre_director"],
+        id_docente=implicados["id_docente"],
+        nombre_docente=implicados["nombre_docente"],
+        id_alumno=informe.id_alumno,
+        nombre_alumno=implicados["nombre_alumno"]
+    )
+
+
+def etapa_pdf(cola, trabajo, carga):
+    informe = _informe(trabajo)
+    ruta_pdf = generar_pdf_informe(**argumentos_pdf(informe))
+    if not ruta_pdf:
+        raise RuntimeError("No se pudo generar el PDF")
+    informe.ruta_pdf = ruta_pdf
+    informe.estado_procesamiento = "pdf_generado"
+    # El aviso va a la bandeja de salida en el mismo commit que el informe
+    encolar_aviso(informe)
+
+
+def regenerar_pdfs(ids=None, procesos=None, tamano_lote=500):
+    """
+    Vuelve a generar los expedientes ya analizados (auditorías de fin de
+    trimestre). Los datos se leen por lotes y se dibujan en el pool de
+    procesos; devuelve (generados, fallidos).
+    """
+    consulta = select(Informe).where(Informe.datos_ia.is_not(None)).order_by(Informe.id_informe)
+    if ids is not None:
+        consulta = consulta.where(Informe.id_informe.in_(ids))
+    generados = fallidos = 0
+    ultimo = 0
+    while True:
+        informes = db.session.execute(
+            consulta.where(Informe.id_informe > ultimo).limit(tamano_lote)).scalars().all()
+        if not informes:
+            break
+        rutas = generar_pdfs_lote([argumentos_pdf(i) for i in informes], procesos=procesos)
+        for informe, ruta in zip(informes, rutas):
+            if ruta:
+                informe.ruta_pdf = ruta
+                generados += 1
+            else:
+                fallidos += 1
+        db.session.commit()
+        ultimo = informes[-1].id_informe
+        print(f"📄 {generados} expedientes regenerados ({fallidos} fallidos)...")
+    return generados, fallidos
+
+
+def encolar_aviso(informe):
+    """Correo a dirección y tutoría en la bandeja de salida (sin commit)."""
+    implicados = _implicados(informe)
+    destinatarios = [implicados["email_director"], implicados["email_tutor"]]
+    asunto = f"🔴 URGENTE: Nuevo Expediente #{informe.id_informe} - {implicados['nombre_centro']}"
+    cuerpo = f"""
+    SISTEMA DE GESTIÓN DE INCIDENCIAS 'SAY IT'
+    ==========================================
+    Se ha registrado una nueva denuncia.
+
+    - ID Reporte: {informe.id_informe}
+    - Alumno:     {implicados['nombre_alumno']}
+    - Gravedad:   {informe.nivel_gravedad or 'REVISAR'}
+
+    El informe PDF adjunto contiene los detalles confidenciales.
+    """
+    return encolar_notificacion(destinatarios, asunto, cuerpo, informe.ruta_pdf,
+                                id_informe=informe.id_informe, id_centro=informe.id_centro_estudios,
+                                gravedad=informe.nivel_gravedad)
+
+
+def etapa_notificacion(cola, trabajo, carga):
+    """Trabajos "notificacion" encolados antes de la bandeja de salida."""
+    encolar_aviso(_informe(trabajo))
+
+
+def _marcar_error(trabajo, error):
+    """Al agotar reintentos, el informe queda marcado para revisión manual."""
+    informe = db.session.get(Informe, trabajo.id_informe)
+    if informe:
+        informe.estado_procesamiento = "error"
+        informe.error_procesamiento = f"{trabajo.tipo}: {error}"[:500]
+    if trabajo.tipo == "analisis":
+        _sin_conversacion(trabajo, json.loads(trabajo.carga or "{}"))
+
+
+def registrar_etapas(cola):
+    for tipo, etapa in (("analisis", etapa_analisis), ("pdf", etapa_pdf),
+                        ("notificacion", etapa_notificacion)):
+        cola.registrar(tipo, lambda trabajo, carga, etapa=etapa: etapa(cola, trabajo, carga),
+                       al_fallar=_marcar_error)
+
+
+if __name__ == "__main__":
+    # python -m backend.pipeline_informes --regenerar [--procesos N]
+    import argparse
+    from main import app
+
+    parser = argparse.ArgumentParser(description="Regenera los expedientes PDF en lote")
+    parser.add_argument("--regenerar", action="store_true", help="Regenera todos los expedientes")
+    parser.add_argument("--procesos", type=int, default=None, help="Procesos de dibujo (def.: núcleos)")
+    args = parser.parse_args()
+    if args.regenerar:
+        with app.app_context():
+            generados, fallidos = regenerar_pdfs(procesos=args.procesos)
+        print(f"✅ {generados} expedientes regenerados, {fallidos} fallidos.")
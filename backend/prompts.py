@@ -0,0 +1,124 @@
+"""
+Montaje del prompt del chat con presupuesto de tokens.
+
+El protocolo (parte fija) va como instrucción de sistema del modelo y no se
+repite en cada turno. Cada llamada lleva solo:
+- un resumen compacto de los turnos antiguos que no caben,
+- los turnos recientes completos,
+- los fragmentos de normativa relevantes (RAG) y el mensaje nuevo.
+Así el coste por turno se mantiene plano aunque la conversación sea larga.
+"""
+import os
+
+PRESUPUESTO_TOKENS = int(os.getenv("PRESUPUESTO_TOKENS_PROMPT", "3000"))
+# Nunca se resumen los últimos N turnos, aunque se pase el presupuesto
+TURNOS_RECIENTES_MINIMOS = 2
+# Palabras que se conservan de cada mensaje antiguo del alumno en el resumen
+PALABRAS_POR_TURNO_RESUMIDO = 25
+
+
+def estimar_tokens(texto):
+    """Aproximación sin red: ~4 caracteres por token en español."""
+    return len(texto) // 4 + 1
+
+
+def normalizar_historial(historial):
+    """
+    Convierte el historial de Gradio en [(alumno, say_it), ...].
+    Admite el formato de pares [[humano, ia], ...] y el de mensajes
+    [{"role": "user"|"assistant", "content": ...}, ...].
+    """
+    turnos = []
+    pendiente = None
+    for item in historial or []:
+        if isinstance(item, dict):
+            contenido = item.get("content")
+            if not isinstance(contenido, str):
+                continue
+            if item.get("role") == "user":
+                pendiente = contenido
+            elif item.get("role") == "assistant" and pendiente:
+                turnos.append((pendiente, contenido))
+                pendiente = None
+        elif isinstance(item, (list, tuple)) and len(item) >= 2:
+            human, ai = item[0], item[1]
+            if human and ai:
+                turnos.append((human, ai))
+    return turnos
+
+
+def _recortar(texto, palabras):
+    trozos = texto.split()
+    if len(trozos) <= palabras:
+        return texto
+    return " ".join(trozos[:palabras]) + "…"
+
+
+class ConstructorPrompt:
+    """
+    Construye la lista de `contents` para Gemini respetando un presupuesto
+    de tokens. `recuperar_contexto(mensaje) -> str` aporta la normativa (RAG).
+    """
+
+    def __init__(self, presupuesto_tokens=PRESUPUESTO_TOKENS, recuperar_contexto=None,
+                 turnos_recientes_minimos=TURNOS_RECIENTES_MINIMOS):
+        self.presupuesto_tokens = presupuesto_tokens
+        self.recuperar_contexto = recuperar_contexto
+        self.turnos_recientes_minimos = turnos_recientes_minimos
+
+    def _contexto(self, mensaje):
+        # Un saludo ("Hola") no necesita normativa: se ahorra la búsqueda
+        if not self.recuperar_contexto or len(mensaje.split()) < 3:
+            return ""
+        try:
+            return self.recuperar_contexto(mensaje) or ""
+        except Exception as e:
+            print(f"⚠️ RAG no disponible para el chat: {e}")
+            return ""
+
+    def _resumir(self, turnos):
+        """Resumen extractivo (sin llamar al modelo) de los turnos que no caben."""
+        lineas = [f"- Alumno: {_recortar(humano, PALABRAS_POR_TURNO_RESUMIDO)}"
+                  for humano, _ in turnos]
+        return "RESUMEN DE LA CONVERSACIÓN ANTERIOR (lo que ya contó el alumno):\n" + "\n".join(lineas)
+
+    def construir(self, historial, mensaje, nota=None):
+        """`nota`: indicación interna para este turno (p. ej. qué datos faltan)."""
+        turnos = normalizar_historial(historial)
+
+        contexto = self._contexto(mensaje)
+        ultimo = mensaje
+        if contexto or nota:
+            ultimo = ""
+            if contexto:
+                ultimo += f"NORMATIVA DEL CENTRO (úsala solo si es pertinente):\n{contexto}\n\n"
+            if nota:
+                ultimo += f"NOTA INTERNA (no la cites al alumno): {nota}\n\n"
+            ultimo += f"NUEVO MENSAJE DEL ALUMNO:\n{mensaje}"
+        disponible = self.presupuesto_tokens - estimar_tokens(ultimo)
+
+        # Se incluyen turnos completos de más reciente a más antiguo mientras quepan
+        recientes = []
+        for i, (humano, ai) in enumerate(reversed(turnos)):
+            coste = estimar_tokens(humano) + estimar_tokens(ai)
+            if coste > disponible and i >= self.turnos_recientes_minimos:
+                break
+            recientes.insert(0, (humano, ai))
+            disponible -= coste
+        antiguos = turnos[:len(turnos) - len(recientes)]
+
+        contenidos = []
+        if antiguos:
+            resumen = self._resumir(antiguos)
+            # Si ni el resumen cabe, se quedan solo los turnos antiguos más recientes
+            while antiguos and estimar_tokens(resumen) > max(disponible, 0):
+                antiguos = antiguos[1:]
+                resumen = self._resumir(antiguos)
+            if antiguos:
+                contenidos.append({"role": "user", "parts": [resumen]})
+                contenidos.append({"role": "model", "parts": ["Entendido, lo tengo en cuenta."]})
+        for humano, ai in recientes:
+            contenidos.append({"role": "user", "parts": [humano]})
+            contenidos.append({"role": "model", "parts": [ai]})
+        contenidos.append({"role": "user", "parts": [ultimo]})
+        return contenidos
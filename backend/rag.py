@@ -1,75 +1,265 @@
 import os
+import sys
+import threading
+import time
+from collections import OrderedDict
 from dotenv import load_dotenv # <--- Carga las variables de entorno
 
 # Cargar variables del archivo .env si existe
 load_dotenv()
 
-# Verificación de seguridad antes de arrancar
-if not os.getenv("GOOGLE_API_KEY"):
-    print("❌ ERROR CRÍTICO: No se encuentra la GOOGLE_API_KEY.")
-    print("   -> Solución: Crea un archivo .env o ejecuta 'export GOOGLE_API_KEY=tu_clave'")
-    exit(1)
+# Permite ejecutar `python backend/rag.py` desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # --- IMPORTS ---
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+# El backend de embeddings (Google, local o falso) se elige con EMBEDDINGS_BACKEND;
+# ya no hace falta GOOGLE_API_KEY si se usa el modelo local.
+import chromadb
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from backend.metricas import observar, registrar_evento
 
 # Configuración
 DB_DIR = "chroma_db"
 DOCS_DIR = "documentos_rag"
+MODELO_EMBEDDINGS = "models/embedding-001"
+TAMANO_CACHE_CONSULTAS = int(os.getenv("RAG_CACHE_CONSULTAS", "512"))
+# "hibrido" (BM25 + vectores), "lexico" o "vector"
+MODO_BUSQUEDA = os.getenv("RAG_MODO", "hibrido")
+PESO_VECTORIAL = float(os.getenv("RAG_PESO_VECTORIAL", "0.5"))
+# Archivos cuyo cambio indica que el índice se ha reconstruido
+ARCHIVOS_INDICE = ("manifiesto.json", "chroma.sqlite3")
 
 def inicializar_base_vectorial():
-    """Lee los TXT, los trocea y los guarda en la base de datos vectorial."""
+    """Lee los TXT, los trocea y sincroniza la base vectorial (solo lo que ha cambiado)."""
+    from backend.data_science.embeddings import crear_embeddings
+    from backend.data_science.indexador import IndexadorIncremental
+
     if not os.path.exists(DOCS_DIR):
         print("❌ Error: No hay documentos en documentos_rag/")
         return
 
     print("--- ⚙️ PROCESANDO NORMATIVA ---")
-    
-    # 1. Cargar documentos
-    loader = DirectoryLoader(DOCS_DIR, glob="*.txt", loader_cls=TextLoader)
-    docs = loader.load()
-    print(f"📄 Documentos cargados: {len(docs)}")
-    
-    # 2. Dividir en trozos (chunks)
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    chunks = text_splitter.split_documents(docs)
-    print(f"🧩 Fragmentos generados: {len(chunks)}")
-
-    # 3. Crear Embeddings
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-
-    # 4. Guardar en ChromaDB (Limpiando la anterior si existe)
-    if os.path.exists(DB_DIR):
-        import shutil
-        shutil.rmtree(DB_DIR) 
-            
-    vectorstore = Chroma.from_documents(
-        documents=chunks, 
-        embedding=embeddings, 
-        persist_directory=DB_DIR
+
+    indexador = IndexadorIncremental(
+        docs_dir=DOCS_DIR,
+        db_dir=DB_DIR,
+        embeddings=crear_embeddings(modelo_google=MODELO_EMBEDDINGS),
+        chunk_size=500,
+        chunk_overlap=50,
     )
-    # En versiones nuevas de Langchain, persist() a veces es automático, 
-    # pero lo dejamos por compatibilidad.
-    # vectorstore.persist() 
-    
+    resumen = indexador.indexar()
+    print(f"🧩 Fragmentos nuevos: {resumen['nuevos']} | eliminados: {resumen['eliminados']} "
+          f"| archivos sin cambios: {resumen['archivos_sin_cambios']}")
+
+    # Si este mismo proceso tiene el recuperador abierto, que recargue el índice
+    if _recuperador is not None:
+        _recuperador.invalidar()
+
     print("✅ Base de Datos Normativa actualizada correctamente.")
 
+
+# --- RECUPERADOR COMPARTIDO (se carga una vez por proceso) ---
+
+def _normalizar_consulta(texto):
+    """Clave de caché: mismas palabras con distinto espaciado/mayúsculas -> misma entrada."""
+    return " ".join(texto.lower().split())
+
+
+class EmbeddingsConCache(Embeddings):
+    """
+    Envuelve un cliente de embeddings con una caché LRU para las consultas.
+    Las frases repetidas ("me pegan en el patio") no vuelven a llamar a la API.
+    Los documentos (indexado) pasan directos: no merece la pena cachearlos.
+    """
+
+    def __init__(self, base, maximo=TAMANO_CACHE_CONSULTAS):
+        self.base = base
+        # Se conserva la identidad del cliente real para validar el índice
+        self.backend = getattr(base, "backend", None)
+        self.modelo = getattr(base, "modelo", None) or getattr(base, "model", None)
+        self.maximo = maximo
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
+
+    def embed_query(self, text):
+        clave = _normalizar_consulta(text)
+        with self._lock:
+            if clave in self._cache:
+                self._cache.move_to_end(clave)
+                self.aciertos += 1
+                return self._cache[clave]
+        # La llamada de red va fuera del lock para no serializar a todos los hilos
+        vector = self.base.embed_query(text)
+        with self._lock:
+            self.fallos += 1
+            self._cache[clave] = vector
+            self._cache.move_to_end(clave)
+            while len(self._cache) > self.maximo:
+                self._cache.popitem(last=False)
+        return vector
+
+
+def _firma_indice(directorio):
+    """
+    Huella barata del índice en disco: cambia cuando alguien lo reconstruye.
+    Los indexadores reescriben el manifiesto en cada cambio; si no hay
+    manifiesto (índice antiguo) se mira la propia base de Chroma.
+    """
+    for nombre in ARCHIVOS_INDICE:
+        try:
+            info = os.stat(os.path.join(directorio, nombre))
+            return (nombre, info.st_mtime_ns, info.st_size)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+class RecuperadorNormativa:
+    """
+    Acceso compartido a la base vectorial. Abre Chroma, el índice léxico y el
+    cliente de embeddings una sola vez y los reutiliza entre peticiones e hilos.
+    Si el índice en disco cambia (re-indexado), se recarga en la siguiente consulta.
+
+    Modos de búsqueda:
+    - "vector":  solo similitud de embeddings.
+    - "lexico":  solo BM25 (sin llamadas de embeddings).
+    - "hibrido": BM25 primero; si el resultado es concluyente se responde ya,
+                 si no se fusionan las puntuaciones léxicas y vectoriales.
+    """
+
+    def __init__(self, directorio=DB_DIR, modelo=MODELO_EMBEDDINGS, embeddings=None,
+                 modo=MODO_BUSQUEDA, peso_vectorial=PESO_VECTORIAL):
+        self.directorio = directorio
+        self.modelo = modelo
+        self.modo = modo
+        self.peso_vectorial = peso_vectorial
+        self._lock = threading.RLock()
+        self._embeddings = EmbeddingsConCache(embeddings) if embeddings is not None else None
+        self._coleccion = None
+        self._lexico = None
+        self._firma = None
+        self._registro = None  # backend/modelo/dimensión con que se creó el índice
+        self.atajos_lexicos = 0  # consultas resueltas sin embeddings
+
+    @property
+    def embeddings(self):
+        with self._lock:
+            if self._embeddings is None:
+                from backend.data_science.embeddings import crear_embeddings
+                self._embeddings = EmbeddingsConCache(crear_embeddings(modelo_google=self.modelo))
+            return self._embeddings
+
+    def _indice_vigente(self):
+        """Devuelve (colección Chroma, índice BM25), recargándolos si el índice ha cambiado."""
+        from backend.data_science.indexador import COLECCION, cargar_manifiesto
+        from backend.data_science.lexico import IndiceBM25
+
+        with self._lock:
+            if self._coleccion is None or _firma_indice(self.directorio) != self._firma:
+                if self._coleccion is not None:
+                    print("🔁 RAG: índice modificado en disco, recargando.")
+                    # chromadb reutiliza el cliente por ruta; se descarta para leer lo nuevo
+                    chromadb.api.client.SharedSystemClient.clear_system_cache()
+                manifiesto = cargar_manifiesto(self.directorio) or {}
+                self._registro = manifiesto.get("embeddings")
+                cliente = chromadb.PersistentClient(path=self.directorio)
+                self._coleccion = cliente.get_or_create_collection(COLECCION)
+                self._lexico = IndiceBM25.cargar(self.directorio)
+                # Abrir Chroma puede tocar su sqlite: la firma se toma después
+                self._firma = _firma_indice(self.directorio)
+            return self._coleccion, self._lexico
+
+    def invalidar(self):
+        """Fuerza la recarga en la próxima consulta (p.ej. tras re-indexar en este proceso)."""
+        with self._lock:
+            self._coleccion = None
+            self._lexico = None
+            self._firma = None
+
+    def _buscar_vectorial(self, coleccion, query, n):
+        """[(id, texto, metadatos, distancia)] de los n fragmentos más cercanos."""
+        from backend.data_science.embeddings import comprobar_compatibilidad
+
+        # Un índice creado con otro modelo devolvería resultados sin sentido
+        comprobar_compatibilidad(self._registro, self.embeddings)
+        vector = self.embeddings.embed_query(query)
+        comprobar_compatibilidad(self._registro, self.embeddings, dimension=len(vector))
+        res = coleccion.query(query_embeddings=[vector], n_results=n,
+                              include=["documents", "metadatas", "distances"])
+        return list(zip(res["ids"][0], res["documents"][0], res["metadatas"][0],
+                        res["distances"][0]))
+
+    def buscar(self, query, k=2, modo=None):
+        modo = modo or self.modo
+        coleccion, lexico = self._indice_vigente()
+        candidatos = max(k * 4, 10)
+
+        resultados_lexicos = []
+        if modo in ("lexico", "hibrido") and lexico is not None:
+            resultados_lexicos = lexico.buscar(query, k=candidatos)
+            if modo == "lexico" or lexico.es_concluyente(resultados_lexicos):
+                self.atajos_lexicos += 1
+                return [Document(page_content=lexico.textos[pos], metadata=lexico.metadatos[pos])
+                        for pos, _, _ in resultados_lexicos[:k]]
+
+        vectoriales = self._buscar_vectorial(coleccion, query, candidatos if resultados_lexicos else k)
+        if not resultados_lexicos:
+            return [Document(page_content=texto, metadata=meta or {})
+                    for _, texto, meta, _ in vectoriales[:k]]
+
+        # Fusión: puntuaciones normalizadas a [0, 1] y combinadas con un peso
+        fusion = {}
+        if vectoriales:
+            distancias = [d for *_, d in vectoriales]
+            minima, maxima = min(distancias), max(distancias)
+            for id_fragmento, texto, meta, distancia in vectoriales:
+                cercania = 1.0 if maxima == minima else (maxima - distancia) / (maxima - minima)
+                fusion[id_fragmento] = [self.peso_vectorial * cercania, texto, meta or {}]
+        maximo_lexico = resultados_lexicos[0][1]
+        for pos, puntos, _ in resultados_lexicos:
+            id_fragmento = lexico.ids[pos]
+            entrada = fusion.setdefault(id_fragmento, [0.0, lexico.textos[pos], lexico.metadatos[pos]])
+            entrada[0] += (1 - self.peso_vectorial) * puntos / maximo_lexico
+
+        mejores = sorted(fusion.values(), key=lambda e: e[0], reverse=True)[:k]
+        return [Document(page_content=texto, metadata=meta) for _, texto, meta in mejores]
+
+
+_recuperador = None
+_recuperador_lock = threading.Lock()
+
+
+def obtener_recuperador():
+    """Recuperador único del proceso (se crea en la primera consulta)."""
+    global _recuperador
+    if _recuperador is None:
+        with _recuperador_lock:
+            if _recuperador is None:
+                _recuperador = RecuperadorNormativa(directorio=DB_DIR)
+    return _recuperador
+
+
 def obtener_contexto_relevante(query):
     """Busca en la BD la información más parecida a la pregunta del usuario."""
+    inicio = time.perf_counter()
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-        vectorstore = Chroma(persist_directory=DB_DIR, embedding_function=embeddings)
-        
         # Buscar los 2 fragmentos más relevantes
-        docs = vectorstore.similarity_search(query, k=2)
+        docs = obtener_recuperador().buscar(query, k=2)
         
         contexto = "\n".join([d.page_content for d in docs])
+        observar("sayit_rag_duracion_segundos", time.perf_counter() - inicio, modo=MODO_BUSQUEDA, resultado="ok")
         return contexto
     except Exception as e:
         print(f"⚠️ Error RAG: {e}")
+        observar("sayit_rag_duracion_segundos", time.perf_counter() - inicio, modo=MODO_BUSQUEDA, resultado="error")
+        registrar_evento("error_rag", error=str(e)[:200])
         return ""
 
 if __name__ == "__main__":
@@ -1,126 +1,302 @@
+"""
+Generación de los expedientes PDF.
+
+- La parte fija de cada página (marca de agua, líneas de cabecera, pie) y
+  las etiquetas de la portada son Form XObjects de PDF que cada página solo
+  referencia; por informe se escriben únicamente los valores. reportlab ata
+  un Form a su documento, así que lo que se reutiliza entre informes son sus
+  operaciones ya generadas: se dibujan una vez por proceso y cada documento
+  las copia.
+- Las medidas de la maquetación (anchos de etiquetas, espacio) se calculan
+  una vez al importar el módulo.
+- El resumen se parte en líneas en tiempo lineal (el ancho de cada palabra
+  se mide una sola vez) y continúa en páginas nuevas si no cabe.
+- `generar_pdfs_lote` reparte miles de expedientes en un pool de procesos.
+"""
+import io
 import os
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
 from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.pdfgen import canvas
 from reportlab.lib.colors import black, red, gray, navy
-from datetime import datetime
 
-def generar_pdf_informe(id_informe, fecha_reporte, datos_ia, nombre_centro, id_centro, 
-                        id_director, nombre_director, 
-                        id_docente, nombre_docente, 
-                        id_alumno, nombre_alumno):
+from backend.metricas import contar, observar
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPORTS_DIR = os.getenv("REPORTS_DIR", os.path.join(BASE_DIR, "data", "reports"))
+
+ANCHO, ALTO = letter
+FUENTE, TAMANO = "Helvetica", 10
+INTERLINEADO = TAMANO * 1.2
+ANCHO_LINEA = 450
+MARGEN_INFERIOR = 60  # por encima del pie
+GRAVEDADES_ROJO = ('GRAVE', 'MUY GRAVE', 'CRITICO')
+
+# Posiciones fijas de la portada (las mismas del diseño original)
+Y_SECCION_1 = ALTO - 120
+Y_FECHA = Y_SECCION_1 - 25
+Y_ALUMNO = Y_FECHA - 20
+Y_DIRECTOR = Y_ALUMNO - 20
+Y_DOCENTE = Y_DIRECTOR - 20
+Y_SECCION_2 = Y_DOCENTE - 40
+Y_TIPO = Y_SECCION_2 - 25
+Y_GRAVEDAD = Y_TIPO - 20
+Y_SECCION_3 = Y_GRAVEDAD - 40
+Y_RESUMEN = Y_SECCION_3 - 25
+Y_CONTINUACION = ALTO - 110
+
+X_VALOR = 170
+X_FECHA = 60 + stringWidth("Fecha: ", FUENTE, TAMANO)
+X_CENTRO = 300 + stringWidth("Centro: ", FUENTE, TAMANO)
+LINEAS_PORTADA = int((Y_RESUMEN - MARGEN_INFERIOR) // INTERLINEADO) + 1
+LINEAS_CONTINUACION = int((Y_CONTINUACION - MARGEN_INFERIOR) // INTERLINEADO) + 1
+
+
+def nombre_pdf(id_informe):
+    """Nombre único: varias versiones del mismo expediente nunca se pisan."""
+    return f"Reporte_{id_informe}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(3)}.pdf"
+
+
+def partir_lineas(texto, ancho=ANCHO_LINEA, fuente=FUENTE, tamano=TAMANO):
+    """
+    Reparte el texto en líneas que no superan `ancho` puntos. Cada palabra se
+    mide una vez y el ancho de la línea se acumula (O(n)); los saltos de
+    párrafo se respetan y una palabra más larga que la línea se corta.
+    """
+    espacio = stringWidth(" ", fuente, tamano)
+    lineas = []
+    for parrafo in texto.splitlines() or [""]:
+        actual, ancho_actual = [], 0.0
+        for palabra in parrafo.split():
+            ancho_palabra = stringWidth(palabra, fuente, tamano)
+            while ancho_palabra > ancho:
+                # Palabra imposible de encajar (p.ej. una URL): se corta por caracteres
+                if actual:
+                    lineas.append(" ".join(actual))
+                    actual, ancho_actual = [], 0.0
+                corte, acumulado = 0, 0.0
+                for caracter in palabra:
+                    acumulado += stringWidth(caracter, fuente, tamano)
+                    if acumulado > ancho:
+                        break
+                    corte += 1
+                corte = max(corte, 1)
+                lineas.append(palabra[:corte])
+                palabra = palabra[corte:]
+                ancho_palabra = stringWidth(palabra, fuente, tamano)
+            if not palabra:
+                continue
+            necesario = ancho_palabra + (espacio if actual else 0)
+            if actual and ancho_actual + necesario > ancho:
+                lineas.append(" ".join(actual))
+                actual, ancho_actual = [palabra], ancho_palabra
+            else:
+                actual.append(palabra)
+                ancho_actual += necesario
+        lineas.append(" ".join(actual))
+    return lineas
+
+
+def paginar(lineas):
+    """Lista de páginas: la portada tiene menos hueco que las de continuación."""
+    paginas = [lineas[:LINEAS_PORTADA]]
+    resto = lineas[LINEAS_PORTADA:]
+    while resto:
+        paginas.append(resto[:LINEAS_CONTINUACION])
+        resto = resto[LINEAS_CONTINUACION:]
+    return paginas
+
+
+def _dibujar_fondo(c):
+    # --- MARCA DE AGUA ---
+    c.saveState()
+    c.setFont("Helvetica-Bold", 60)
+    c.setFillColor(gray, alpha=0.1)
+    c.translate(300, 400)
+    c.rotate(45)
+    c.drawCentredString(0, 0, "CONFIDENCIAL")
+    c.restoreState()
+    # --- LÍNEA DE TÍTULO ---
+    c.setStrokeColor(navy)
+    c.setLineWidth(3)
+    c.line(50, ALTO - 50, ANCHO - 50, ALTO - 50)
+    # --- PIE ---
+    c.setFont("Helvetica-Oblique", 8)
+    c.setFillColor(gray)
+    c.drawCentredString(ANCHO / 2, 30, "Documento generado automáticamente por el Sistema Say It")
+
+
+def _dibujar_portada(c):
+    c.setFillColor(black)
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(50, Y_SECCION_1, "1. IDENTIFICACIÓN Y RESPONSABLES")
+    c.drawString(50, Y_SECCION_2, "2. CLASIFICACIÓN DEL INCIDENTE")
+    c.drawString(50, Y_SECCION_3, "3. RESUMEN DE LOS HECHOS")
+    c.setFont(FUENTE, TAMANO)
+    c.drawString(60, Y_FECHA, "Fecha:")
+    c.drawString(300, Y_FECHA, "Centro:")
+    c.setFont("Helvetica-Bold", TAMANO)
+    for y, etiqueta in ((Y_ALUMNO, "Alumno Informante:"), (Y_DIRECTOR, "Director Asignado:"),
+                        (Y_DOCENTE, "Tutor/Docente:"), (Y_TIPO, "Tipo de Incidente:"),
+                        (Y_GRAVEDAD, "Nivel de Gravedad:")):
+        c.drawString(60, y, etiqueta)
+
+
+PLANTILLAS = (("fondo", _dibujar_fondo), ("portada", _dibujar_portada))
+
+# Parte fija ya dibujada en este proceso: operaciones de cada Form y las
+# fuentes y transparencias que nombran (ver `preparar_plantillas`)
+_plantillas = None
+
+
+def preparar_plantillas():
+    """Dibuja la parte fija una vez en un lienzo auxiliar (inicializador de los procesos del lote)."""
+    global _plantillas
+    if _plantillas is None:
+        c = canvas.Canvas(io.BytesIO(), pagesize=letter)
+        operaciones = {}
+        for nombre, dibujar in PLANTILLAS:
+            c.beginForm(nombre)
+            dibujar(c)
+            operaciones[nombre] = list(c._code)
+            c.endForm()
+        _plantillas = (operaciones, dict(c._doc.fontMapping), dict(c._extgstate._c))
+    return _plantillas
+
+
+def _definir_plantillas(c):
+    """
+    Form XObjects del documento: fondo de todas las páginas y etiquetas de la
+    portada. En un lienzo nuevo las fuentes y transparencias reciben los
+    mismos nombres internos que en el auxiliar y basta copiar las
+    operaciones; si no coinciden, se dibujan como siempre.
+    """
+    operaciones, fuentes, transparencias = preparar_plantillas()
+    for fuente in fuentes:
+        c._doc.getInternalFontName(fuente)
+    reutilizable = c._doc.fontMapping == fuentes and not c._extgstate._c
+    if reutilizable:
+        c._extgstate._c.update(transparencias)
+    for nombre, dibujar in PLANTILLAS:
+        c.beginForm(nombre)
+        if reutilizable:
+            c._code.extend(operaciones[nombre])
+        else:
+            dibujar(c)
+        c.endForm()
+
+
+def _cabecera(c, id_informe, pagina, total):
+    c.doForm("fondo")
+    c.setFont("Helvetica-Bold", 18)
+    c.setFillColor(navy)
+    titulo = f"REPORTE DE INCIDENCIA #{id_informe}"
+    c.drawString(50, ALTO - 80, titulo if pagina == 1 else f"{titulo} (continuación)")
+    if total > 1:
+        c.setFont("Helvetica-Oblique", 8)
+        c.setFillColor(gray)
+        c.drawRightString(ANCHO - 50, 30, f"Página {pagina} de {total}")
+    c.setFillColor(black)
+
+
+def _lineas_texto(c, x, y, lineas):
+    texto = c.beginText(x, y)
+    texto.setFont(FUENTE, TAMANO)
+    texto.setLeading(INTERLINEADO)
+    for linea in lineas:
+        texto.textLine(linea)
+    c.drawText(texto)
+
+
+def generar_pdf_informe(id_informe, fecha_reporte, datos_ia, nombre_centro, id_centro,
+                        id_director, nombre_director,
+                        id_docente, nombre_docente,
+                        id_alumno, nombre_alumno, directorio=None, nombre_archivo=None):
     """
     Genera un expediente PDF incluyendo NOMBRES e IDs de todos los implicados.
+    Se guarda en `directorio` (por defecto REPORTS_DIR) con `nombre_archivo`
+    (por defecto uno único) y devuelve la ruta, o None si falla.
     """
-    output_dir = os.path.join(os.getcwd(), "data", "reports")
+    output_dir = directorio or REPORTS_DIR
     os.makedirs(output_dir, exist_ok=True)
-    
-    filename = f"Reporte_{id_informe}_{datetime.now().strftime('%Y%m%d')}.pdf"
-    filepath = os.path.join(output_dir, filename)
-    
+
+    filepath = os.path.join(output_dir, nombre_archivo or nombre_pdf(id_informe))
+    temporal = f"{filepath}.{os.getpid()}.tmp"
+
+    inicio = time.perf_counter()
     try:
-        c = canvas.Canvas(filepath, pagesize=letter)
-        width, height = letter
-        
-        # --- MARCA DE AGUA ---
-        c.saveState()
-        c.setFont("Helvetica-Bold", 60)
-        c.setFillColor(gray, alpha=0.1)
-        c.translate(300, 400)
-        c.rotate(45)
-        c.drawCentredString(0, 0, "CONFIDENCIAL")
-        c.restoreState()
-        
-        # --- TÍTULO ---
-        c.setStrokeColor(navy)
-        c.setLineWidth(3)
-        c.line(50, height - 50, width - 50, height - 50)
-        c.setFont("Helvetica-Bold", 18)
-        c.setFillColor(navy)
-        c.drawString(50, height - 80, f"REPORTE DE INCIDENCIA #{id_informe}")
-        
-        # --- 1. DATOS DE IDENTIFICACIÓN (Nombres + IDs) ---
-        y = height - 120
-        c.setFillColor(black)
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(50, y, "1. IDENTIFICACIÓN Y RESPONSABLES")
-        y -= 25
-        
-        c.setFont("Helvetica", 10)
-        # Fila 1: Fecha y Centro
-        c.drawString(60, y, f"Fecha: {fecha_reporte}")
-        c.drawString(300, y, f"Centro: {nombre_centro} (ID: {id_centro})")
-        y -= 20
-        
-        # Fila 2: Alumno Informante
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(60, y, "Alumno Informante:")
-        c.setFont("Helvetica", 10)
-        c.drawString(170, y, f"{nombre_alumno} (ID: {id_alumno})")
-        y -= 20
-        
-        # Fila 3: Director Responsable
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(60, y, "Director Asignado:")
-        c.setFont("Helvetica", 10)
-        c.drawString(170, y, f"{nombre_director} (ID: {id_director if id_director else 'N/A'})")
-        y -= 20
-        
-        # Fila 4: Tutor/Docente
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(60, y, "Tutor/Docente:")
-        c.setFont("Helvetica", 10)
-        c.drawString(170, y, f"{nombre_docente} (ID: {id_docente if id_docente else 'N/A'})")
-        
-        # --- 2. CLASIFICACIÓN ---
-        y -= 40
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(50, y, "2. CLASIFICACIÓN DEL INCIDENTE")
-        y -= 25
-        
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(60, y, "Tipo de Incidente:")
-        c.setFont("Helvetica", 10)
-        c.drawString(170, y, str(datos_ia.get('tipo_incidente', 'No especificado')))
-        
-        y -= 20
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(60, y, "Nivel de Gravedad:")
+        resumen = datos_ia.get('resumen_hechos', 'Sin resumen disponible.')
+        paginas = paginar(partir_lineas(str(resumen)))
+
+        c = canvas.Canvas(temporal, pagesize=letter)
+        _definir_plantillas(c)
+
+        # --- PORTADA: solo los valores, las etiquetas vienen de la plantilla ---
+        _cabecera(c, id_informe, 1, len(paginas))
+        c.doForm("portada")
+        c.setFont(FUENTE, TAMANO)
+        c.drawString(X_FECHA, Y_FECHA, str(fecha_reporte))
+        c.drawString(X_CENTRO, Y_FECHA, f"{nombre_centro} (ID: {id_centro})")
+        c.drawString(X_VALOR, Y_ALUMNO, f"{nombre_alumno} (ID: {id_alumno})")
+        c.drawString(X_VALOR, Y_DIRECTOR, f"{nombre_director} (ID: {id_director if id_director else 'N/A'})")
+        c.drawString(X_VALOR, Y_DOCENTE, f"{nombre_docente} (ID: {id_docente if id_docente else 'N/A'})")
+        c.drawString(X_VALOR, Y_TIPO, str(datos_ia.get('tipo_incidente', 'No especificado')))
         gravedad = datos_ia.get('nivel_gravedad', 'LEVE')
-        if gravedad in ['GRAVE', 'MUY GRAVE', 'CRITICO']:
+        c.setFont("Helvetica-Bold", TAMANO)
+        if gravedad in GRAVEDADES_ROJO:
             c.setFillColor(red)
-        c.drawString(170, y, gravedad)
+        c.drawString(X_VALOR, Y_GRAVEDAD, str(gravedad))
         c.setFillColor(black)
-        
-        # --- 3. HECHOS ---
-        y -= 40
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(50, y, "3. RESUMEN DE LOS HECHOS")
-        y -= 25
-        
-        resumen = datos_ia.get('resumen_hechos', 'Sin resumen disponible.')
-        
-        text_object = c.beginText(60, y)
-        text_object.setFont("Helvetica", 10)
-        text_object.setTextOrigin(60, y)
-        palabras = resumen.split()
-        linea_actual = ""
-        for palabra in palabras:
-            if c.stringWidth(linea_actual + " " + palabra, "Helvetica", 10) < 450:
-                linea_actual += " " + palabra
-            else:
-                text_object.textLine(linea_actual)
-                linea_actual = palabra
-        text_object.textLine(linea_actual)
-        c.drawText(text_object)
-        
-        # Pie de página
-        c.setFont("Helvetica-Oblique", 8)
-        c.setFillColor(gray)
-        c.drawCentredString(width/2, 30, "Documento generado automáticamente por el Sistema Say It")
-        
+        _lineas_texto(c, 60, Y_RESUMEN, paginas[0])
+
+        # --- PÁGINAS DE CONTINUACIÓN DEL RESUMEN ---
+        for numero, lineas in enumerate(paginas[1:], start=2):
+            c.showPage()
+            _cabecera(c, id_informe, numero, len(paginas))
+            _lineas_texto(c, 60, Y_CONTINUACION, lineas)
+
         c.save()
+        # Un lector (o una regeneración simultánea) nunca ve un PDF a medias
+        os.replace(temporal, filepath)
+        observar("sayit_pdf_duracion_segundos", time.perf_counter() - inicio, resultado="ok")
         return filepath
-        
+
     except Exception as e:
         print(f"Error PDF: {e}")
-        return None
\ No newline at end of file
+        observar("sayit_pdf_duracion_segundos", time.perf_counter() - inicio, resultado="error")
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        return None
+
+
+def _generar_desde_dict(argumentos):
+    return generar_pdf_informe(**argumentos)
+
+
+def generar_pdfs_lote(lista_argumentos, procesos=None, directorio=None):
+    """
+    Genera muchos expedientes en paralelo (un proceso por núcleo por defecto).
+    `lista_argumentos` son dicts con los parámetros de `generar_pdf_informe`.
+    Devuelve las rutas en el mismo orden (None en los que fallen).
+    Las métricas por PDF se quedan en los procesos hijos: aquí se mide el lote.
+    """
+    lista_argumentos = [dict(a, directorio=directorio or a.get("directorio")) for a in lista_argumentos]
+    inicio = time.perf_counter()
+    if procesos == 1 or len(lista_argumentos) < 2:
+        rutas = [_generar_desde_dict(a) for a in lista_argumentos]
+    else:
+        procesos = procesos or os.cpu_count() or 2
+        # Lotes grandes por tarea: el coste de enviar los datos al proceso es mínimo
+        tamano_tarea = max(1, len(lista_argumentos) // (procesos * 4))
+        with ProcessPoolExecutor(max_workers=procesos, initializer=preparar_plantillas) as pool:
+            rutas = list(pool.map(_generar_desde_dict, lista_argumentos, chunksize=tamano_tarea))
+    observar("sayit_pdf_lote_segundos", time.perf_counter() - inicio, resultado="ok")
+    fallidos = rutas.count(None)
+    contar("sayit_pdf_generados_total", len(rutas) - fallidos, resultado="ok")
+    contar("sayit_pdf_generados_total", fallidos, resultado="error")
+    return rutas
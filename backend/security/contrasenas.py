@@ -0,0 +1,98 @@
+"""
+Hash y verificación de contraseñas.
+
+- El método y su coste se configuran con PASSWORD_HASH_METHOD (formato de
+  werkzeug, p.ej. "scrypt:32768:8:1" o "pbkdf2:sha256:600000").
+- La verificación es cara a propósito, así que se hace en un pool de hilos
+  acotado (HILOS_VERIFICACION): aunque lleguen cien logins a la vez a las
+  8:00, como mucho N derivaciones de clave compiten por la CPU y el resto
+  espera en cola en vez de degradar a todos. hashlib libera el GIL durante
+  el cálculo, así que los hilos sí aprovechan varios núcleos.
+- Si el hash guardado usa otro método/coste (o es texto plano heredado de
+  la demo), `verificar` avisa para volver a guardarlo con el actual.
+"""
+import hashlib
+import hmac
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+METODO_HASH = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+HILOS_VERIFICACION = int(os.getenv("HILOS_VERIFICACION", str(os.cpu_count() or 2)))
+
+_PREFIJOS_KDF = ("scrypt", "pbkdf2")
+_pool = ThreadPoolExecutor(max_workers=HILOS_VERIFICACION, thread_name_prefix="verificar-pass")
+_hash_senuelo = None
+
+
+def generar_hash(password, metodo=None, sal=None):
+    """
+    Hash en el formato de werkzeug ("metodo$sal$hash"). La sal es aleatoria;
+    `sal` solo se pasa para datos reproducibles (p.ej. los sintéticos), nunca
+    para contraseñas reales.
+    """
+    if sal is None:
+        return generate_password_hash(password, method=metodo or METODO_HASH)
+    return _hash_con_sal(password, metodo or METODO_HASH, sal)
+
+
+def _hash_con_sal(password, metodo, sal):
+    """
+    Deriva la clave con hashlib y la guarda en el formato de werkzeug, que la
+    verifica con check_password_hash (sin depender de sus funciones internas).
+    """
+    nombre, *parametros = metodo.split(":")
+    if nombre == "scrypt":
+        n, r, p = map(int, parametros) if parametros else (32768, 8, 1)
+        valor = hashlib.scrypt(password.encode(), salt=sal.encode(), n=n, r=r, p=p,
+                               maxmem=132 * n * r * p).hex()
+        return f"scrypt:{n}:{r}:{p}${sal}${valor}"
+    if nombre == "pbkdf2" and len(parametros) == 2:
+        algoritmo, iteraciones = parametros[0], int(parametros[1])
+        valor = hashlib.pbkdf2_hmac(algoritmo, password.encode(), sal.encode(), iteraciones).hex()
+        return f"pbkdf2:{algoritmo}:{iteraciones}${sal}${valor}"
+    raise ValueError(f"Método de hash no admitido con sal fija: {metodo} "
+                     "(usa scrypt[:n:r:p] o pbkdf2:algoritmo:iteraciones)")
+
+
+def es_hash(valor):
+    """¿Es un hash de werkzeug ("metodo$sal$hash") y no una contraseña en claro?"""
+    return bool(valor) and valor.count("$") == 2 and valor.startswith(_PREFIJOS_KDF)
+
+
+def verificar(almacenado, password, metodo=None):
+    """
+    Comprueba `password` contra lo guardado.
+    Devuelve (correcta, necesita_rehash).
+    """
+    if not almacenado or password is None:
+        return False, False
+    if not es_hash(almacenado):
+        # Credencial heredada en claro: se acepta una vez y se migra a hash
+        correcta = hmac.compare_digest(almacenado.encode("utf-8"), password.encode("utf-8"))
+        return correcta, correcta
+    correcta = check_password_hash(almacenado, password)
+    metodo_guardado = almacenado.split("$", 1)[0]
+    return correcta, correcta and metodo_guardado != (metodo or METODO_HASH)
+
+
+def verificar_en_pool(almacenado, password):
+    """Como `verificar`, pero ejecutado en el pool acotado (devuelve un Future)."""
+    return _pool.submit(verificar, almacenado, password)
+
+
+def generar_hash_en_pool(password):
+    """Como `generar_hash`, pero en el pool acotado (devuelve un Future)."""
+    return _pool.submit(generar_hash, password)
+
+
+def verificar_senuelo(password):
+    """
+    Gasta el mismo tiempo que una verificación real cuando el email no
+    existe, para que el tiempo de respuesta no revele qué cuentas hay.
+    """
+    global _hash_senuelo
+    if _hash_senuelo is None:
+        _hash_senuelo = generar_hash("senuelo-sin-cuenta")
+    return _pool.submit(check_password_hash, _hash_senuelo, password or "")
@@ -0,0 +1,163 @@
+"""
+Conversaciones del alumno guardadas en el servidor.
+
+- Cada alumno tiene como mucho una sesión "abierta". Cada turno (mensaje +
+  respuesta) se añade como una fila nueva y lo anterior no se reescribe.
+- Al volver a entrar (o si se recarga el navegador), el alumno recupera su
+  conversación. El chat y la denuncia leen el historial de aquí, no del
+  que reenvía el navegador.
+- Al registrar la denuncia la sesión se cierra y el trabajo de análisis
+  solo guarda su id. `purgar_sesiones` borra las cerradas tras
+  SESIONES_CHAT_RETENCION_HORAS (salvo si su análisis sigue pendiente o
+  reintentándose: aún necesita la conversación), las abiertas abandonadas tras
+  SESIONES_CHAT_TTL_HORAS sin actividad y, con la misma retención, los
+  trabajos de la cola ya terminados (por si alguno aún lleva conversación).
+
+    python -m backend.sesiones_chat --purgar
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, or_, select, update
+
+from backend.cola import purgar_trabajos
+from backend.models import db, Identidad, SesionChat, Trabajo, TurnoChat
+
+SESIONES_CHAT_TTL_HORAS = int(os.getenv("SESIONES_CHAT_TTL_HORAS", "72"))
+SESIONES_CHAT_RETENCION_HORAS = int(os.getenv("SESIONES_CHAT_RETENCION_HORAS", "24"))
+INTERVALO_PURGA_SEGUNDOS = 600
+TAMANO_LOTE_PURGA = 500
+
+_ultima_purga = 0.0
+_cerrojo_purga = threading.Lock()
+
+
+def id_alumno_por_email(email):
+    """Id del alumno con ese email (búsqueda indexada en `identidades`), o None."""
+    if not email:
+        return None
+    return db.session.execute(
+        select(Identidad.id_usuario)
+        .where(Identidad.email == email.strip().lower(), Identidad.rol == "alumno")
+    ).scalar()
+
+
+def sesion_abierta(id_alumno, crear=False):
+    """La sesión abierta y no caducada del alumno; con `crear`, una nueva si no hay (sin commit)."""
+    limite = datetime.utcnow() - timedelta(hours=SESIONES_CHAT_TTL_HORAS)
+    sesion = db.session.execute(
+        select(SesionChat)
+        .where(SesionChat.id_alumno == id_alumno, SesionChat.estado == "abierta",
+               SesionChat.actualizada >= limite)
+        .order_by(SesionChat.actualizada.desc()).limit(1)
+    ).scalar()
+    if sesion is None and crear:
+        sesion = SesionChat(id_alumno=id_alumno, estado="abierta", turnos=0)
+        db.session.add(sesion)
+        db.session.flush()
+    return sesion
+
+
+def turnos_sesion(id_sesion):
+    """Historial de la sesión como [(alumno, say_it), ...]."""
+    filas = db.session.execute(
+        select(TurnoChat.mensaje, TurnoChat.respuesta)
+        .where(TurnoChat.id_sesion == id_sesion).order_by(TurnoChat.numero)
+    ).all()
+    return [(mensaje, respuesta) for mensaje, respuesta in filas]
+
+
+def anadir_turno(id_sesion, mensaje, respuesta):
+    """
+    Añade un turno al final de la sesión y la marca como activa. El número
+    sale del propio UPDATE de la sesión, que la bloquea hasta el commit: dos
+    turnos simultáneos de la misma sesión reciben números seguidos y
+    ninguno se pierde contra la restricción única.
+    """
+    numero = db.session.execute(
+        update(SesionChat).where(SesionChat.id_sesion == id_sesion)
+        .values(turnos=func.coalesce(SesionChat.turnos, 0) + 1, actualizada=datetime.utcnow())
+        .returning(SesionChat.turnos)
+    ).scalar()
+    if numero is None:
+        db.session.rollback()
+        return
+    db.session.add(TurnoChat(id_sesion=id_sesion, numero=numero, mensaje=mensaje, respuesta=respuesta))
+    db.session.commit()
+
+
+def cerrar_sesion(sesion, id_informe):
+    """La denuncia ya está registrada: la sesión deja de retomarse (sin commit)."""
+    sesion.estado = "cerrada"
+    sesion.id_informe = id_informe
+    sesion.actualizada = datetime.utcnow()
+
+
+def historial_para_chat(email):
+    """Conversación abierta del alumno en el formato de gr.Chatbot ([[alumno, say_it], ...])."""
+    id_alumno = id_alumno_por_email(email)
+    sesion = sesion_abierta(id_alumno) if id_alumno else None
+    if sesion is None:
+        return []
+    return [[mensaje, respuesta] for mensaje, respuesta in turnos_sesion(sesion.id_sesion)]
+
+
+def purgar_sesiones(ahora=None):
+    """
+    Borra (por lotes) las sesiones caducadas con sus turnos y los trabajos
+    terminados antiguos. Devuelve {"sesiones": n, "trabajos": n}.
+    """
+    ahora = ahora or datetime.utcnow()
+    # El trabajo de análisis solo lleva el id de la sesión: mientras espere
+    # (p.ej. en backoff tras un fallo) la conversación no se puede borrar
+    analisis_pendiente = select(Trabajo.id_trabajo).where(
+        Trabajo.id_informe == SesionChat.id_informe, Trabajo.tipo == "analisis",
+        Trabajo.estado.in_(("pendiente", "en_curso"))).exists()
+    caducadas = or_(
+        and_(SesionChat.estado == "abierta",
+             SesionChat.actualizada < ahora - timedelta(hours=SESIONES_CHAT_TTL_HORAS)),
+        and_(SesionChat.estado == "cerrada",
+             SesionChat.actualizada < ahora - timedelta(hours=SESIONES_CHAT_RETENCION_HORAS),
+             ~analisis_pendiente),
+    )
+    borradas = 0
+    while True:
+        ids = db.session.execute(
+            select(SesionChat.id_sesion).where(caducadas).limit(TAMANO_LOTE_PURGA)).scalars().all()
+        if not ids:
+            break
+        db.session.execute(delete(TurnoChat).where(TurnoChat.id_sesion.in_(ids)))
+        db.session.execute(delete(SesionChat).where(SesionChat.id_sesion.in_(ids)))
+        db.session.commit()
+        borradas += len(ids)
+    trabajos = purgar_trabajos(ahora - timedelta(hours=SESIONES_CHAT_RETENCION_HORAS))
+    return {"sesiones": borradas, "trabajos": trabajos}
+
+
+def purgar_si_toca():
+    """`purgar_sesiones` como mucho cada INTERVALO_PURGA_SEGUNDOS (se llama en el login)."""
+    global _ultima_purga
+    with _cerrojo_purga:
+        if time.monotonic() - _ultima_purga < INTERVALO_PURGA_SEGUNDOS:
+            return {"sesiones": 0, "trabajos": 0}
+        _ultima_purga = time.monotonic()
+    borradas = purgar_sesiones()
+    if borradas["sesiones"] or borradas["trabajos"]:
+        print(f"🧹 {borradas['sesiones']} sesiones de chat caducadas y "
+              f"{borradas['trabajos']} trabajos terminados borrados.")
+    return borradas
+
+
+if __name__ == "__main__":
+    import argparse
+    from main import app
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de las sesiones de chat")
+    parser.add_argument("--purgar", action="store_true", help="Borra las sesiones caducadas")
+    args = parser.parse_args()
+    if args.purgar:
+        with app.app_context():
+            borradas = purgar_sesiones()
+            print(f"✅ {borradas['sesiones']} sesiones y {borradas['trabajos']} trabajos borrados.")
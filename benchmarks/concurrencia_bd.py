@@ -0,0 +1,120 @@
+"""
+Benchmark: N escritores guardando informes mientras M lectores consultan el dashboard.
+
+Usa los modelos reales y la configuración de backend/database.py sobre una
+base de datos temporal (o la de DATABASE_URL si se define). Informa de
+operaciones por segundo, latencias y errores "database is locked".
+
+    python benchmarks/concurrencia_bd.py --escritores 8 --lectores 4 --segundos 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy.exc import OperationalError
+
+from backend.database import configurar_base_datos
+from backend.models import db, CentroEstudios, Informe, Trabajo, obtener_pagina_informes
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+class Resultados:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias = {"escritura": [], "lectura": []}
+        self.bloqueos = {"escritura": 0, "lectura": 0}
+
+    def anotar(self, tipo, segundos=None, bloqueo=False):
+        with self.lock:
+            if bloqueo:
+                self.bloqueos[tipo] += 1
+            else:
+                self.latencias[tipo].append(segundos)
+
+
+def escritor(app, id_centro, fin, resultados):
+    with app.app_context():
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            try:
+                # Lo mismo que guarda el formulario: informe + primera etapa de la cola
+                informe = Informe(fecha_informe=datetime.utcnow(), tipo_bullying="Verbal",
+                                  descripcion="Informe de prueba de carga", estado="Pendiente",
+                                  id_centro_estudios=id_centro)
+                db.session.add(informe)
+                db.session.flush()
+                db.session.add(Trabajo(tipo="analisis", id_informe=informe.id_informe,
+                                       carga="{}", estado="hecho"))
+                db.session.commit()
+                resultados.anotar("escritura", time.perf_counter() - inicio)
+            except OperationalError:
+                db.session.rollback()
+                resultados.anotar("escritura", bloqueo=True)
+
+
+def lector(app, id_centro, fin, resultados):
+    with app.app_context():
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            try:
+                obtener_pagina_informes(centros=[id_centro], limite=50)
+                db.session.rollback()  # cierra la transacción de lectura
+                resultados.anotar("lectura", time.perf_counter() - inicio)
+            except OperationalError:
+                db.session.rollback()
+                resultados.anotar("lectura", bloqueo=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--escritores", type=int, default=8)
+    parser.add_argument("--lectores", type=int, default=4)
+    parser.add_argument("--segundos", type=float, default=10)
+    args = parser.parse_args()
+
+    temporal = tempfile.mkdtemp(prefix="sayit-bench-")
+    app = Flask(__name__)
+    url = configurar_base_datos(app, os.path.join(temporal, "bench.db"))
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        centro = CentroEstudios(denominacion_especifica="Centro de carga")
+        db.session.add(centro)
+        db.session.commit()
+        id_centro = centro.id_centro_estudios
+
+    print(f"🗄️  {url} | {args.escritores} escritores, {args.lectores} lectores, {args.segundos}s")
+    resultados = Resultados()
+    fin = time.monotonic() + args.segundos
+    hilos = [threading.Thread(target=escritor, args=(app, id_centro, fin, resultados))
+             for _ in range(args.escritores)]
+    hilos += [threading.Thread(target=lector, args=(app, id_centro, fin, resultados))
+              for _ in range(args.lectores)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    print(f"{'operación':>10} {'ops/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'bloqueos':>9}")
+    for tipo in ("escritura", "lectura"):
+        lat = resultados.latencias[tipo]
+        print(f"{tipo:>10} {len(lat) / args.segundos:>8.1f} {1000 * percentil(lat, 0.50):>8.1f} "
+              f"{1000 * percentil(lat, 0.95):>8.1f} {1000 * percentil(lat, 0.99):>8.1f} "
+              f"{resultados.bloqueos[tipo]:>9}")
+
+
+if __name__ == "__main__":
+    main()
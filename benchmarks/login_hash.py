@@ -0,0 +1,50 @@
+"""
+Benchmark: logins por segundo con el método de hash configurado.
+
+Mide cuántas verificaciones de contraseña por segundo se consiguen con
+1..N hilos del pool y cuántas corresponden a cada núcleo, para dimensionar
+HILOS_VERIFICACION y PASSWORD_HASH_METHOD antes del pico de las 8:00.
+
+    python benchmarks/login_hash.py --metodo scrypt:32768:8:1 --logins 200
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.security.contrasenas import METODO_HASH, generar_hash, verificar
+
+
+def medir(hash_guardado, logins, hilos):
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        resultados = list(pool.map(lambda _: verificar(hash_guardado, "12345")[0], range(logins)))
+    segundos = time.perf_counter() - inicio
+    assert all(resultados)
+    return logins / segundos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--metodo", default=METODO_HASH, help="Método werkzeug (coste incluido)")
+    parser.add_argument("--logins", type=int, default=100, help="Verificaciones por medición")
+    parser.add_argument("--max-hilos", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    nucleos = os.cpu_count() or 1
+    hash_guardado = generar_hash("12345", metodo=args.metodo)
+    print(f"🔐 Método: {args.metodo} | núcleos: {nucleos} | {args.logins} logins por medición")
+    print(f"{'hilos':>6} {'logins/s':>10} {'logins/s/núcleo':>16} {'ms/login':>9}")
+    hilos = 1
+    while hilos <= args.max_hilos:
+        por_segundo = medir(hash_guardado, args.logins, hilos)
+        print(f"{hilos:>6} {por_segundo:>10.1f} {por_segundo / min(hilos, nucleos):>16.1f} "
+              f"{1000 * hilos / por_segundo:>9.1f}")
+        hilos *= 2
+
+
+if __name__ == "__main__":
+    main()
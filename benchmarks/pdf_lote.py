@@ -0,0 +1,48 @@
+"""
+Benchmark: expedientes PDF por segundo, en serie y con el pool de procesos.
+
+    python benchmarks/pdf_lote.py --informes 2000 --palabras 600
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.reporting import generar_pdfs_lote, partir_lineas, paginar
+
+
+def argumentos(n, palabras):
+    resumen = " ".join(f"palabra{i % 97}" for i in range(palabras))
+    return [dict(
+        id_informe=i, fecha_reporte="01/06/2025 10:00",
+        datos_ia={"tipo_incidente": "Verbal", "nivel_gravedad": "GRAVE", "resumen_hechos": resumen},
+        nombre_centro="IES Demo", id_centro=1, id_director=1, nombre_director="Sr. Director",
+        id_docente=2, nombre_docente="Tutora", id_alumno=3, nombre_alumno="Alumno",
+    ) for i in range(1, n + 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--informes", type=int, default=500)
+    parser.add_argument("--palabras", type=int, default=300, help="Palabras del resumen")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    lista = argumentos(args.informes, args.palabras)
+    paginas = len(paginar(partir_lineas(lista[0]["datos_ia"]["resumen_hechos"])))
+    print(f"📄 {args.informes} expedientes de {paginas} página(s)")
+    for procesos in sorted({1, args.procesos}):
+        with tempfile.TemporaryDirectory() as directorio:
+            inicio = time.perf_counter()
+            rutas = generar_pdfs_lote(lista, procesos=procesos, directorio=directorio)
+            segundos = time.perf_counter() - inicio
+        fallidos = rutas.count(None)
+        print(f"{procesos:>3} proceso(s): {args.informes / segundos:8.1f} PDF/s "
+              f"({segundos:.1f}s, {fallidos} fallidos)")
+
+
+if __name__ == "__main__":
+    main()
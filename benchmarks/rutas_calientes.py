@@ -0,0 +1,331 @@
+"""
+Benchmark de las rutas calientes de Say It, sin red y comparable entre versiones.
+
+Todo corre en local con dobles: IA simulada (LLM_BACKEND=falso), embeddings
+falsos (EMBEDDINGS_BACKEND=falso) y un servidor SMTP en memoria. La base de
+datos es un SQLite temporal cargado con backend/data_science/generar_datos_sinteticos.py
+a la escala pedida (misma semilla = mismos datos).
+
+Para cada caso mide p50/p95/p99 y operaciones por segundo y guarda el
+resultado en JSON. Con --comparar hace de puerta de regresión: termina con
+código 1 si algún caso empeora su p95 más de --tolerancia respecto a la base.
+
+    python benchmarks/rutas_calientes.py --escala media --salida resultados/base.json
+    python benchmarks/rutas_calientes.py --escala media --comparar resultados/base.json
+    python benchmarks/rutas_calientes.py --casos generar_pdf_informe obtener_contexto_relevante_frio
+
+La búsqueda en la normativa se mide dos veces: "_frio" con una consulta
+distinta en cada repetición (calcula el embedding) y "_cache" repitiendo unas
+pocas consultas (tras el calentamiento, todo sale de la caché de embeddings).
+Ambas van en modo "vector" (sin el atajo léxico del híbrido) y con un
+proveedor de embeddings falso que tarda --latencia-embeddings ms por llamada.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+CASOS = ["procesar_login", "responder_alumno", "guardar_informe_bd", "obtener_datos_dashboard",
+         "generar_pdf_informe", "obtener_contexto_relevante_frio", "obtener_contexto_relevante_cache",
+         "enviar_correos"]
+CASOS_RAG = {"obtener_contexto_relevante_frio", "obtener_contexto_relevante_cache"}
+# Casos que necesitan la app (main.py) y la base de datos sintética
+CASOS_CON_BD = {"procesar_login", "responder_alumno", "guardar_informe_bd",
+                "obtener_datos_dashboard", "enviar_correos"}
+# Una diferencia por debajo de esto es ruido, sea cual sea el porcentaje
+MARGEN_MINIMO_MS = 0.5
+
+PARRAFOS_NORMATIVA = [
+    "Ante una comunicación de acoso escolar la dirección del centro abrirá expediente en un plazo "
+    "máximo de dos días lectivos e informará a las familias de los alumnos implicados.",
+    "El protocolo de ciberacoso establece que las capturas y mensajes aportados por el alumno se "
+    "conservarán como prueba y no se pedirá al menor que borre el contenido.",
+    "Las agresiones físicas con lesiones se comunicarán de inmediato a la familia y, si procede, a "
+    "los servicios sanitarios y a la Policía Local o Guardia Civil.",
+    "El tutor o tutora realizará entrevistas individuales con la víctima, los testigos y los "
+    "presuntos agresores, garantizando la confidencialidad de quien informa.",
+    "Las medidas de protección de la víctima incluyen la vigilancia de recreos, pasillos y "
+    "vestuarios y el cambio de grupo del agresor cuando sea necesario.",
+    "La exclusión social reiterada y la difusión de rumores se consideran conductas contrarias "
+    "a la convivencia y se tratarán según el plan de convivencia del centro.",
+]
+CONSULTAS = ["me pegan en el recreo", "me insultan por whatsapp", "qué hace el tutor si denuncio",
+             "me han pasado fotos mías", "nadie me habla en clase", "me amenazan a la salida",
+             "tengo miedo de ir al instituto", "me empujan en el vestuario"]
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+class SMTPFalso:
+    """Servidor SMTP en memoria: acepta todo y cuenta lo enviado."""
+
+    def __init__(self):
+        self.enviados = 0
+
+    def send_message(self, mensaje, from_addr=None, to_addrs=None):
+        self.enviados += 1
+        return {}
+
+    def noop(self):
+        return 250, b"OK"
+
+    def quit(self):
+        pass
+
+
+def _preparar_entorno(directorio):
+    """Dobles y rutas temporales. Debe ir antes de importar el backend (lee el entorno al importar)."""
+    os.environ.update({
+        "LLM_BACKEND": "falso",
+        "EMBEDDINGS_BACKEND": "falso",
+        "DATABASE_URL": f"sqlite:///{os.path.join(directorio, 'benchmark.db')}",
+        "REPORTS_DIR": os.path.join(directorio, "reports"),
+        "SMTP_HOST": "",
+        # Las métricas se siguen midiendo; solo se apaga el registro por línea
+        "LOG_EVENTOS": "no",
+    })
+
+
+def _indice_normativa(directorio):
+    """Índice RAG temporal (documentos sintéticos, embeddings falsos) como recuperador del proceso."""
+    from backend import rag
+    from backend.data_science.embeddings import crear_embeddings
+    from backend.data_science.indexador import IndexadorIncremental
+
+    documentos = os.path.join(directorio, "documentos_rag")
+    indice = os.path.join(directorio, "vector_store")
+    os.makedirs(documentos, exist_ok=True)
+    for n in range(12):
+        with open(os.path.join(documentos, f"protocolo_{n}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n\n".join(PARRAFOS_NORMATIVA[(n + i) % len(PARRAFOS_NORMATIVA)] for i in range(8)))
+    IndexadorIncremental(docs_dir=documentos, db_dir=indice, embeddings=crear_embeddings("falso"),
+                         chunk_size=1000, chunk_overlap=200).indexar()
+    rag._recuperador = rag.RecuperadorNormativa(directorio=indice, embeddings=crear_embeddings("falso"))
+    return indice
+
+
+def _muestras(app, semilla):
+    """Emails de alumnos y directores sintéticos para repartir las peticiones."""
+    from sqlalchemy import select
+    from backend.models import db, Identidad
+
+    with app.app_context():
+        filas = db.session.execute(
+            select(Identidad.email, Identidad.rol).where(Identidad.rol.in_(["alumno", "director"]))
+        ).all()
+    rng = random.Random(semilla)
+    alumnos = sorted(e for e, rol in filas if rol == "alumno")
+    directores = sorted(e for e, rol in filas if rol == "director")
+    rng.shuffle(alumnos)
+    rng.shuffle(directores)
+    return alumnos, directores
+
+
+def _historial(i, turnos):
+    return [[f"Mensaje {n} de la conversación {i}: se meten conmigo en el patio", "Lo siento mucho. ¿Quién?"]
+            for n in range(turnos)]
+
+
+def construir_casos(seleccion, args, directorio):
+    """{nombre: funcion(i)}; prepara solo lo que necesitan los casos elegidos."""
+    casos = {}
+    if "generar_pdf_informe" in seleccion:
+        from backend.reporting import generar_pdf_informe
+        resumen = " ".join(f"palabra{n % 97}" for n in range(args.palabras_pdf))
+        destino = os.path.join(directorio, "pdf")
+
+        def pdf(i):
+            generar_pdf_informe(
+                id_informe=i, fecha_reporte="01/06/2025 10:00",
+                datos_ia={"tipo_incidente": "Verbal", "nivel_gravedad": "GRAVE", "resumen_hechos": resumen},
+                nombre_centro="IES Demo", id_centro=1, id_director=1, nombre_director="Dirección",
+                id_docente=2, nombre_docente="Tutora", id_alumno=3, nombre_alumno="Alumno",
+                directorio=destino, nombre_archivo=f"{i % 50}.pdf")
+        casos["generar_pdf_informe"] = pdf
+
+    if seleccion & (CASOS_RAG | {"responder_alumno"}):
+        indice = _indice_normativa(directorio)
+    if seleccion & CASOS_RAG:
+        from backend.data_science.embeddings import EmbeddingsFalsos
+        from backend.rag import RecuperadorNormativa
+        # Sin atajo léxico y con latencia de red: la diferencia entre los dos
+        # casos es la llamada de embeddings que la caché se ahorra
+        vectorial = RecuperadorNormativa(directorio=indice, modo="vector",
+                                         embeddings=EmbeddingsFalsos(latencia=args.latencia_embeddings / 1000))
+        # Consulta nueva en cada repetición (también en el calentamiento, con i < 0): nunca en caché
+        casos["obtener_contexto_relevante_frio"] = lambda i: vectorial.buscar(
+            f"{CONSULTAS[i % len(CONSULTAS)]} (#{i})", k=2)
+        casos["obtener_contexto_relevante_cache"] = lambda i: vectorial.buscar(
+            CONSULTAS[i % len(CONSULTAS)], k=2)
+
+    if not seleccion & CASOS_CON_BD:
+        return casos
+
+    import main
+    from backend.data_science.generar_datos_sinteticos import CLAVE_SINTETICA, ESCALAS, generar_datos
+    from backend.email_service import EnviadorCorreos, PoolSMTP, encolar_notificacion
+    from backend.migraciones import aplicar_migraciones
+    from backend.models import db
+
+    with main.app.app_context():
+        aplicar_migraciones()
+        generar_datos(args.semilla, progreso=lambda *_: None, **ESCALAS[args.escala])
+    alumnos, directores = _muestras(main.app, args.semilla)
+
+    if "procesar_login" in seleccion:
+        usuarios = [u for par in zip(alumnos, directores) for u in par] or alumnos
+        casos["procesar_login"] = lambda i: main.procesar_login(usuarios[i % len(usuarios)], CLAVE_SINTETICA)
+    if "responder_alumno" in seleccion:
+        from backend.agents import responder_alumno
+        # Mensajes distintos en cada repetición: la caché del cliente de IA no los absorbe
+        casos["responder_alumno"] = lambda i: responder_alumno(
+            _historial(i, args.turnos), f"Hoy {CONSULTAS[i % len(CONSULTAS)]} (#{i})")
+    if "guardar_informe_bd" in seleccion:
+        casos["guardar_informe_bd"] = lambda i: main.guardar_informe_bd(
+            _historial(i, args.turnos), alumnos[i % len(alumnos)])
+    if "obtener_datos_dashboard" in seleccion:
+        casos["obtener_datos_dashboard"] = lambda i: main.obtener_datos_dashboard(
+            directores[i % len(directores)], "director")
+    if "enviar_correos" in seleccion:
+        smtp = SMTPFalso()
+
+        class PoolFalso(PoolSMTP):
+            def _abrir(self):
+                return smtp
+
+        enviador = EnviadorCorreos(main.app, pool=PoolFalso(host="falso"))
+
+        def correos(i):
+            with main.app.app_context():
+                encolar_notificacion([directores[i % len(directores)]], f"Expediente #{i}",
+                                     "Aviso de prueba", gravedad="GRAVE")
+                db.session.commit()
+            enviador.procesar_pendientes()
+        casos["enviar_correos"] = correos
+    return casos
+
+
+def medir(funcion, repeticiones, calentamiento):
+    for i in range(calentamiento):
+        funcion(-1 - i)
+    latencias = []
+    inicio = time.perf_counter()
+    for i in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion(i)
+        latencias.append((time.perf_counter() - t0) * 1000)
+    total = time.perf_counter() - inicio
+    return {
+        "n": repeticiones,
+        "p50_ms": round(percentil(latencias, 0.50), 3),
+        "p95_ms": round(percentil(latencias, 0.95), 3),
+        "p99_ms": round(percentil(latencias, 0.99), 3),
+        "media_ms": round(sum(latencias) / len(latencias), 3),
+        "max_ms": round(max(latencias), 3),
+        "ops_s": round(repeticiones / total, 1),
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def comparar(resultado, base, tolerancia):
+    """Lista de regresiones: casos cuyo p95 empeora más de `tolerancia` (fracción)."""
+    regresiones = []
+    for nombre, actual in resultado["casos"].items():
+        anterior = base.get("casos", {}).get(nombre)
+        if not anterior:
+            continue
+        limite = anterior["p95_ms"] * (1 + tolerancia)
+        if actual["p95_ms"] > limite and actual["p95_ms"] - anterior["p95_ms"] > MARGEN_MINIMO_MS:
+            regresiones.append(f"{nombre}: p95 {anterior['p95_ms']} -> {actual['p95_ms']} ms "
+                               f"(+{100 * (actual['p95_ms'] / anterior['p95_ms'] - 1):.0f}%)")
+    return regresiones
+
+
+def main():
+    from backend.data_science.generar_datos_sinteticos import ESCALAS
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--escala", choices=ESCALAS, default="demo", help="Volumen de datos sintéticos")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--casos", nargs="+", choices=CASOS, default=CASOS)
+    parser.add_argument("--repeticiones", type=int, default=200)
+    parser.add_argument("--calentamiento", type=int, default=10)
+    parser.add_argument("--turnos", type=int, default=6, help="Turnos de historial en el chat")
+    parser.add_argument("--latencia-embeddings", type=float, default=20,
+                        help="ms de cada llamada al proveedor de embeddings falso (casos de normativa)")
+    parser.add_argument("--palabras-pdf", type=int, default=300, help="Palabras del resumen del PDF")
+    parser.add_argument("--salida", help="Fichero JSON donde guardar los resultados")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior (puerta de regresión)")
+    parser.add_argument("--tolerancia", type=float, default=0.25, help="Empeoramiento de p95 admitido")
+    parser.add_argument("--detalle", action="store_true", help="No silencia la salida de la app")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="sayit-bench-") as directorio:
+        _preparar_entorno(directorio)
+        silencio = contextlib.nullcontext() if args.detalle else contextlib.redirect_stdout(io.StringIO())
+        print(f"⏱️  Escala '{args.escala}' (semilla {args.semilla}), {args.repeticiones} repeticiones por caso")
+        with silencio:
+            casos = construir_casos(set(args.casos), args, directorio)
+        resultado = {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": _commit(),
+            "escala": args.escala,
+            "semilla": args.semilla,
+            "repeticiones": args.repeticiones,
+            "latencia_embeddings_ms": args.latencia_embeddings,
+            "entorno": {"python": platform.python_version(), "sistema": platform.platform(),
+                        "nucleos": os.cpu_count()},
+            "casos": {},
+        }
+        print(f"{'caso':<34} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9}")
+        for nombre in args.casos:
+            with silencio:
+                datos = medir(casos[nombre], args.repeticiones, args.calentamiento)
+            resultado["casos"][nombre] = datos
+            print(f"{nombre:<34} {datos['p50_ms']:>9.2f} {datos['p95_ms']:>9.2f} "
+                  f"{datos['p99_ms']:>9.2f} {datos['ops_s']:>9.1f}")
+
+    if args.salida:
+        os.makedirs(os.path.dirname(os.path.abspath(args.salida)), exist_ok=True)
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=2)
+        print(f"💾 Resultados en {args.salida}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            base = json.load(f)
+        if (base.get("escala"), base.get("semilla")) != (args.escala, args.semilla):
+            print(f"⚠️ La base es de escala '{base.get('escala')}' y semilla {base.get('semilla')}: "
+                  f"la comparación no es fiable.")
+        regresiones = comparar(resultado, base, args.tolerancia)
+        if regresiones:
+            print("❌ Regresiones de rendimiento:\n  - " + "\n  - ".join(regresiones))
+            sys.exit(1)
+        print(f"✅ Sin regresiones respecto a {args.comparar} (tolerancia {args.tolerancia:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,29 +4,32 @@ load_dotenv()  # Carga las variables del archivo .env automáticamente
 import gradio as gr
 import os
 import pandas as pd
+from datetime import datetime, timedelta
 from flask import Flask
-# AÑADIDO: 'Profesor' a los imports para evitar conflictos con auth
-from backend.models import db, Alumno, CentroEstudios, Informe, Director, Tutor, Profesor
+from flask_cors import CORS
+from backend.models import (db, Informe, resolver_alumno, centros_del_usuario, obtener_pagina_informes,
+                            COLUMNAS_DASHBOARD)
 from backend.auth import autenticar_usuario
-from backend.agents import responder_alumno, generar_reporte_riesgo
-from backend.reporting import generar_pdf_informe
-from backend.email_service import enviar_notificacion_protocolo
+from backend.auth.identidades import asegurar_indice_identidades
+from backend.agents import responder_alumno_stream, estado_conversacion
+from backend.email_service import EnviadorCorreos
+from backend.cola import ColaTrabajos
+from backend.database import configurar_base_datos
+from backend.migraciones import aplicar_migraciones
+from backend.exportacion import exportar_expedientes
+from backend.reporting import REPORTS_DIR
+from backend.pipeline_informes import registrar_etapas
+from backend.prompts import normalizar_historial
+from backend.metricas import accion_medida, registrar_en_flask, servir_metricas
+from backend.sesiones_chat import (sesion_abierta, turnos_sesion, anadir_turno, cerrar_sesion,
+                                   historial_para_chat, id_alumno_por_email, purgar_si_toca)
 
 
 # --- CONFIGURACIÓN ---
 app = Flask(__name__)
 CORS(app) 
-
-# --- IMPORTACIONES DEL BACKEND ---
-try:
-    from backend.models import db, Alumno, Profesor, Director, Tutor, Informe
-    from backend.auth import autenticar_usuario
-    # Importamos la IA y el generador de PDF
-    from backend.agents import responder_alumno, generar_reporte_riesgo
-    from backend.reporting import generar_pdf_informe
-except ImportError as e:
-    print(f"❌ Error importando backend: {e}")
-    exit()
+# /metrics (Prometheus) e id de petición en cada petición HTTP
+registrar_en_flask(app)
 
 # --- CONFIGURACIÓN DE BASE DE DATOS ---
 base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'data'))
@@ -35,17 +38,26 @@ db_path = os.path.join(base_dir, 'bullying.db')
 # Asegurar que la carpeta data existe
 os.makedirs(base_dir, exist_ok=True)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# SQLite en modo WAL con pool, o el servidor de DATABASE_URL (ver backend/database.py)
+configurar_base_datos(app, db_path)
 db.init_app(app)
 
+# --- COLA DE INFORMES (análisis, PDF y email en segundo plano) ---
+cola_informes = ColaTrabajos(app)
+registrar_etapas(cola_informes)
+# Bandeja de salida de correo: envío en segundo plano con conexiones reutilizadas
+enviador_correos = EnviadorCorreos(app)
+
 # --- LÓGICA DE BACKEND ---
 
+@accion_medida("login")
 def procesar_login(email, password):
     """Gestiona la autenticación y devuelve el rol y mensaje de bienvenida."""
     with app.app_context():
         rol, nombre = autenticar_usuario(email, password)
         if rol == "error": return rol, "❌ Error. Verifica tu Email y Contraseña.", ""
+        if rol == "alumno":
+            purgar_si_toca()  # sesiones de chat caducadas
         
         msgs = {
             "alumno": f"Hola {nombre}. Panel de Denuncia Activado.",
@@ -55,125 +67,147 @@ def procesar_login(email, password):
         }
         return rol, msgs.get(rol, "Hola"), email
 
+@accion_medida("denuncia")
 def guardar_informe_bd(historial_chat, usuario_email):
     """
-    Proceso principal: Analiza chat -> Guarda en BD -> Genera PDF -> Envía Email.
+    Registra la denuncia y devuelve enseguida su número de expediente.
+    El análisis IA, el PDF y el email se hacen en segundo plano
+    (ver backend/pipeline_informes.py), con reintentos por etapa.
     """
     if not historial_chat: return "⚠️ Formulario vacío. Por favor, describe el incidente."
 
     print("--- 🔄 PROCESANDO REPORTE ---")
-    
-    # 1. ANÁLISIS IA (Con red de seguridad para Demos)
-    try:
-        datos = generar_reporte_riesgo(historial_chat)
-    except Exception as e:
-        print(f"⚠️ IA no disponible o error ({e}). Usando datos de respaldo para DEMO.")
-        datos = {
-            "rol_informante": "VÍCTIMA",
-            "tipo_incidente": ["Agresión Física", "Acoso Verbal"],
-            "nivel_gravedad": "GRAVE",
-            "resumen_hechos": "El alumno declara haber sido acorralado en la zona de canchas por dos compañeros (Carlos Pérez y Ana García), quienes le quitaron la mochila, tiraron material escolar y le empujaron contra la valla. Reporta miedo a volver a clase.",
-            "nombres_involucrados": ["Carlos Pérez", "Ana García"]
-        }
-
-    # Limpieza
-    tipo_raw = datos.get("tipo_incidente", "Otro")
-    tipo = ", ".join(tipo_raw) if isinstance(tipo_raw, list) else str(tipo_raw)
-    resumen = datos.get("resumen_hechos", "Sin detalles disponibles.")
-    rol_informante = datos.get("rol_informante", "TESTIGO")
 
     with app.app_context():
-        informante = Alumno.query.filter_by(email_alumno=usuario_email).first()
+        # Alumno + centro + director en una única consulta
+        informante = resolver_alumno(email=usuario_email)
         
         if informante:
-            # Recuperación de datos
-            id_alumno = informante.id_alumno
-            nombre_alumno = informante.nombre_alumno
-            id_centro = informante.id_centro_estudios
-            id_docente = informante.id_tutor
-            
-            nombre_centro = "Centro Desconocido"
-            id_director = None
-            nombre_director = "No asignado"
-            email_director = "director@sayit.test"
-            nombre_docente = "No asignado"
-            email_tutor = "tutor@sayit.test"
-
-            centro = CentroEstudios.query.get(id_centro)
-            if centro:
-                nombre_centro = f"{centro.denominacion_generica_es} {centro.denominacion_especifica}"
-                id_director = centro.id_director
-                if id_director:
-                    dir_obj = Director.query.get(id_director)
-                    if dir_obj: 
-                        email_director = dir_obj.email_director
-                        nombre_director = dir_obj.nombre_director
-            
-            if id_docente:
-                tutor_obj = Tutor.query.get(id_docente)
-                if tutor_obj: 
-                    email_tutor = tutor_obj.email_tutor
-                    nombre_docente = tutor_obj.nombre_tutor
-
-            # 2. Guardar en BD
+            # El historial guardado en el servidor manda sobre el del navegador
+            sesion = sesion_abierta(informante["id_alumno"])
+            if sesion is not None and sesion.turnos:
+                historial_chat = turnos_sesion(sesion.id_sesion)
+            # Tipo y gravedad provisionales del análisis hecho durante el chat:
+            # un caso GRAVE se ve como tal en el panel desde el primer momento
+            estado = estado_conversacion(historial_chat)
+            provisional = estado.como_informe()
             nuevo_informe = Informe(
-                tipo_bullying=tipo,
-                descripcion=f"[{rol_informante}] {resumen}",
-                id_centro_estudios=id_centro,
-                id_director=id_director
+                tipo_bullying=", ".join(provisional["tipo_incidente"])[:50],
+                descripcion="[EN ANÁLISIS] Denuncia recibida.",
+                nivel_gravedad=provisional["nivel_gravedad"],
+                id_centro_estudios=informante["id_centro"],
+                id_director=informante["id_director"],
+                id_alumno=informante["id_alumno"],
+                estado_procesamiento="recibido"
             )
             db.session.add(nuevo_informe)
+            db.session.flush()
+            if estado.gravedad == "GRAVE":
+                print(f"🚨 EXPEDIENTE #{nuevo_informe.id_informe} con indicios GRAVES.")
+            # El trabajo solo apunta a la sesión guardada: la conversación no se
+            # copia a `trabajos`. Sin sesión (historial del navegador) va en la
+            # carga y se borra de ella al terminar el análisis.
+            if sesion is not None and sesion.turnos:
+                carga = {"id_sesion": sesion.id_sesion}
+            else:
+                carga = {"historial": normalizar_historial(historial_chat), "estado": estado.a_dict()}
+            # Mismo commit: no puede quedar un informe sin su trabajo ni al revés
+            cola_informes.encolar("analisis", id_informe=nuevo_informe.id_informe, carga=carga, commit=False)
+            if sesion is not None:
+                cerrar_sesion(sesion, nuevo_informe.id_informe)
             db.session.commit()
             
-            # 3. Generar PDF
-            fecha_reporte = nuevo_informe.fecha_informe.strftime("%d/%m/%Y %H:%M")
-            ruta_pdf = generar_pdf_informe(
-                id_informe=nuevo_informe.id_informe,
-                fecha_reporte=fecha_reporte,
-                datos_ia=datos,
-                nombre_centro=nombre_centro,
-                id_centro=id_centro,
-                id_director=id_director,
-                nombre_director=nombre_director,
-                id_docente=id_docente,
-                nombre_docente=nombre_docente,
-                id_alumno=id_alumno,
-                nombre_alumno=nombre_alumno
-            )
-            
-            # 4. Enviar Email
-            destinatarios = [email_director, email_tutor]
-            asunto = f"🔴 URGENTE: Nuevo Expediente #{nuevo_informe.id_informe} - {nombre_centro}"
-            cuerpo = f"""
-            SISTEMA DE GESTIÓN DE INCIDENCIAS 'SAY IT'
-            ==========================================
-            Se ha registrado una nueva denuncia.
-            
-            - ID Reporte: {nuevo_informe.id_informe}
-            - Alumno:     {nombre_alumno}
-            - Gravedad:   {datos.get('nivel_gravedad', 'REVISAR')}
-            
-            El informe PDF adjunto contiene los detalles confidenciales.
-            """
-            enviar_notificacion_protocolo(destinatarios, asunto, cuerpo, ruta_pdf)
-            
-            return f"✅ EXPEDIENTE #{nuevo_informe.id_informe} REGISTRADO.\n📄 PDF Oficial generado.\n📧 Notificación enviada."
+            return (f"✅ EXPEDIENTE #{nuevo_informe.id_informe} REGISTRADO.\n"
+                    f"⏳ El análisis, el PDF oficial y la notificación a dirección se están procesando.")
         else:
             return "❌ Error: Alumno no identificado."
 
-def obtener_datos_dashboard():
+TAMANO_PAGINA_DASHBOARD = int(os.getenv("TAMANO_PAGINA_DASHBOARD", "50"))
+ESTADOS_INFORME = ["", "Pendiente", "En Proceso", "Resuelto"]
+
+def _fecha_filtro(texto, fin_de_dia=False):
+    """'AAAA-MM-DD' -> datetime (el límite superior incluye el día entero)."""
+    if not texto or not texto.strip(): return None
+    fecha = datetime.strptime(texto.strip(), "%Y-%m-%d")
+    return fecha + timedelta(days=1) if fin_de_dia else fecha
+
+@accion_medida("dashboard")
+def obtener_datos_dashboard(usuario_email="", rol="", estado="", tipo="", desde="", hasta="", cursor=None):
+    """
+    Una página de la bandeja, limitada a los centros del usuario.
+    Devuelve (DataFrame, cursor de la página siguiente, texto informativo).
+    """
+    vacio = pd.DataFrame(columns=COLUMNAS_DASHBOARD)
     with app.app_context():
         try:
-            informes = Informe.query.order_by(Informe.fecha_informe.desc()).all()
-            if not informes: return pd.DataFrame(columns=["ID", "Fecha", "Tipo", "Resumen"])
-            data = []
-            for i in informes:
-                fecha = i.fecha_informe.strftime("%Y-%m-%d") if i.fecha_informe else "Hoy"
-                data.append([i.id_informe, fecha, i.tipo_bullying, i.descripcion])
-            return pd.DataFrame(data, columns=["ID", "Fecha", "Tipo", "Resumen"])
+            centros = centros_del_usuario(rol, usuario_email)
+            filas, siguiente = obtener_pagina_informes(
+                centros=centros,
+                estado=estado or None,
+                tipo=tipo or None,
+                desde=_fecha_filtro(desde),
+                hasta=_fecha_filtro(hasta, fin_de_dia=True),
+                cursor=cursor or None,
+                limite=TAMANO_PAGINA_DASHBOARD,
+                columnas=COLUMNAS_DASHBOARD
+            )
+            if not filas: return vacio, None, "Sin expedientes para estos filtros."
+            data = [[id_inf, fecha.strftime("%Y-%m-%d") if fecha else "Hoy", tipo_inf, resumen]
+                    for id_inf, fecha, tipo_inf, resumen in filas]
+            info = f"Mostrando {len(data)} expedientes." + (" Hay más en la página siguiente." if siguiente else "")
+            return pd.DataFrame(data, columns=COLUMNAS_DASHBOARD), siguiente, info
         except Exception as e:
             print(f"Error Dashboard: {e}")
-            return pd.DataFrame(columns=["ID", "Fecha", "Tipo", "Resumen"])
+            return vacio, None, "⚠️ No se pudo cargar la bandeja."
+
+@accion_medida("exportacion")
+def exportar_dashboard(usuario_email="", rol="", desde="", hasta="", progress=gr.Progress()):
+    """ZIP con los expedientes de los centros del usuario en el rango de fechas del filtro."""
+    with app.app_context():
+        centros = centros_del_usuario(rol, usuario_email)
+        if not centros: return None, "⚠️ No tienes centros asignados."
+        salida = os.path.join(REPORTS_DIR, "exportaciones",
+                              f"Expedientes_{'-'.join(map(str, centros))}_{desde or 'inicio'}_{hasta or 'hoy'}.zip")
+        try:
+            resumen = exportar_expedientes(
+                salida, centros=centros,
+                desde=_fecha_filtro(desde), hasta=_fecha_filtro(hasta, fin_de_dia=True),
+                progreso=lambda hechos, total: progress(hechos / max(total, 1), desc=f"{hechos}/{total} expedientes")
+            )
+        except Exception as e:
+            print(f"Error Exportación: {e}")
+            return None, "⚠️ No se pudo completar la exportación. Vuelve a pulsar para reanudarla."
+        aviso = f" ({len(resumen['fallidos'])} no se pudieron generar)" if resumen["fallidos"] else ""
+        return resumen["salida"], f"📦 {resumen['exportados']} expedientes exportados{aviso}."
+
+def conversacion_guardada(usuario_email):
+    """Chat abierto del alumno para mostrarlo al volver a entrar."""
+    with app.app_context():
+        return historial_para_chat(usuario_email)
+
+@accion_medida("chat")
+def chat_alumno(mensaje, historial, usuario_email=""):
+    """
+    Generador para gr.ChatInterface: muestra la respuesta mientras se escribe.
+    El historial sale de la sesión guardada en el servidor y cada turno se
+    añade a ella; sin alumno identificado se usa el del navegador.
+    """
+    id_sesion = None
+    with app.app_context():
+        id_alumno = id_alumno_por_email(usuario_email)
+        if id_alumno:
+            sesion = sesion_abierta(id_alumno, crear=True)
+            id_sesion = sesion.id_sesion
+            historial = turnos_sesion(id_sesion)
+            db.session.commit()
+
+    respuesta = ""
+    for respuesta in responder_alumno_stream(historial, mensaje):
+        yield respuesta
+
+    if id_sesion and respuesta:
+        with app.app_context():
+            anadir_turno(id_sesion, mensaje, respuesta)
 
 # --- INTERFAZ ---
 theme = gr.themes.Soft()
@@ -197,7 +231,8 @@ with gr.Blocks(theme=theme, title="Say It - Gestión Escolar") as demo:
     with gr.Group(visible=False) as chat_view:
         gr.Markdown("### 📝 Canal de Denuncia Seguro")
         chatbot = gr.ChatInterface(
-            fn=lambda m, h: responder_alumno(h, m),
+            fn=chat_alumno,
+            additional_inputs=[estado_usuario],
             chatbot=gr.Chatbot(height=400),
             textbox=gr.Textbox(placeholder="Escribe aquí lo que ha pasado...", scale=5),
         )
@@ -210,30 +245,70 @@ with gr.Blocks(theme=theme, title="Say It - Gestión Escolar") as demo:
         with gr.Row():
             btn_refresh = gr.Button("🔄 Actualizar Bandeja")
             gr.Markdown("ℹ️ *Los expedientes PDF se archivan en `data/reports/`*")
+        with gr.Row():
+            filtro_estado = gr.Dropdown(ESTADOS_INFORME, value="", label="Estado")
+            filtro_tipo = gr.Textbox(label="Tipo contiene", placeholder="Verbal, Físico, Ciber...")
+            filtro_desde = gr.Textbox(label="Desde (AAAA-MM-DD)")
+            filtro_hasta = gr.Textbox(label="Hasta (AAAA-MM-DD)")
         
         # Tabla con headers definidos
         tabla = gr.Dataframe(
-            headers=["ID", "Fecha", "Tipo", "Resumen"], 
+            headers=COLUMNAS_DASHBOARD, 
             label="Últimas Denuncias", 
             interactive=False, 
             wrap=True
         )
+        with gr.Row():
+            info_pagina = gr.Markdown("")
+            btn_siguiente = gr.Button("Página siguiente ▶")
+        estado_cursor = gr.State(None)
+        with gr.Row():
+            btn_exportar = gr.Button("📦 Exportar expedientes (ZIP, fechas del filtro)")
+            archivo_exportado = gr.File(label="Exportación", interactive=False)
 
     # ROUTER
     def router(u, p):
         rol, msg, user_real = procesar_login(u, p)
         hide = gr.update(visible=False)
+        sin_tabla = (gr.update(), None, "")
+        sin_chat = (gr.update(),) * len(salida_chat)
         if rol == "alumno":
-            return msg, user_real, hide, gr.update(visible=True), hide
+            # Se retoma la conversación que quedó abierta (otra pestaña, recarga...)
+            chat = conversacion_guardada(user_real)
+            return (msg, user_real, rol, hide, gr.update(visible=True), hide) + sin_tabla + (chat,) * len(salida_chat)
         elif rol in ["director", "profesor"]:
-            df = obtener_datos_dashboard()
-            return msg, user_real, hide, hide, gr.update(visible=True, value=df)
+            df, cursor, info = obtener_datos_dashboard(user_real, rol)
+            return (msg, user_real, rol, hide, hide, gr.update(visible=True), df, cursor, info) + sin_chat
         else:
-            return msg, "", gr.update(visible=True), hide, hide
+            return (msg, "", "", gr.update(visible=True), hide, hide) + sin_tabla + sin_chat
+
+    def primera_pagina(usuario, rol, estado, tipo, desde, hasta):
+        return obtener_datos_dashboard(usuario, rol, estado, tipo, desde, hasta)
+
+    def pagina_siguiente(usuario, rol, estado, tipo, desde, hasta, cursor):
+        if not cursor:
+            return gr.update(), None, "No hay más expedientes."
+        return obtener_datos_dashboard(usuario, rol, estado, tipo, desde, hasta, cursor)
 
-    login_btn.click(router, [user_input, pass_input], [login_msg, estado_usuario, login_view, chat_view, admin_view])
+    filtros = [estado_usuario, estado_rol, filtro_estado, filtro_tipo, filtro_desde, filtro_hasta]
+    salida_tabla = [tabla, estado_cursor, info_pagina]
+    # La vista del chat y, si la versión de Gradio lo tiene, su estado interno
+    salida_chat = [chatbot.chatbot] + ([chatbot.chatbot_state] if hasattr(chatbot, "chatbot_state") else [])
+
+    login_btn.click(router, [user_input, pass_input],
+                    [login_msg, estado_usuario, estado_rol, login_view, chat_view, admin_view]
+                    + salida_tabla + salida_chat)
     btn_enviar.click(guardar_informe_bd, [chatbot.chatbot, estado_usuario], [confirmacion])
-    btn_refresh.click(obtener_datos_dashboard, None, tabla)
+    btn_refresh.click(primera_pagina, filtros, salida_tabla)
+    btn_siguiente.click(pagina_siguiente, filtros + [estado_cursor], salida_tabla)
+    btn_exportar.click(exportar_dashboard, [estado_usuario, estado_rol, filtro_desde, filtro_hasta],
+                       [archivo_exportado, info_pagina])
 
 if __name__ == "__main__":
+    with app.app_context():
+        aplicar_migraciones()
+        asegurar_indice_identidades()
+    cola_informes.iniciar(int(os.getenv("WORKERS_INFORMES", "2")))
+    enviador_correos.iniciar()
+    servir_metricas(app)
     demo.launch()
\ No newline at end of file
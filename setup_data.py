@@ -1,13 +1,15 @@
 from main import app, db
 from backend.models import CentroEstudios, Director, Profesor, Alumno, Tutor
+from backend.security.contrasenas import generar_hash
+from backend.migraciones import aplicar_migraciones
 import os
 
 def cargar_datos_prueba():
     with app.app_context():
         print("🌱 Conectando a la base de datos...")
         
-        # 1. Crear tablas si no existen
-        db.create_all()
+        # 1. Crear tablas o actualizar un bullying.db existente (columnas e índices)
+        aplicar_migraciones()
         print("✅ Estructura de tablas verificada.")
 
         print("🌱 Iniciando carga de datos...")
@@ -17,7 +19,7 @@ def cargar_datos_prueba():
             director = Director(
                 nombre_director="Sr. Director",
                 email_director="director@sayit.test",
-                password_hash="12345" 
+                password_hash=generar_hash("12345") 
                 # Quitamos id_centro_estudios porque no existe en tu modelo
             )
             db.session.add(director)
@@ -43,7 +45,7 @@ def cargar_datos_prueba():
             profe = Profesor(
                 nombre_profesor="Profe Matemáticas",
                 email_profesor="profe@sayit.test",
-                password_hash="12345",
+                password_hash=generar_hash("12345"),
                 id_centro_estudios=1, # Este sí tiene la columna en tu modelo
                 # Quitamos es_tutor si no está en tu modelo (no lo vi en tu código)
             )
@@ -55,7 +57,7 @@ def cargar_datos_prueba():
             alumno = Alumno(
                 nombre_alumno="Micaela Alumna",
                 email_alumno="alumno@sayit.test",
-                password_hash="12345",
+                password_hash=generar_hash("12345"),
                 id_centro_estudios=1,
                 id_tutor=None 
             )
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+# Las pruebas importan `backend` desde la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Sin red ni API key: IA y embeddings simulados, sin registro de eventos
+os.environ.setdefault("LLM_BACKEND", "falso")
+os.environ.setdefault("EMBEDDINGS_BACKEND", "falso")
+os.environ.setdefault("LOG_EVENTOS", "no")
+
+from backend import rag  # noqa: E402
+from backend.database import configurar_base_datos  # noqa: E402
+from backend.migraciones import aplicar_migraciones  # noqa: E402
+from backend.models import db  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def indice_normativa_temporal(tmp_path, monkeypatch):
+    """El índice RAG se crea en un directorio temporal, nunca en chroma_db/ del proyecto."""
+    monkeypatch.setattr(rag, "DB_DIR", str(tmp_path / "chroma_db"))
+    monkeypatch.setattr(rag, "_recuperador", None)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App Flask con una base SQLite temporal ya migrada, dentro de su contexto."""
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    app = Flask(__name__)
+    configurar_base_datos(app, str(tmp_path / "pruebas.db"))
+    db.init_app(app)
+    with app.app_context():
+        aplicar_migraciones()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
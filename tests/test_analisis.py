@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from backend.analisis import AnalizadorRiesgo
+
+INFORME = json.dumps({"rol_informante": "VÍCTIMA", "tipo_incidente": ["Verbal"], "nivel_gravedad": "LEVE",
+                      "resumen_hechos": "Un compañero le insulta en clase.", "nombres_involucrados": ["Desconocido"]})
+TURNOS = [("Un compañero me insulta en clase", "Siento que te pase eso.")]
+
+
+class _Respuesta:
+    def __init__(self, text):
+        self.text = text
+
+
+class ModeloQueFalla:
+    """Falla con `error` la primera vez que se le pide salida estructurada."""
+
+    def __init__(self, error):
+        self.error = error
+        self.con_esquema = 0
+
+    def generate_content(self, prompt, generation_config=None):
+        if generation_config is not None:
+            self.con_esquema += 1
+            if self.con_esquema == 1:
+                raise self.error
+        return _Respuesta(INFORME)
+
+
+@pytest.mark.parametrize("error", [TimeoutError("deadline"), RuntimeError("429 Resource exhausted")])
+def test_error_transitorio_no_desactiva_el_esquema(error):
+    modelo = ModeloQueFalla(error)
+    analizador = AnalizadorRiesgo(modelo)
+
+    assert analizador.analizar(TURNOS)["origen_analisis"] == "local"
+    assert analizador.con_esquema
+    assert analizador.analizar(TURNOS)["origen_analisis"] == "ia"
+    assert modelo.con_esquema == 2
+
+
+def test_esquema_rechazado_pasa_a_json_en_el_prompt():
+    modelo = ModeloQueFalla(TypeError("unexpected keyword argument 'response_schema'"))
+    analizador = AnalizadorRiesgo(modelo)
+
+    assert analizador.analizar(TURNOS)["origen_analisis"] == "ia"
+    assert not analizador.con_esquema
+    analizador.analizar(TURNOS)
+    assert modelo.con_esquema == 1
@@ -0,0 +1,45 @@
+import pytest
+from werkzeug.security import check_password_hash
+
+import backend.auth as auth
+from backend.auth.identidades import buscar_identidades
+from backend.models import db, Alumno, Tutor
+from backend.security.contrasenas import METODO_HASH, es_hash, generar_hash
+
+
+@pytest.mark.parametrize("guardado", ["12345", generar_hash("12345", metodo="pbkdf2:sha256:1000")],
+                         ids=["en_claro", "metodo_antiguo"])
+def test_login_correcto_actualiza_la_credencial(app, guardado):
+    alumno = Alumno(nombre_alumno="Lucía", email_alumno="lucia@centro.test", password_hash=guardado)
+    db.session.add(alumno)
+    db.session.commit()
+
+    assert auth.autenticar_usuario("Lucia@centro.test", "12345") == ("alumno", "Lucía")
+
+    db.session.expire_all()
+    nuevo = db.session.get(Alumno, alumno.id_alumno).password_hash
+    assert es_hash(nuevo) and nuevo.startswith(METODO_HASH + "$")
+    assert check_password_hash(nuevo, "12345")
+    # El índice de login ve el hash nuevo
+    assert buscar_identidades("lucia@centro.test")[0].password_hash == nuevo
+
+
+def test_login_fallido_no_toca_la_credencial(app):
+    antiguo = generar_hash("12345", metodo="pbkdf2:sha256:1000")
+    tutor = Tutor(nombre_tutor="Tutora", email_tutor="tutora@centro.test", password_hash=antiguo)
+    db.session.add(tutor)
+    db.session.commit()
+
+    assert auth.autenticar_usuario("tutora@centro.test", "otra") == ("error", None)
+    db.session.expire_all()
+    assert db.session.get(Tutor, tutor.id_tutor).password_hash == antiguo
+
+
+def test_email_desconocido_pasa_por_el_senuelo(app, monkeypatch):
+    llamadas = []
+    senuelo = auth.verificar_senuelo
+    monkeypatch.setattr(auth, "verificar_senuelo", lambda password: llamadas.append(password) or senuelo(password))
+    monkeypatch.setattr(auth, "verificar_en_pool", lambda *a: pytest.fail("no hay hash que verificar"))
+
+    assert auth.autenticar_usuario("nadie@centro.test", "12345") == ("error", None)
+    assert llamadas == ["12345"]
@@ -0,0 +1,22 @@
+import pytest
+from werkzeug.security import check_password_hash
+
+from backend.security.contrasenas import generar_hash
+
+
+@pytest.mark.parametrize("metodo", ["scrypt:16384:8:1", "scrypt", "pbkdf2:sha256:1000"])
+def test_hash_con_sal_fija_es_reproducible_y_valido_para_werkzeug(metodo):
+    primero = generar_hash("12345", metodo=metodo, sal="SalDeLaSemilla42")
+    assert primero == generar_hash("12345", metodo=metodo, sal="SalDeLaSemilla42")
+    assert primero.split("$")[1] == "SalDeLaSemilla42"
+    assert check_password_hash(primero, "12345")
+    assert not check_password_hash(primero, "54321")
+
+
+def test_sin_sal_cada_hash_es_distinto():
+    assert generar_hash("12345", metodo="pbkdf2:sha256:1000") != generar_hash("12345", metodo="pbkdf2:sha256:1000")
+
+
+def test_metodo_no_admitido_con_sal_fija():
+    with pytest.raises(ValueError):
+        generar_hash("12345", metodo="md5", sal="abc")
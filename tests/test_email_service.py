@@ -0,0 +1,239 @@
+"""
+Bandeja de salida -> EnviadorCorreos -> PoolSMTP contra un servidor SMTP
+local de depuración (aiosmtpd) que guarda lo que recibe. Los destinatarios
+de @rechazado.test se rechazan con 550 (permanente) y los de
+@ocupado.test con 451 (temporal).
+"""
+import socket
+from datetime import datetime, timedelta
+from email import message_from_bytes, policy
+
+import pytest
+from sqlalchemy import select, update
+
+aiosmtpd = pytest.importorskip("aiosmtpd.controller")
+
+from backend.email_service import (EnviadorCorreos, PoolSMTP, configurar_avisos_centro,  # noqa: E402
+                                   encolar_notificacion, reactivar_muertos)
+from backend.models import db, CentroEstudios, CorreoSaliente, Informe  # noqa: E402
+
+
+class BuzonDepuracion:
+    """Manejador de aiosmtpd: acepta, rechaza o aplaza cada destinatario y guarda los mensajes."""
+
+    def __init__(self):
+        self.mensajes = []
+        self.ocupado = True  # False: @ocupado.test vuelve a aceptar
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.endswith("@rechazado.test"):
+            return "550 Buzón inexistente"
+        if address.endswith("@ocupado.test") and self.ocupado:
+            return "451 Inténtelo más tarde"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        mensaje = message_from_bytes(envelope.content, policy=policy.default)
+        self.mensajes.append((sorted(envelope.rcpt_tos), mensaje))
+        return "250 Message accepted for delivery"
+
+
+def _puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def buzon():
+    manejador = BuzonDepuracion()
+    controlador = aiosmtpd.Controller(manejador, hostname="127.0.0.1", port=_puerto_libre())
+    controlador.start()
+    yield controlador, manejador
+    controlador.stop()
+
+
+@pytest.fixture
+def enviador(app, buzon):
+    controlador, _ = buzon
+    pool = PoolSMTP(host=controlador.hostname, puerto=controlador.port, usuario="", starttls=False, maximo=1)
+    enviador = EnviadorCorreos(app, pool=pool)
+    yield enviador
+    pool.cerrar()
+
+
+def _informe(id_centro=None):
+    informe = Informe(tipo_bullying="Verbal", estado_procesamiento="pdf_generado", id_centro_estudios=id_centro)
+    db.session.add(informe)
+    db.session.flush()
+    return informe
+
+
+def _estados():
+    return {(c.id_informe, c.destinatario): c for c in db.session.execute(select(CorreoSaliente)).scalars()}
+
+
+def test_aviso_inmediato_y_dead_letter(app, buzon, enviador):
+    _, manejador = buzon
+    informe = _informe()
+    encolar_notificacion(["Director@centro.test", "nadie@rechazado.test", "tutor@ocupado.test"],
+                         "🔴 URGENTE: Nuevo Expediente", "Detalles", id_informe=informe.id_informe,
+                         gravedad="GRAVE")
+    db.session.commit()
+
+    assert enviador.procesar_pendientes() == 3
+
+    # Un solo mensaje para el aviso, con los destinatarios aceptados
+    assert len(manejador.mensajes) == 1
+    destinatarios, mensaje = manejador.mensajes[0]
+    assert destinatarios == ["director@centro.test"]
+    assert mensaje["Subject"] == "🔴 URGENTE: Nuevo Expediente"
+
+    db.session.expire_all()
+    estados = _estados()
+    assert estados[(informe.id_informe, "director@centro.test")].estado == "enviado"
+    # 5xx: dead letter al primer intento, con el error del servidor
+    muerto = estados[(informe.id_informe, "nadie@rechazado.test")]
+    assert muerto.estado == "muerto" and "550" in muerto.ultimo_error
+    # 4xx: se reintenta más tarde
+    aplazado = estados[(informe.id_informe, "tutor@ocupado.test")]
+    assert aplazado.estado == "pendiente" and aplazado.disponible_en > datetime.utcnow()
+    assert db.session.get(Informe, informe.id_informe).estado_procesamiento == "error"
+
+
+def test_resumen_agrupa_avisos_por_destinatario(app, buzon, enviador):
+    _, manejador = buzon
+    informes = [_informe() for _ in range(3)]
+    for informe in informes:
+        encolar_notificacion(["direccion@centro.test", "tutor@centro.test"], "Aviso", "Detalles",
+                             id_informe=informe.id_informe, gravedad="LEVE")
+    db.session.commit()
+
+    # Por debajo de la gravedad inmediata: nada sale hasta que se cierra la ventana
+    assert enviador.procesar_pendientes() == 0
+    assert manejador.mensajes == []
+
+    db.session.execute(update(CorreoSaliente).values(disponible_en=datetime.utcnow() - timedelta(minutes=1)))
+    db.session.commit()
+    assert enviador.procesar_pendientes() == 6
+
+    # Un resumen por destinatario con los tres expedientes
+    assert sorted(d for d, _ in manejador.mensajes) == [["direccion@centro.test"], ["tutor@centro.test"]]
+    for _, mensaje in manejador.mensajes:
+        assert mensaje["Subject"] == "📋 Resumen Say It: 3 expediente(s) nuevo(s)"
+        cuerpo = mensaje.get_body(preferencelist=("plain",)).get_content()
+        for informe in informes:
+            assert f"Expediente #{informe.id_informe}" in cuerpo
+
+    db.session.expire_all()
+    assert {c.estado for c in _estados().values()} == {"enviado"}
+    assert {db.session.get(Informe, i.id_informe).estado_procesamiento for i in informes} == {"notificado"}
+
+
+def _centro(**politica):
+    centro = CentroEstudios(denominacion_generica_es="IES", denominacion_especifica="Demo")
+    db.session.add(centro)
+    db.session.commit()
+    if politica:
+        configurar_avisos_centro(centro.id_centro_estudios, **politica)
+    return centro.id_centro_estudios
+
+
+def _vencer_ventanas():
+    db.session.execute(update(CorreoSaliente).where(CorreoSaliente.estado == "pendiente")
+                       .values(disponible_en=datetime.utcnow() - timedelta(minutes=1)))
+    db.session.commit()
+
+
+def test_politica_de_avisos_por_centro(app, buzon, enviador):
+    _, manejador = buzon
+    al_momento = _centro(ventana_minutos=0)
+    solo_muy_grave = _centro(ventana_minutos=60, gravedad_inmediata="muy grave")
+    por_defecto = _centro()
+    for id_centro in (al_momento, solo_muy_grave, por_defecto):
+        informe = _informe(id_centro)
+        encolar_notificacion(["direccion@centro.test"], f"Aviso centro {id_centro}", "Detalles",
+                             id_informe=informe.id_informe, id_centro=id_centro, gravedad="GRAVE")
+    # Un segundo aviso leve se une a la ventana ya abierta del destinatario
+    informe = _informe(solo_muy_grave)
+    encolar_notificacion(["direccion@centro.test"], "Otro aviso", "Detalles",
+                         id_informe=informe.id_informe, id_centro=solo_muy_grave, gravedad="LEVE")
+    db.session.commit()
+
+    correos = db.session.execute(select(CorreoSaliente)).scalars().all()
+    modos = {c.id_centro_estudios: c.modo for c in correos}
+    assert modos == {al_momento: "inmediato", solo_muy_grave: "resumen", por_defecto: "inmediato"}
+    ventanas = {c.disponible_en for c in correos if c.modo == "resumen"}
+    assert len(ventanas) == 1 and ventanas.pop() > datetime.utcnow() + timedelta(minutes=59)
+
+    assert enviador.procesar_pendientes() == 2
+    assert sorted(m["Subject"] for _, m in manejador.mensajes) == [
+        f"Aviso centro {al_momento}", f"Aviso centro {por_defecto}"]
+
+
+def test_resumenes_separados_por_centro(app, buzon, enviador):
+    _, manejador = buzon
+    centros = [_centro(ventana_minutos=30), _centro(ventana_minutos=30)]
+    for id_centro in centros:
+        for _ in range(2):
+            informe = _informe(id_centro)
+            encolar_notificacion(["inspeccion@centro.test"], "Aviso", "Detalles", id_informe=informe.id_informe,
+                                 id_centro=id_centro, gravedad="LEVE")
+    db.session.commit()
+    _vencer_ventanas()
+
+    assert enviador.procesar_pendientes() == 4
+    # Mismo destinatario, un resumen por centro con sus dos expedientes
+    assert len(manejador.mensajes) == 2
+    for destinatarios, mensaje in manejador.mensajes:
+        assert destinatarios == ["inspeccion@centro.test"]
+        assert mensaje["Subject"] == "📋 Resumen Say It: 2 expediente(s) nuevo(s)"
+
+
+def test_dead_letter_al_agotar_los_intentos(app, buzon, enviador):
+    _, manejador = buzon
+    informe = _informe()
+    encolar_notificacion(["tutor@ocupado.test"], "Aviso", "Detalles", id_informe=informe.id_informe,
+                         gravedad="GRAVE", max_intentos=2)
+    db.session.commit()
+
+    enviador.procesar_pendientes()
+    db.session.expire_all()
+    (correo,) = _estados().values()
+    assert (correo.estado, correo.intentos) == ("pendiente", 1)
+    assert db.session.get(Informe, informe.id_informe).estado_procesamiento == "pdf_generado"
+
+    _vencer_ventanas()
+    enviador.procesar_pendientes()
+    db.session.expire_all()
+    (correo,) = _estados().values()
+    assert (correo.estado, correo.intentos) == ("muerto", 2) and "451" in correo.ultimo_error
+    assert db.session.get(Informe, informe.id_informe).estado_procesamiento == "error"
+
+    # Reactivado a mano cuando el servidor vuelve a aceptar: sale y el informe queda notificado
+    manejador.ocupado = False
+    assert reactivar_muertos() == 1
+    assert enviador.procesar_pendientes() == 1
+    db.session.expire_all()
+    assert {c.estado for c in _estados().values()} == {"enviado"}
+    assert db.session.get(Informe, informe.id_informe).estado_procesamiento == "notificado"
+
+
+def test_informe_notificado_solo_cuando_salen_todos_sus_correos(app, buzon, enviador):
+    _, manejador = buzon
+    informe = _informe()
+    encolar_notificacion(["director@centro.test", "tutor@ocupado.test"], "Aviso", "Detalles",
+                         id_informe=informe.id_informe, gravedad="GRAVE")
+    db.session.commit()
+
+    enviador.procesar_pendientes()
+    db.session.expire_all()
+    # Uno enviado y otro reintentándose: aún no está notificado
+    assert db.session.get(Informe, informe.id_informe).estado_procesamiento == "pdf_generado"
+
+    manejador.ocupado = False
+    _vencer_ventanas()
+    assert enviador.procesar_pendientes() == 1
+    db.session.expire_all()
+    assert db.session.get(Informe, informe.id_informe).estado_procesamiento == "notificado"
@@ -0,0 +1,61 @@
+import os
+import zipfile
+
+import pytest
+
+from backend import exportacion
+from backend.models import db, Informe
+
+
+class PDFsFalsos:
+    """Sustituye al pool de dibujo: escribe un fichero por informe y puede fallar en un lote."""
+
+    def __init__(self, fallar_en=None):
+        self.llamadas = 0
+        self.fallar_en = fallar_en
+
+    def __call__(self, lista_argumentos, procesos=None, directorio=None):
+        self.llamadas += 1
+        if self.llamadas == self.fallar_en:
+            raise RuntimeError("proceso cortado a mitad de lote")
+        os.makedirs(directorio, exist_ok=True)
+        rutas = []
+        for argumentos in lista_argumentos:
+            ruta = os.path.join(directorio, argumentos["nombre_archivo"])
+            with open(ruta, "wb") as f:
+                f.write(b"%PDF-1.4 expediente " + str(argumentos["id_informe"]).encode())
+            rutas.append(ruta)
+        return rutas
+
+
+@pytest.fixture
+def informes(app):
+    filas = [Informe(tipo_bullying="Verbal", nivel_gravedad="LEVE", descripcion="Hechos")
+             for _ in range(5)]
+    db.session.add_all(filas)
+    db.session.commit()
+    return [f.id_informe for f in filas]
+
+
+def test_corte_a_mitad_de_lote_deja_un_zip_valido_y_se_reanuda(app, informes, tmp_path, monkeypatch):
+    salida = str(tmp_path / "inspeccion.zip")
+    monkeypatch.setattr(exportacion, "generar_pdfs_lote", PDFsFalsos(fallar_en=2))
+    with pytest.raises(RuntimeError):
+        exportacion.exportar_expedientes(salida, tamano_lote=2)
+
+    # El ZIP es el del primer lote completo y el estado apunta a él
+    with zipfile.ZipFile(salida) as archivo:
+        assert archivo.testzip() is None
+        assert len(archivo.namelist()) == 2
+    assert os.path.exists(salida + ".estado.json")
+    assert not os.path.exists(salida + ".tmp")
+
+    monkeypatch.setattr(exportacion, "generar_pdfs_lote", PDFsFalsos())
+    resumen = exportacion.exportar_expedientes(salida, tamano_lote=2)
+
+    assert resumen["exportados"] == 5 and resumen["fallidos"] == []
+    with zipfile.ZipFile(salida) as archivo:
+        nombres = archivo.namelist()
+    assert len(nombres) == len(set(nombres)) == 5
+    assert all(any(f"Expediente_{i}_" in n for n in nombres) for i in informes)
+    assert not os.path.exists(salida + ".estado.json")
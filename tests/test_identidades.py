@@ -0,0 +1,90 @@
+from sqlalchemy import insert, select
+
+from backend.auth.identidades import buscar_identidades, rellenar_indice_identidades
+from backend.models import db, Alumno, CentroEstudios, Director, Identidad, Profesor, Tutor, resolver_alumno
+
+
+def _identidades():
+    return {(i.rol, i.id_usuario): i for i in db.session.execute(select(Identidad)).scalars()}
+
+
+def test_altas_cambios_y_bajas_se_reflejan_en_el_indice(app):
+    alumno = Alumno(nombre_alumno="Lucía", email_alumno="  Lucia@Centro.test ", password_hash="h1")
+    director = Director(nombre_director="Dirección", email_director="dir@centro.test", password_hash="h2")
+    db.session.add_all([alumno, director, Profesor(nombre_profesor="Sin correo")])
+    db.session.commit()
+
+    indice = _identidades()
+    # El profesor sin email no entra: no podría iniciar sesión
+    assert set(indice) == {("alumno", alumno.id_alumno), ("director", director.id_director)}
+    assert indice[("alumno", alumno.id_alumno)].email == "lucia@centro.test"
+    assert indice[("alumno", alumno.id_alumno)].nombre == "Lucía"
+
+    alumno.email_alumno = "lucia.nueva@centro.test"
+    alumno.password_hash = "h3"
+    db.session.commit()
+    assert buscar_identidades("lucia@centro.test") == []
+    (identidad,) = buscar_identidades("LUCIA.NUEVA@centro.test")
+    assert (identidad.rol, identidad.id_usuario, identidad.password_hash) == ("alumno", alumno.id_alumno, "h3")
+
+    db.session.delete(director)
+    db.session.commit()
+    assert set(_identidades()) == {("alumno", alumno.id_alumno)}
+
+
+def test_email_en_varios_roles_sale_por_prioridad(app):
+    db.session.add_all([
+        Profesor(nombre_profesor="Ana", email_profesor="ana@centro.test", password_hash="p"),
+        Tutor(nombre_tutor="Ana", email_tutor="ana@centro.test", password_hash="t"),
+        Director(nombre_director="Ana", email_director="ana@centro.test", password_hash="d"),
+    ])
+    db.session.commit()
+
+    assert [i.rol for i in buscar_identidades("ana@centro.test")] == ["director", "tutor", "profesor"]
+
+
+def test_rellenar_recupera_las_cargas_que_no_pasan_por_el_orm(app):
+    db.session.add(Tutor(nombre_tutor="Tutora", email_tutor="tutora@centro.test", password_hash="t"))
+    db.session.commit()
+    # INSERT masivo (como generar_datos_sinteticos.py): sin eventos del ORM
+    db.session.execute(insert(Alumno), [
+        {"nombre_alumno": "Pau", "email_alumno": " PAU@centro.test", "password_hash": "a"},
+        {"nombre_alumno": "Sin correo", "email_alumno": "  ", "password_hash": "a"},
+    ])
+    db.session.commit()
+    assert buscar_identidades("pau@centro.test") == []
+
+    assert rellenar_indice_identidades() == 2
+    db.session.expire_all()
+    assert [i.rol for i in buscar_identidades("pau@centro.test")] == ["alumno"]
+    assert [i.rol for i in buscar_identidades("tutora@centro.test")] == ["tutor"]
+
+
+def test_resolver_alumno_trae_tutor_centro_y_director(app):
+    director = Director(nombre_director="Dirección", email_director="dir@centro.test")
+    tutor = Tutor(nombre_tutor="Tutora", email_tutor="tutora@centro.test")
+    db.session.add_all([director, tutor])
+    db.session.flush()
+    centro = CentroEstudios(denominacion_generica_es="IES", denominacion_especifica="Demo",
+                            id_director=director.id_director)
+    db.session.add(centro)
+    db.session.flush()
+    alumno = Alumno(nombre_alumno="Lucía", email_alumno="lucia@centro.test",
+                    id_tutor=tutor.id_tutor, id_centro_estudios=centro.id_centro_estudios)
+    huerfano = Alumno(nombre_alumno="Sin centro", email_alumno="solo@centro.test")
+    db.session.add_all([alumno, huerfano])
+    db.session.commit()
+
+    datos = resolver_alumno(email="lucia@centro.test")
+    assert datos == {
+        "id_alumno": alumno.id_alumno, "nombre_alumno": "Lucía",
+        "id_tutor": tutor.id_tutor, "nombre_tutor": "Tutora", "email_tutor": "tutora@centro.test",
+        "id_centro": centro.id_centro_estudios, "nombre_centro": "IES Demo",
+        "id_director": director.id_director, "nombre_director": "Dirección",
+        "email_director": "dir@centro.test",
+    }
+    assert resolver_alumno(id_alumno=alumno.id_alumno) == datos
+
+    sin_centro = resolver_alumno(id_alumno=huerfano.id_alumno)
+    assert sin_centro["id_tutor"] is None and sin_centro["id_centro"] is None
+    assert resolver_alumno(email="nadie@centro.test") is None
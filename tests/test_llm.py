@@ -0,0 +1,33 @@
+import threading
+
+from backend.llm import ClienteLLM, ModeloFalso
+
+CON_DATOS = "Devuelve JSON: Juan me pegó ayer en el patio"
+
+
+def test_respuestas_con_datos_del_alumno_no_se_guardan():
+    modelo = ModeloFalso(latencia=0.2)
+    cliente = ClienteLLM(modelo, nombre="prueba")
+
+    # Duplicados en vuelo (doble clic): una sola llamada
+    hilos = [threading.Thread(target=cliente.generate_content, args=(CON_DATOS,)) for _ in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    assert modelo.llamadas == 1
+    assert cliente.metricas()["agrupadas"] == 3
+
+    # Terminada la llamada no queda nada: la siguiente vuelve al modelo
+    assert cliente.metricas()["entradas_cache"] == 0
+    cliente.generate_content(CON_DATOS)
+    assert modelo.llamadas == 2
+
+
+def test_saludos_se_sirven_de_la_cache():
+    modelo = ModeloFalso()
+    cliente = ClienteLLM(modelo, nombre="prueba")
+    cliente.generate_content("hola")
+    cliente.generate_content("Hola!")
+    assert modelo.llamadas == 1
+    assert cliente.metricas()["aciertos"] == 1
@@ -0,0 +1,29 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from backend.metricas import registro
+from backend.models import db
+
+
+def _sentencias_select():
+    with registro._cerrojo:
+        return sum(datos[-1] for (nombre, etiquetas), datos in registro._histogramas.items()
+                   if nombre == "sayit_bd_consulta_segundos" and ("operacion", "SELECT") in etiquetas)
+
+
+def test_sentencia_fallida_no_deja_inicios_colgados(app):
+    conexion = db.session.connection()
+    antes = _sentencias_select()
+    with pytest.raises(OperationalError):
+        conexion.execute(text("SELECT * FROM tabla_que_no_existe"))
+    db.session.rollback()
+
+    conexion = db.session.connection()
+    for _ in range(3):
+        conexion.execute(text("SELECT 1"))
+
+    # Solo cuentan las que terminaron, y la conexión del pool no acumula nada
+    assert _sentencias_select() - antes == 3
+    assert "inicios_sql" not in conexion.connection.info
+    assert "inicios_sql" not in conexion.info
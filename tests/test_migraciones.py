@@ -0,0 +1,11 @@
+from backend.migraciones import MIGRACIONES, aplicar_migraciones, verificar_planes, version_actual
+
+
+def test_migraciones_llegan_a_la_ultima_version(app):
+    assert version_actual() == MIGRACIONES[-1][0]
+    # Idempotentes: volver a aplicarlas no cambia nada
+    assert aplicar_migraciones() == MIGRACIONES[-1][0]
+
+
+def test_consultas_calientes_usan_indices(app):
+    assert verificar_planes() == []
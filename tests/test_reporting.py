@@ -0,0 +1,54 @@
+import re
+
+import pytest
+from reportlab import rl_config
+
+from backend import reporting
+
+RESUMEN_LARGO = " ".join(f"palabra{n % 97}" for n in range(2500))
+
+
+@pytest.fixture
+def dibujos(monkeypatch):
+    """Cuenta cuántas veces se dibuja de verdad cada plantilla."""
+    reporting.preparar_plantillas()
+    llamadas = []
+    plantillas = tuple((nombre, lambda c, nombre=nombre, dibujar=dibujar: (llamadas.append(nombre), dibujar(c)))
+                       for nombre, dibujar in reporting.PLANTILLAS)
+    monkeypatch.setattr(reporting, "PLANTILLAS", plantillas)
+    monkeypatch.setattr(rl_config, "invariant", 1)  # sin fechas ni ids aleatorios: bytes comparables
+    return llamadas
+
+
+def _pdf(directorio, nombre):
+    ruta = reporting.generar_pdf_informe(
+        id_informe=7, fecha_reporte="01/06/2025 10:00",
+        datos_ia={"tipo_incidente": "Verbal", "nivel_gravedad": "GRAVE", "resumen_hechos": RESUMEN_LARGO},
+        nombre_centro="IES Demo", id_centro=1, id_director=1, nombre_director="Dirección",
+        id_docente=2, nombre_docente="Tutora", id_alumno=3, nombre_alumno="Alumno",
+        directorio=str(directorio), nombre_archivo=nombre)
+    assert ruta
+    with open(ruta, "rb") as f:
+        return f.read()
+
+
+def test_plantillas_se_reutilizan_sin_redibujar(tmp_path, dibujos):
+    contenido = _pdf(tmp_path, "reutilizado.pdf")
+
+    assert dibujos == []  # las operaciones salen de la caché del proceso
+    paginas = len(reporting.paginar(reporting.partir_lineas(RESUMEN_LARGO)))
+    assert paginas > 1
+    assert re.search(rb"/Count %d\b" % paginas, contenido)
+    assert len(re.findall(rb"/Subtype /Form\b", contenido)) == len(reporting.PLANTILLAS)
+
+
+def test_reutilizar_y_dibujar_dan_el_mismo_pdf(tmp_path, dibujos, monkeypatch):
+    reutilizado = _pdf(tmp_path, "reutilizado.pdf")
+
+    # Caché que no encaja con el lienzo: se vuelve a dibujar cada plantilla
+    operaciones, _, transparencias = reporting.preparar_plantillas()
+    monkeypatch.setattr(reporting, "_plantillas", (operaciones, {}, transparencias))
+    dibujado = _pdf(tmp_path, "dibujado.pdf")
+
+    assert dibujos == [nombre for nombre, _ in reporting.PLANTILLAS]
+    assert reutilizado == dibujado
@@ -0,0 +1,140 @@
+import json
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update
+
+from backend.cola import ColaTrabajos
+from backend.models import db, Informe, SesionChat, Trabajo, TurnoChat
+from backend.pipeline_informes import registrar_etapas
+from backend.sesiones_chat import (SESIONES_CHAT_RETENCION_HORAS, anadir_turno, cerrar_sesion,
+                                   purgar_sesiones, sesion_abierta, turnos_sesion)
+
+
+def test_turnos_simultaneos_no_se_pierden(app):
+    sesion = sesion_abierta(1, crear=True)
+    db.session.commit()
+    salida = threading.Barrier(8)
+
+    def turno(n):
+        with app.app_context():
+            salida.wait()
+            anadir_turno(sesion.id_sesion, f"mensaje {n}", f"respuesta {n}")
+
+    hilos = [threading.Thread(target=turno, args=(n,)) for n in range(8)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    numeros = db.session.execute(
+        select(TurnoChat.numero).where(TurnoChat.id_sesion == sesion.id_sesion)).scalars().all()
+    assert sorted(numeros) == list(range(1, 9))
+    db.session.expire_all()
+    assert db.session.get(SesionChat, sesion.id_sesion).turnos == 8
+
+
+def test_la_cola_no_guarda_la_conversacion(app, monkeypatch):
+    import backend.pipeline_informes as pipeline
+
+    recibido = []
+    analizar = pipeline.generar_reporte_riesgo
+    monkeypatch.setattr(pipeline, "generar_reporte_riesgo",
+                        lambda historial, estado=None: recibido.append(historial) or analizar(historial, estado))
+    sesion = sesion_abierta(1, crear=True)
+    db.session.commit()
+    anadir_turno(sesion.id_sesion, "Un compañero me pega en el patio", "Lo siento mucho.")
+    informe = Informe(estado_procesamiento="recibido")
+    db.session.add(informe)
+    db.session.flush()
+    cola = ColaTrabajos(app)
+    registrar_etapas(cola)
+    trabajo = cola.encolar("analisis", id_informe=informe.id_informe,
+                           carga={"id_sesion": sesion.id_sesion}, commit=False)
+    cerrar_sesion(sesion, informe.id_informe)
+    db.session.commit()
+
+    cola.procesar_pendientes(limite=1)
+
+    db.session.expire_all()
+    # El análisis lee la conversación de la sesión, no de la carga
+    assert recibido == [[("Un compañero me pega en el patio", "Lo siento mucho.")]]
+    assert db.session.get(Informe, informe.id_informe).estado_procesamiento == "analizado"
+    assert db.session.get(Trabajo, trabajo.id_trabajo).estado == "hecho"
+    assert "patio" not in db.session.get(Trabajo, trabajo.id_trabajo).carga
+
+
+def test_carga_del_navegador_se_borra_al_analizar(app):
+    informe = Informe(estado_procesamiento="recibido")
+    db.session.add(informe)
+    db.session.flush()
+    cola = ColaTrabajos(app)
+    registrar_etapas(cola)
+    trabajo = cola.encolar("analisis", id_informe=informe.id_informe,
+                           carga={"historial": [["Me insultan en clase", "Lo siento."]],
+                                  "estado": {"relato": ["Me", "insultan", "en", "clase"]}})
+
+    cola.procesar_pendientes(limite=1)
+
+    db.session.expire_all()
+    carga = json.loads(db.session.get(Trabajo, trabajo.id_trabajo).carga)
+    assert "historial" not in carga and "estado" not in carga
+
+
+def test_purga_borra_sesiones_y_trabajos_terminados(app):
+    sesion = sesion_abierta(1, crear=True)
+    db.session.commit()
+    id_sesion = sesion.id_sesion
+    anadir_turno(id_sesion, "mensaje", "respuesta")
+    cerrar_sesion(sesion, None)
+    antiguo = datetime.utcnow() - timedelta(hours=SESIONES_CHAT_RETENCION_HORAS + 1)
+    db.session.add_all([
+        Trabajo(tipo="analisis", carga='{"historial": []}', estado="hecho"),
+        Trabajo(tipo="analisis", carga='{"historial": []}', estado="fallido"),
+        Trabajo(tipo="pdf", carga="{}", estado="pendiente"),
+        Trabajo(tipo="pdf", carga="{}", estado="hecho"),  # reciente
+    ])
+    db.session.commit()
+    db.session.execute(update(SesionChat).values(actualizada=antiguo))
+    db.session.execute(update(Trabajo).where(Trabajo.id_trabajo.in_([1, 2, 3])).values(actualizado=antiguo))
+    db.session.commit()
+
+    assert purgar_sesiones() == {"sesiones": 1, "trabajos": 2}
+    assert turnos_sesion(id_sesion) == []
+    assert sorted(db.session.execute(select(Trabajo.estado)).scalars()) == ["hecho", "pendiente"]
+
+
+def test_purga_respeta_el_analisis_aun_pendiente(app, monkeypatch):
+    import backend.pipeline_informes as pipeline
+
+    recibido = []
+    monkeypatch.setattr(pipeline, "generar_reporte_riesgo",
+                        lambda historial, estado=None: recibido.append(historial) or {})
+    sesion = sesion_abierta(1, crear=True)
+    db.session.commit()
+    id_sesion = sesion.id_sesion
+    anadir_turno(id_sesion, "Me quitan el almuerzo", "Lo siento mucho.")
+    informe = Informe(estado_procesamiento="recibido")
+    db.session.add(informe)
+    db.session.flush()
+    cola = ColaTrabajos(app)
+    registrar_etapas(cola)
+    # Análisis que falló y espera su reintento más allá de la retención
+    trabajo = cola.encolar("analisis", id_informe=informe.id_informe,
+                           carga={"id_sesion": id_sesion}, commit=False)
+    cerrar_sesion(sesion, informe.id_informe)
+    db.session.commit()
+    antiguo = datetime.utcnow() - timedelta(hours=SESIONES_CHAT_RETENCION_HORAS + 1)
+    db.session.execute(update(SesionChat).values(actualizada=antiguo))
+    db.session.execute(update(Trabajo).values(intentos=1, disponible_en=antiguo))
+    db.session.commit()
+
+    assert purgar_sesiones()["sesiones"] == 0
+    cola.procesar_pendientes(limite=1)
+
+    db.session.expire_all()
+    assert recibido == [[("Me quitan el almuerzo", "Lo siento mucho.")]]
+    assert db.session.get(Trabajo, trabajo.id_trabajo).estado == "hecho"
+    # Analizado: ya se puede borrar
+    assert purgar_sesiones()["sesiones"] == 1
+    assert turnos_sesion(id_sesion) == []